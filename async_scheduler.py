@@ -0,0 +1,237 @@
+'''
+Asyncio scheduler that keeps many self-play games in flight on a few engines.
+
+Every game is a coroutine that borrows an idle engine for one move at a
+time, so while one game is in the opening book or extracting features the
+engines keep searching for the others. Each engine remembers its current
+Skill Level and is only reconfigured when a move needs a different one.
+'''
+import asyncio
+import collections
+import contextlib
+import itertools
+import time
+
+import chess
+import chess.engine
+import chess.pgn
+
+from dataset_generator import (Adjudicator, FeatureAccumulator, OPENING_BOOK_PATH, STOCKFISH_PATH, engine_command,
+                               evaluation_from_info, extract_features, game_rng, pick_skills, score_to_pawns, trajectory_features)
+from game_archive import game_record
+from opening_book import load_opening_book
+from stage_timing import NULL_TIMER, StageTimer
+
+MOVE_LIMIT = chess.engine.Limit(time=0.0001)
+
+
+class SchedulerStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.games = 0
+        self.plies = 0
+        self.engine_moves = 0
+        self.reconfigurations = 0
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        return (f"{self.games} games, {self.plies} plies in {elapsed:.1f}s: "
+                f"{self.games / elapsed:.2f} games/sec, {self.plies / elapsed:.1f} plies/sec, "
+                f"{self.reconfigurations} skill reconfigurations for {self.engine_moves} engine moves")
+
+
+class AsyncEnginePool:
+    """A fixed set of UCI engine processes shared by all running games."""
+
+    def __init__(self, size, stats, engine_path=None, eval_cache=None):
+        self.size = size
+        self.stats = stats
+        self.eval_cache = eval_cache
+        self.engine_path = engine_path or STOCKFISH_PATH
+        self.engines = []
+        self.skills = {}
+        self.idle = asyncio.Queue()
+
+    async def start(self):
+        for _ in range(self.size):
+            _, engine = await chess.engine.popen_uci(engine_command(self.engine_path))
+            self.engines.append(engine)
+            self.skills[engine] = None
+            self.idle.put_nowait(engine)
+
+    async def close(self):
+        for engine in self.engines:
+            with contextlib.suppress(chess.engine.EngineError, ConnectionError):
+                await engine.quit()
+
+    @contextlib.asynccontextmanager
+    async def engine(self, skill=None):
+        engine = await self.idle.get()
+        try:
+            if skill is not None and self.skills[engine] != skill:
+                await engine.configure({"Skill Level": skill})
+                self.skills[engine] = skill
+                self.stats.reconfigurations += 1
+            yield engine
+        finally:
+            self.idle.put_nowait(engine)
+
+    async def play(self, board, skill, info=chess.engine.INFO_NONE):
+        """Returns the engine's PlayResult for 'board' at 'skill'."""
+        async with self.engine(skill) as engine:
+            self.stats.engine_moves += 1
+            return await engine.play(board, MOVE_LIMIT, info=info)
+
+    async def evaluate(self, board, depth):
+        if self.eval_cache is not None:
+            score = self.eval_cache.get(board, depth)
+            if score is not None:
+                return score
+        async with self.engine() as engine:
+            score = evaluation_from_info(await engine.analyse(board, chess.engine.Limit(depth=depth)))
+        if score is None:
+            # As in get_evaluation_score: 0 for this game, nothing cached
+            return 0
+        if self.eval_cache is not None:
+            self.eval_cache.put(board, depth, score)
+        return score
+
+
+async def play_game_async(pool, book, white_skill, black_skill, rng=None, accumulator=None, timer=None, scores=None,
+                          adjudication=None):
+    """Coroutine version of dataset_generator.play_game on an AsyncEnginePool.
+
+    The engine stages of 'timer' include the wait for an idle engine.
+    """
+    timer = timer or NULL_TIMER
+    board = chess.Board()
+    moves = []
+    eval_after_move_15 = None
+    book_plies = 0
+    info = chess.engine.INFO_NONE if scores is None and adjudication is None else chess.engine.INFO_SCORE
+    adjudicator = Adjudicator(adjudication) if adjudication is not None else None
+    verdict = None
+    score = None
+
+    while not board.is_game_over():
+        if adjudicator is not None:
+            verdict = adjudicator.update(board, score)
+            if verdict is not None:
+                break
+        score = None
+        skill = white_skill if len(moves) % 2 == 0 else black_skill
+        move = None
+        if len(moves) < 7: # Length of opening
+            try:
+                with timer.stage('book'):
+                    move = book.choice(board, random=rng).move
+                book_plies += 1
+            except IndexError:
+                pass
+        if move is None:
+            with timer.stage('engine_play'):
+                result = await pool.play(board, skill, info)
+            move = result.move
+            if 'score' in result.info:
+                score = score_to_pawns(result.info['score'])
+                if scores is not None:
+                    scores[len(moves)] = score
+
+        if accumulator is not None:
+            with timer.stage('features'):
+                accumulator.push(board, move)
+        else:
+            board.push(move)
+        moves.append(move)
+
+        if len(moves) == 15:
+            with timer.stage('analysis'):
+                eval_after_move_15 = await pool.evaluate(board, 12)
+
+    game = chess.pgn.Game.from_board(board)
+    game.headers["Result"] = board.result()
+    game.headers["BookPlies"] = str(book_plies)
+    if verdict is not None:
+        game.headers["Result"], game.headers["Adjudication"] = verdict
+        played_result = None
+        if adjudication.audit:
+            played_result = await play_out_async(pool, board, white_skill, black_skill, timer)
+        timer.adjudicated(verdict[1], verdict[0], played_result)
+    return game, board, moves, eval_after_move_15
+
+
+async def play_out_async(pool, board, white_skill, black_skill, timer):
+    """Coroutine version of dataset_generator.play_out."""
+    board = board.copy()
+    while not board.is_game_over():
+        with timer.stage('saved_engine_play'):
+            result = await pool.play(board, white_skill if board.turn == chess.WHITE else black_skill)
+        board.push(result.move)
+    return board.result()
+
+
+async def generate_game_async(pool, book, seed, game_index, asymmetric=False, timings=None, archive=False, trajectory_plies=(),
+                              adjudication=None):
+    """Coroutine version of dataset_generator.generate_game; returns a (row, archive record) pair."""
+    rng = game_rng(seed, game_index)
+    white_skill, black_skill = pick_skills(rng, asymmetric)
+    accumulator = FeatureAccumulator(evaluation_interval=3)
+    timer = StageTimer() if timings is not None else NULL_TIMER
+    scores = {} if trajectory_plies else None
+    game, board, moves, eval_after_move_15 = await play_game_async(pool, book, white_skill, black_skill, rng=rng,
+                                                                   accumulator=accumulator, timer=timer, scores=scores,
+                                                                   adjudication=adjudication)
+    result = game.headers["Result"]
+    pool.stats.games += 1
+    pool.stats.plies += len(moves)
+    timer.plies = len(moves)
+    with timer.stage('features'):
+        row = extract_features(game, board, moves, white_skill, black_skill, eval_after_move_15, accumulator=accumulator,
+                               result=result)
+        if trajectory_plies:
+            row.update(trajectory_features(scores, trajectory_plies, board))
+        if adjudication is not None:
+            row['adjudication'] = game.headers.get("Adjudication", 'none')
+    if timings is not None:
+        timings.record(game_index, timer.as_dict())
+    record = None
+    if archive:
+        record = game_record(seed, game_index, white_skill, black_skill, moves, result, eval_after_move_15,
+                             int(game.headers["BookPlies"]))
+    return row, record
+
+
+def generate_rows_async(game_indices, seed, engines, in_flight=16, engine_path=None, asymmetric=False, eval_cache=None,
+                        timings=None, archive=False, trajectory_plies=(), adjudication=None):
+    """Yields (feature row, archive record) pairs in game order while up to 'in_flight' games share 'engines' engine processes."""
+    loop = asyncio.new_event_loop()
+    stats = SchedulerStats()
+    pool = AsyncEnginePool(engines, stats, engine_path, eval_cache)
+    pending = collections.deque()
+    try:
+        loop.run_until_complete(pool.start())
+        with load_opening_book(OPENING_BOOK_PATH) as book:
+            def start(game_index):
+                return loop.create_task(generate_game_async(pool, book, seed, game_index, asymmetric, timings, archive,
+                                                            trajectory_plies, adjudication))
+
+            game_indices = iter(game_indices)
+            # Keep a window of 'in_flight' games running and hand them out in order
+            for game_index in itertools.islice(game_indices, in_flight):
+                pending.append(start(game_index))
+            while pending:
+                result = loop.run_until_complete(pending.popleft())
+                for game_index in itertools.islice(game_indices, 1):
+                    pending.append(start(game_index))
+                yield result
+    finally:
+        loop.run_until_complete(_shutdown(pool, pending))
+        loop.close()
+        print(stats.report())
+
+
+async def _shutdown(pool, pending):
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    await pool.close()
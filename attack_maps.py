@@ -0,0 +1,127 @@
+'''
+Bitboard attack maps used by the piece activity and center control features.
+
+attack_mask builds the set of squares one side attacks in a single position.
+game_attack_counts does the same for every position of a game at once, with
+the attack generation vectorized over the plies in NumPy.
+'''
+import chess
+import numpy as np
+
+
+def attack_mask(board, color):
+    """Returns the bitboard of squares attacked by 'color'."""
+    mask = 0
+    for square in chess.scan_forward(board.occupied_co[color]):
+        mask |= board.attacks_mask(square)
+    return mask
+
+
+def attack_counts(board):
+    """Returns (white_activity, black_activity, white_center, black_center) for one position."""
+    white_mask = attack_mask(board, chess.WHITE)
+    black_mask = attack_mask(board, chess.BLACK)
+    return (chess.popcount(white_mask), chess.popcount(black_mask),
+            chess.popcount(white_mask & chess.BB_CENTER), chess.popcount(black_mask & chess.BB_CENTER))
+
+
+# Destination masks that stop shifted bitboards from wrapping around the board edge
+_NOT_A = np.uint64(~chess.BB_FILE_A & chess.BB_ALL)
+_NOT_H = np.uint64(~chess.BB_FILE_H & chess.BB_ALL)
+_NOT_AB = np.uint64(~(chess.BB_FILE_A | chess.BB_FILE_B) & chess.BB_ALL)
+_NOT_GH = np.uint64(~(chess.BB_FILE_G | chess.BB_FILE_H) & chess.BB_ALL)
+_ALL = np.uint64(chess.BB_ALL)
+_CENTER = np.uint64(chess.BB_CENTER)
+
+# (shift, destination mask) per direction; positive shifts go towards rank 8
+_ROOK_DIRECTIONS = [(8, _ALL), (-8, _ALL), (1, _NOT_A), (-1, _NOT_H)]
+_BISHOP_DIRECTIONS = [(9, _NOT_A), (7, _NOT_H), (-7, _NOT_A), (-9, _NOT_H)]
+_KING_DIRECTIONS = _ROOK_DIRECTIONS + _BISHOP_DIRECTIONS
+_KNIGHT_DIRECTIONS = [(17, _NOT_A), (15, _NOT_H), (10, _NOT_AB), (6, _NOT_GH),
+                      (-6, _NOT_AB), (-10, _NOT_GH), (-15, _NOT_A), (-17, _NOT_H)]
+
+
+def _shift(bb, shift):
+    if shift > 0:
+        return bb << np.uint64(shift)
+    return bb >> np.uint64(-shift)
+
+
+def _step_attacks(bb, directions):
+    attacks = np.zeros_like(bb)
+    for shift, mask in directions:
+        attacks |= _shift(bb, shift) & mask
+    return attacks
+
+
+def _slider_attacks(sliders, empty, directions):
+    # Kogge-Stone occluded fill: each direction floods the sliders through
+    # empty squares in three doubling steps, then steps once more onto the blocker
+    attacks = np.zeros_like(sliders)
+    for shift, mask in directions:
+        gen = sliders
+        pro = empty & mask
+        gen = gen | (pro & _shift(gen, shift))
+        pro = pro & _shift(pro, shift)
+        gen = gen | (pro & _shift(gen, 2 * shift))
+        pro = pro & _shift(pro, 2 * shift)
+        gen = gen | (pro & _shift(gen, 4 * shift))
+        attacks |= _shift(gen, shift) & mask
+    return attacks
+
+
+def _popcount(bb):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bb).astype(np.int64)
+    return np.unpackbits(bb.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1, dtype=np.int64)
+
+
+def _side_attacks(pieces, empty, color):
+    pawns, knights, diagonal, straight, kings = pieces
+    if color == chess.WHITE:
+        attacks = _step_attacks(pawns, [(9, _NOT_A), (7, _NOT_H)])
+    else:
+        attacks = _step_attacks(pawns, [(-7, _NOT_A), (-9, _NOT_H)])
+    attacks |= _step_attacks(knights, _KNIGHT_DIRECTIONS)
+    attacks |= _step_attacks(kings, _KING_DIRECTIONS)
+    attacks |= _slider_attacks(diagonal, empty, _BISHOP_DIRECTIONS)
+    attacks |= _slider_attacks(straight, empty, _ROOK_DIRECTIONS)
+    return attacks
+
+
+def position_bitboards(moves, board=None):
+    """Returns a (plies, 2, 5) uint64 array with the piece bitboards after every move.
+
+    The five bitboards per side are pawns, knights, bishops and queens,
+    rooks and queens, and the king.
+    """
+    board = chess.Board() if board is None else board
+    rows = []
+    for move in moves:
+        board.push(move)
+        queens = board.queens
+        row = []
+        for color in chess.COLORS:
+            own = board.occupied_co[color]
+            row.append((board.pawns & own, board.knights & own, (board.bishops | queens) & own,
+                        (board.rooks | queens) & own, board.kings & own))
+        rows.append(row)
+    return np.array(rows, dtype=np.uint64).reshape(-1, 2, 5)
+
+
+def game_attack_counts(moves, board=None):
+    """Counts the attacked squares after every move of a game.
+
+    Returns four int arrays of length len(moves): white and black piece
+    activity, then white and black center control.
+    """
+    bitboards = position_bitboards(moves, board)
+    white = tuple(bitboards[:, 0, i] for i in range(5))
+    black = tuple(bitboards[:, 1, i] for i in range(5))
+    occupied = np.bitwise_or.reduce(bitboards.reshape(len(bitboards), 10), axis=1)
+    empty = ~occupied
+
+    white_mask = _side_attacks(white, empty, chess.WHITE)
+    black_mask = _side_attacks(black, empty, chess.BLACK)
+    return (_popcount(white_mask), _popcount(black_mask),
+            _popcount(white_mask & _CENTER), _popcount(black_mask & _CENTER))
@@ -0,0 +1,386 @@
+'''
+Throughput benchmark of the dataset generator.
+
+Every stage of generating a row is timed on its own, over recorded games
+so the numbers do not depend on what an engine happens to play:
+book lookups, engine round trips against fake_uci_engine.py, each feature
+function that extract_features relies on, and the CSV write. On top of the
+stages, whole games are generated end to end with the scripted engine to
+get games/sec, and the import time of each entry point is measured in a
+fresh interpreter.
+
+Per-game latency percentiles are compared with a stored baseline and the
+run fails when a stage got slower than the tolerance allows. A fixed
+calibration workload is timed alongside the stages of every run, and
+stages are stored and compared as multiples of it, so a baseline
+recorded on one machine holds on a faster or slower one. Stages too fast
+for the noise floor can have a budget instead, a ceiling on those
+multiples under 'budgets' in the baseline, which recording the baseline
+again keeps.
+
+    python benchmark.py --save-baseline   # record benchmarks/baseline.json
+    python benchmark.py                   # compare against it
+    python benchmark.py --record 50       # re-record the move lists
+'''
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import chess
+import chess.engine
+import numpy as np
+
+import dataset_generator
+from dataset_generator import (FIELDNAMES, average_piece_evaluation, calculate_piece_activity, control_of_center,
+                               count_sacrifices, extract_features, game_rng, generate_game, has_castled,
+                               opening_classifier, opposite_side_castling, pick_skills, play_game, start_engine)
+from opening_book import load_opening_book
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RECORDED_GAMES_PATH = os.path.join(HERE, 'benchmarks', 'recorded_games.json')
+BASELINE_PATH = os.path.join(HERE, 'benchmarks', 'baseline.json')
+FAKE_ENGINE_PATH = os.path.join(HERE, 'fake_uci_engine.py')
+DEFAULT_BOOK_PATH = os.path.join(HERE, 'opening_books', 'gm2001.bin')
+
+PERCENTILES = (50, 90, 99)
+# Percentiles a regression is judged on
+COMPARED_PERCENTILES = (50, 90)
+# Stage latencies below this many milliseconds are too noisy to flag
+NOISE_FLOOR_MS = 0.05
+# Same limits as play_game
+MOVE_LIMIT = chess.engine.Limit(time=0.0001)
+EVAL_DEPTH = 12
+BOOK_PLIES = 7
+# Entry points whose import time every CLI run and pool worker start pays
+IMPORT_MODULES = ('dataset_generator', 'extract', 'predict', 'main')
+# Plies of the calibration game, some 5 ms of move generation
+CALIBRATION_PLIES = 60
+
+
+def record_games(engine_path, count, seed):
+    """Plays 'count' games on the scripted engine and returns their move lists."""
+    engine = start_engine(engine_path)
+    games = []
+    try:
+        for game_index in range(count):
+            rng = game_rng(seed, game_index)
+            white_skill, black_skill = pick_skills(rng)
+            _, _, moves, _ = play_game(engine, white_skill, black_skill, rng=rng)
+            games.append({'game_index': game_index, 'white_skill': white_skill, 'black_skill': black_skill,
+                          'moves': [move.uci() for move in moves]})
+    finally:
+        engine.quit()
+    return {'seed': seed, 'games': games}
+
+
+def load_recorded_games(path):
+    with open(path) as file:
+        recorded = json.load(file)
+    for game in recorded['games']:
+        game['moves'] = [chess.Move.from_uci(uci) for uci in game['moves']]
+    return recorded
+
+
+def positions(moves):
+    """Yields the board before every move of a game, with the move played from it."""
+    board = chess.Board()
+    for move in moves:
+        yield board, move
+        board.push(move)
+
+
+def stage_book_lookup(game, book, rng):
+    for board, _ in positions(game['moves'][:BOOK_PLIES]):
+        try:
+            book.choice(board, random=rng)
+        except IndexError:
+            pass
+
+
+def stage_engine_play(game, engine):
+    for ply, (board, _) in enumerate(positions(game['moves'])):
+        if ply >= BOOK_PLIES:
+            engine.play(board, MOVE_LIMIT)
+
+
+def stage_engine_analyse(game, engine):
+    board = chess.Board()
+    for move in game['moves'][:15]:
+        board.push(move)
+    engine.analyse(board, chess.engine.Limit(depth=EVAL_DEPTH))
+
+
+def final_board(moves):
+    board = chess.Board()
+    for move in moves:
+        board.push(move)
+    return board
+
+
+def feature_stages(game):
+    """Returns the feature functions of one game as (stage name, callable) pairs."""
+    moves = game['moves']
+    parsed_moves = ' '.join(str(move) for move in moves)
+    board = final_board(moves)
+    return [
+        ('opening', lambda: opening_classifier().classify(moves)),
+        ('sacrifices', lambda: count_sacrifices(board.copy())),
+        ('center_control', lambda: control_of_center(moves)),
+        ('piece_activity', lambda: calculate_piece_activity(moves)),
+        ('knight_to_bishop', lambda: average_piece_evaluation(moves, 3)),
+        ('castling', lambda: (has_castled(parsed_moves, True), has_castled(parsed_moves, False),
+                              opposite_side_castling(parsed_moves))),
+        ('extract_features', lambda: extract_features(None, board, moves, game['white_skill'], game['black_skill'], 0.0)),
+    ]
+
+
+def calibration_workload():
+    """Fixed python-chess work like the feature functions do: a seeded random
+    game, generating the legal moves and checking each for a capture every ply."""
+    rng = random.Random(0)
+    board = chess.Board()
+    for _ in range(CALIBRATION_PLIES):
+        moves = list(board.legal_moves)
+        for move in moves:
+            board.is_capture(move)
+        board.push(moves[rng.randrange(len(moves))])
+
+
+def time_call(function):
+    started = time.perf_counter()
+    function()
+    return (time.perf_counter() - started) * 1000
+
+
+def calibrate(repeat):
+    """Milliseconds calibration_workload takes right now, the fastest of 'repeat' runs."""
+    return min(time_call(calibration_workload) for _ in range(repeat))
+
+
+def run_stages(recorded, engine, book, repeat):
+    """Returns the per-game latencies in milliseconds of every stage, and
+    the median calibration time before the games.
+
+    Each game keeps its fastest of 'repeat' runs, which filters out
+    scheduler noise without hiding real slowdowns.
+    """
+    latencies = {}
+    calibrations = []
+
+    def record(stage, function):
+        best = min(time_call(function) for _ in range(repeat))
+        latencies.setdefault(stage, []).append(best)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'benchmark.csv')
+        with open(csv_path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=FIELDNAMES)
+            writer.writeheader()
+            for game in recorded['games']:
+                rng = game_rng(recorded['seed'], game['game_index'])
+                calibrations.append(calibrate(repeat))
+                record('book_lookup', lambda: stage_book_lookup(game, book, rng))
+                record('engine_play', lambda: stage_engine_play(game, engine))
+                record('engine_analyse', lambda: stage_engine_analyse(game, engine))
+                for stage, function in feature_stages(game):
+                    record(stage, function)
+                row = extract_features(None, final_board(game['moves']), game['moves'],
+                                       game['white_skill'], game['black_skill'], 0.0)
+                record('csv_write', lambda: (writer.writerow(row), file.flush()))
+    return latencies, float(np.median(calibrations))
+
+
+def run_end_to_end(engine, seed, games, repeat):
+    """Generates 'games' full games and returns their latencies, the games/sec
+    and the median calibration time before the games."""
+    latencies = []
+    calibrations = []
+    for game_index in range(games):
+        calibrations.append(calibrate(repeat))
+        latencies.append(time_call(lambda: generate_game(engine, seed, game_index)))
+    return latencies, games / (sum(latencies) / 1000), float(np.median(calibrations))
+
+
+def time_import(module):
+    """Milliseconds a fresh interpreter spends importing 'module', on top of starting up.
+
+    STOCKFISH_PATH is unset, so an import that starts an engine fails.
+    """
+    env = {name: value for name, value in os.environ.items() if name != 'STOCKFISH_PATH'}
+
+    def run(code):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=HERE, env=env, check=True)
+        return (time.perf_counter() - started) * 1000
+
+    return max(0.0, run(f'import {module}') - run('pass'))
+
+
+def run_imports(repeat):
+    """Returns 'repeat' import times of every module in IMPORT_MODULES, by
+    stage name, and the median calibration time before the modules."""
+    latencies = {}
+    calibrations = []
+    for module in IMPORT_MODULES:
+        calibrations.append(calibrate(repeat))
+        latencies[f'import_{module}'] = [time_import(module) for _ in range(repeat)]
+    return latencies, float(np.median(calibrations))
+
+
+def summarize(latencies, calibration_ms):
+    """Percentiles and mean of 'latencies' in milliseconds, and the compared percentiles as multiples of 'calibration_ms'."""
+    values = np.asarray(latencies)
+    summary = {f'p{percentile}_ms': round(float(np.percentile(values, percentile)), 4) for percentile in PERCENTILES}
+    summary['mean_ms'] = round(float(values.mean()), 4)
+    for percentile in COMPARED_PERCENTILES:
+        summary[f'p{percentile}_ratio'] = float(f"{np.percentile(values, percentile) / calibration_ms:.4g}")
+    return summary
+
+
+def compare(results, baseline, tolerance):
+    """Returns a description of every stage that regressed against 'baseline'.
+
+    Stages are compared as multiples of the calibration time of their own
+    run; the noise floor applies to milliseconds on this machine.
+    """
+    regressions = []
+    for stage, summary in results['stages'].items():
+        reference = baseline['stages'].get(stage)
+        if reference is None:
+            continue
+        for percentile in COMPARED_PERCENTILES:
+            key = f'p{percentile}_ratio'
+            current, expected = summary[key], reference[key]
+            if current <= expected * (1 + tolerance):
+                continue
+            current_ms = summary[f'p{percentile}_ms']
+            # The baseline in milliseconds at the calibration time this stage ran with
+            expected_ms = current_ms * expected / current
+            if current_ms - expected_ms > NOISE_FLOOR_MS:
+                regressions.append(f"{stage} p{percentile}: {current:.4g}x vs baseline {expected:.4g}x the calibration "
+                                   f"({current_ms:.3f} ms, baseline {expected_ms:.3f} ms here)")
+    for stage, budget in baseline.get('budgets', {}).items():
+        summary = results['stages'].get(stage)
+        if summary is None:
+            continue
+        for key, limit in budget.items():
+            current = summary[key]
+            if current > limit:
+                percentile = key.split('_')[0]
+                limit_ms = summary[f'{percentile}_ms'] * limit / current
+                regressions.append(f"{stage} {percentile}: {current:.4g}x the calibration is over its budget of "
+                                   f"{limit:.4g}x ({summary[f'{percentile}_ms']:.3f} ms, budget {limit_ms:.3f} ms here)")
+    current, expected = results['games_per_calibration'], baseline['games_per_calibration']
+    if current < expected / (1 + tolerance):
+        regressions.append(f"games/sec: {results['games_per_sec']:.2f} vs baseline "
+                           f"{results['games_per_sec'] * expected / current:.2f} here")
+    return regressions
+
+
+def print_report(results):
+    print(f"{'stage':<26}" + ''.join(f"{f'p{p} ms':>10}" for p in PERCENTILES) + f"{'mean ms':>10}{'p50 x':>10}")
+    for stage, summary in results['stages'].items():
+        print(f"{stage:<26}" + ''.join(f"{summary[f'p{p}_ms']:>10.3f}" for p in PERCENTILES)
+              + f"{summary['mean_ms']:>10.3f}{summary['p50_ratio']:>10.4g}")
+    print(f"{results['games_per_sec']:.2f} games/sec end to end over {results['games']} games")
+    calibrations = ', '.join(f"{ms:.2f} ms {phase}" for phase, ms in results['calibration_ms'].items())
+    print(f"Calibration: {calibrations}; 'x' columns are multiples of it")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the dataset generator stage by stage.')
+    parser.add_argument('--engine', default=FAKE_ENGINE_PATH, help='UCI engine to time round trips against')
+    parser.add_argument('--book', default=dataset_generator.OPENING_BOOK_PATH or DEFAULT_BOOK_PATH, help='Polyglot opening book')
+    parser.add_argument('--games', type=int, default=None, help='Recorded games to time (default: all of them)')
+    parser.add_argument('--end-to-end-games', type=int, default=20, help='Games generated end to end for games/sec')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per game and stage; the fastest one counts')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='Baseline JSON to compare against or save')
+    parser.add_argument('--save-baseline', action='store_true', help='Write the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown against the baseline')
+    parser.add_argument('--record', type=int, metavar='GAMES', default=None, help='Re-record the move lists with GAMES games first')
+    parser.add_argument('--seed', type=int, default=7, help='Seed of recorded and end to end games')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # play_game reads the book path from the module
+    dataset_generator.OPENING_BOOK_PATH = args.book
+
+    if args.record is not None:
+        recorded = record_games(args.engine, args.record, args.seed)
+        os.makedirs(os.path.dirname(RECORDED_GAMES_PATH), exist_ok=True)
+        with open(RECORDED_GAMES_PATH, 'w') as file:
+            json.dump(recorded, file, indent=1)
+        print(f"Recorded {args.record} games to {RECORDED_GAMES_PATH}")
+
+    recorded = load_recorded_games(RECORDED_GAMES_PATH)
+    recorded['games'] = recorded['games'][:args.games]
+    book = load_opening_book(args.book)
+    # Load the opening table outside the timed stages
+    opening_classifier()
+
+    # Every phase is calibrated as it runs, so a machine whose speed drifts
+    # between phases does not skew the ratios of the later ones
+    engine = start_engine(args.engine)
+    try:
+        stages, stages_calibration = run_stages(recorded, engine, book, args.repeat)
+        game_latencies, games_per_sec, games_calibration = run_end_to_end(engine, args.seed, args.end_to_end_games,
+                                                                          args.repeat)
+    finally:
+        engine.quit()
+    imports, imports_calibration = run_imports(args.repeat)
+    phases = [(stages, stages_calibration), ({'end_to_end': game_latencies}, games_calibration),
+              (imports, imports_calibration)]
+
+    results = {
+        'machine': platform.node(),
+        'python': platform.python_version(),
+        'engine': os.path.basename(args.engine),
+        'calibration_ms': {'stages': round(stages_calibration, 3), 'end_to_end': round(games_calibration, 3),
+                           'imports': round(imports_calibration, 3)},
+        'games': args.end_to_end_games,
+        'games_per_sec': round(games_per_sec, 3),
+        'games_per_calibration': float(f"{games_per_sec * games_calibration / 1000:.4g}"),
+        'stages': {stage: summarize(latencies, calibration_ms)
+                   for phase, calibration_ms in phases for stage, latencies in phase.items()},
+    }
+    print_report(results)
+
+    if args.save_baseline:
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                budgets = json.load(file).get('budgets')
+            if budgets:
+                results['budgets'] = budgets
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=1)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if 'calibration_ms' not in baseline:
+        print(f"{args.baseline} predates calibrated baselines; record it again with --save-baseline")
+        return 1
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        return 1
+    print(f"No regressions beyond {args.tolerance:.0%} of the baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
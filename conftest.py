@@ -0,0 +1,27 @@
+# Lets tests/ import the top-level modules when run with a bare `pytest`
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def engine_env():
+    """Environment that runs the generator on fake_uci_engine.py instead of Stockfish."""
+    env = dict(os.environ)
+    env['STOCKFISH_PATH'] = os.path.join(ROOT, 'fake_uci_engine.py')
+    env['OPENING_BOOK_PATH'] = os.path.join(ROOT, 'opening_books', 'gm2001.bin')
+    env.pop('ECO_TABLE_PATH', None)
+    return env
+
+
+@pytest.fixture
+def run_script(engine_env):
+    """Runs one of the repo's scripts on the fake engine and returns the finished process."""
+    def run(script, *args, **kwargs):
+        return subprocess.run([sys.executable, os.path.join(ROOT, script), *map(str, args)], env=engine_env, cwd=ROOT,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, check=True, **kwargs)
+    return run
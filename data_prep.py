@@ -1,10 +1,20 @@
+import collections
+import contextlib
+import os
+import tracemalloc
+import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import LabelEncoder, StandardScaler
-from imblearn.over_sampling import SMOTE
-from sklearn.impute import SimpleImputer
 
-def load_data(filepath):
+def load_data(filepath, columns=None, filters=None):
+    """Loads the games dataset from a CSV file or a Parquet dataset.
+
+    For Parquet only 'columns' are read, and 'filters' such as
+    [('white_skill', '>=', 15)] are applied while reading.
+    """
+    if filepath.endswith('.parquet') or os.path.isdir(filepath):
+        from parquet_io import read_dataset
+        return read_dataset(filepath, columns=columns, filters=filters)
+
     try:
         # Try reading with default UTF-8 first
         return pd.read_csv(filepath)
@@ -12,25 +22,102 @@ def load_data(filepath):
         # If UTF-8 fails, try using a different encoding
         return pd.read_csv(filepath, encoding='ISO-8859-1')
 
-def preprocess_data(df):
+def iter_chunks(filepath, chunksize=100_000, columns=None):
+    """Yields the games dataset as DataFrames of at most 'chunksize' rows.
+
+    Row labels keep counting across chunks, so every row keeps the same
+    label whatever the chunk size.
+    """
+    if filepath.endswith('.parquet') or os.path.isdir(filepath):
+        from parquet_io import iter_batches
+        yield from iter_batches(filepath, chunksize, columns=columns)
+        return
+    yield from pd.read_csv(filepath, chunksize=chunksize, usecols=columns, encoding=_csv_encoding(filepath))
+
+def _csv_encoding(filepath, sample_size=1 << 20):
+    # Same fallback as load_data, decided on the start of the file since
+    # chunks cannot be re-read with another encoding halfway through
+    with open(filepath, 'rb') as file:
+        sample = file.read(sample_size)
+    try:
+        sample.decode('utf-8')
+    except UnicodeDecodeError as error:
+        # A multi-byte character cut off by the end of the sample is fine
+        if error.start < len(sample) - 3:
+            return 'ISO-8859-1'
+    return 'utf-8'
+
+# Columns standardized by preprocess_data
+FEATURES = ['total_moves', 'opening', 'white_skill', 'black_skill', 'white_castled', 'black_castled', 'opposite_side_castle', 'white_sacrifices', 'black_sacrifices', 'w_knight_to_bishop', 'b_knight_to_bishop', 'white_piece_activity', 'black_piece_activity', 'eval_after_move_15']
+
+# Columns that are not model inputs: both give the result away
+DROPPED_COLUMNS = ['winner', 'adjudication']
+
+def preprocess_data(df, return_preprocessor=False):
+    """Encodes and scales the dataset in place.
+
+    With 'return_preprocessor' the fitted encoder and scaler come back too,
+    as a Preprocessor that prepares new rows the same way.
+    """
 
     # Drop rows with any missing values in order to fit for SMOTE
     df.dropna(inplace=True)
 
         # Drop the 'winner' column 
-    df.drop(columns=['winner'], inplace=True)
+    df.drop(columns=[column for column in DROPPED_COLUMNS if column in df], inplace=True)
 
     #df['winner'] = LabelEncoder().fit_transform(df['winner'])  # Assuming 'winner' is the problematic column
 
-    df['opening'] = LabelEncoder().fit_transform(df['opening'])
+    from sklearn.preprocessing import LabelEncoder, StandardScaler
+    opening_encoder = LabelEncoder()
+    df['opening'] = opening_encoder.fit_transform(df['opening'])
 
-    features = ['total_moves', 'opening', 'white_skill', 'black_skill', 'white_castled', 'black_castled', 'opposite_side_castle', 'white_sacrifices', 'black_sacrifices', 'w_knight_to_bishop', 'b_knight_to_bishop', 'white_piece_activity', 'black_piece_activity', 'eval_after_move_15']
-    
-    
+    # Datasets from before a feature was added lack its column
+    features = [feature for feature in FEATURES if feature in df]
     scaler = StandardScaler()
     df[features] = scaler.fit_transform(df[features])
+    if return_preprocessor:
+        return df, Preprocessor(opening_encoder, scaler, [column for column in df.columns if column != 'result'], features)
     return df
 
+
+# Bumped whenever Preprocessor.transform changes what it does to a row
+PREPROCESSOR_VERSION = 2
+
+class Preprocessor:
+    """The fitted opening encoder and scaler of preprocess_data, saved with a model.
+
+    transform prepares new feature rows, e.g. at prediction time, exactly
+    like the rows the model was trained on.
+    """
+    version = PREPROCESSOR_VERSION
+
+    def __init__(self, opening_encoder, scaler, columns, features=FEATURES):
+        self.opening_encoder = opening_encoder
+        self.opening_codes = {opening: code for code, opening in enumerate(opening_encoder.classes_)}
+        self.scaler = scaler
+        self.columns = list(columns)
+        # The scaled columns, in the scaler's order
+        self.features = list(features)
+        self.scaled = [self.columns.index(feature) for feature in self.features]
+
+    def transform(self, df):
+        """Returns the model input of the feature rows in 'df', which may include 'result' and 'winner'.
+
+        Unknown openings get their own code, as in StreamingPreprocessor,
+        and missing values count as the training mean. Works on one numpy
+        array rather than column by column, so small batches stay cheap.
+        """
+        X = np.full((len(df), len(self.columns)), np.nan)
+        for i, column in enumerate(self.columns):
+            if column == 'opening':
+                X[:, i] = df['opening'].map(self.opening_codes).fillna(-1) if 'opening' in df else -1
+            elif column in df:
+                X[:, i] = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float)
+        # Same arithmetic as StandardScaler.transform
+        X[:, self.scaled] = (X[:, self.scaled] - self.scaler.mean_) / self.scaler.scale_
+        return pd.DataFrame(np.nan_to_num(X, nan=0.0), columns=self.columns, index=df.index)
+
 """
 def split_data(df):
     X = df.drop('result', axis=1)
@@ -38,14 +125,457 @@ def split_data(df):
     return train_test_split(X, y, test_size=0.25, random_state=11)
 """
 
+# Share of test rows and the seed of the split and of SMOTE
+TEST_SIZE = 0.25
+SPLIT_SEED = 11
+
 def split_data(df):
+    from sklearn.model_selection import train_test_split
     X = df.drop('result', axis=1)
     y = df['result']
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.25, random_state=11)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=TEST_SIZE, random_state=SPLIT_SEED)
 
     # Apply SMOTE to the training set 
-    smote = SMOTE(random_state=11)
+    from imblearn.over_sampling import SMOTE
+    smote = SMOTE(random_state=SPLIT_SEED)
     X_train_smote, y_train_smote = smote.fit_resample(X_train, y_train)
 
     return X_train_smote, X_test, y_train_smote, y_test
 
+
+# Dtypes of load_compact; the remaining feature columns are read as float32
+COMPACT_DTYPES = {
+    'result': 'category',
+    'opening': 'category',
+    'winner': 'category',
+    'adjudication': 'category',
+    'total_moves': 'int16',
+    'white_skill': 'int8',
+    'black_skill': 'int8',
+    'white_castled': 'bool',
+    'black_castled': 'bool',
+    'opposite_side_castle': 'bool',
+    'white_sacrifices': 'int16',
+    'black_sacrifices': 'int16',
+}
+# Their counterparts that can hold missing values, for files that have some
+NULLABLE_DTYPES = {'int8': 'Int8', 'int16': 'Int16', 'bool': 'boolean'}
+# Rows load_compact parses and preprocess_compact scales at a time, which bounds their temporaries;
+# larger files are parsed in LOAD_CHUNKS chunks, since every chunk costs the parser a few milliseconds
+LOAD_CHUNK_ROWS = 1_024
+LOAD_CHUNKS = 16
+SCALE_CHUNK_ROWS = 2_048
+# Rows whose nearest neighbours oversample_compact looks up at a time
+NEIGHBORS_CHUNK_ROWS = 1_024
+
+
+class _SmallReads:
+    """A text file read at most 'size' characters at a time.
+
+    The CSV parser asks for 256 KB per read and, for text, re-encodes what
+    it gets, so on a small file its buffers outweigh the data it parses.
+    """
+
+    def __init__(self, file, size=1 << 15):
+        self.file = file
+        self.size = size
+
+    def read(self, size=-1):
+        return self.file.read(self.size if size < 0 else min(size, self.size))
+
+    def __iter__(self):
+        return iter(self.file)
+
+
+class MemoryReport:
+    """Peak memory of each pipeline stage, as traced by tracemalloc.
+
+    Covers numpy buffers and Python objects such as the strings of an
+    object column, i.e. what the DataFrames hold. Both numbers are relative
+    to what was traced when the first stage started: 'peak' is the most
+    held at any point of the stage, 'held' what is still held after it.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.baseline = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.baseline is None:
+            self.baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            self.stages[name] = {'peak_mb': (peak - self.baseline) / 2 ** 20,
+                                 'held_mb': (current - self.baseline) / 2 ** 20}
+
+    def stop(self):
+        """Stops tracing, which slows every allocation down."""
+        tracemalloc.stop()
+
+    def report(self):
+        lines = [f"{'stage':<12}{'peak MB':>10}{'held MB':>10}"]
+        for name, stage in self.stages.items():
+            lines.append(f"{name:<12}{stage['peak_mb']:>10.1f}{stage['held_mb']:>10.1f}")
+        return '\n'.join(lines)
+
+
+def load_compact(filepath):
+    """Loads the results and model inputs of the games dataset with categorical strings, small integers, bools and float32 features.
+
+    A CSV is parsed a chunk at a time straight into columns of their final
+    dtype, so the parser's wide temporaries and strings only ever cover one
+    chunk and no chunks are concatenated. 'winner' and 'adjudication' are
+    not kept, but rows missing them are dropped as preprocess_data would.
+    """
+    if filepath.endswith('.parquet') or os.path.isdir(filepath):
+        df = load_data(filepath)
+        return df.astype(_compact_dtypes(df.columns, nullable=df.isna().any().any()))
+
+    for encoding in ('utf-8', 'ISO-8859-1'):
+        try:
+            try:
+                return _read_compact(filepath, encoding)
+            except ValueError as error:
+                if isinstance(error, UnicodeDecodeError):
+                    raise
+                # Integer and bool columns with missing values; nullable dtypes parse slower
+                return _read_compact(filepath, encoding, nullable=True)
+        except UnicodeDecodeError:
+            continue
+
+def _read_compact(filepath, encoding, nullable=False):
+    with open(filepath, encoding=encoding, newline='') as file:
+        header = pd.read_csv(_SmallReads(file), nrows=0).columns
+        file.seek(0)
+        dropped = [column for column in DROPPED_COLUMNS if column in header]
+        dtypes = _compact_dtypes([column for column in header if column not in dropped], nullable)
+        capacity = _count_rows(filepath)
+        columns = {column: _empty_column(dtype, capacity) for column, dtype in dtypes.items()}
+        categories = {column: {} for column, dtype in dtypes.items() if dtype == 'category'}
+        labels = None
+        rows = 0
+        for chunk in pd.read_csv(_SmallReads(file), usecols=list(dtypes) + dropped, dtype=_compact_dtypes(header, nullable),
+                                 chunksize=max(LOAD_CHUNK_ROWS, capacity // LOAD_CHUNKS)):
+            complete = chunk[dropped].notna().all(axis=1).to_numpy()
+            if not complete.all():
+                if labels is None:
+                    # Every row so far was kept, so the labels so far are the positions
+                    labels = np.arange(capacity)
+                chunk = chunk[complete]
+            end = rows + len(chunk)
+            for column, values in columns.items():
+                if column in categories:
+                    # Codes into the categories seen so far, in order of first appearance
+                    seen = categories[column]
+                    chunk_categories = chunk[column].cat.categories
+                    remap = np.array([seen.setdefault(name, len(seen)) for name in chunk_categories] + [-1], dtype=np.int16)
+                    values[rows:end] = remap[chunk[column].cat.codes.to_numpy()]
+                else:
+                    values[rows:end] = chunk[column].array
+            if labels is not None:
+                labels[rows:end] = chunk.index
+            rows = end
+
+    data = {}
+    for column, values in columns.items():
+        if column in categories:
+            names = pd.Index(list(categories[column]))
+            # Sorted like the categories read_csv infers
+            order = names.argsort()
+            remap = np.empty(len(names) + 1, dtype=np.int16)
+            remap[order] = np.arange(len(names))
+            remap[-1] = -1
+            values = pd.Categorical.from_codes(remap[values[:rows]], names[order])
+        data[column] = values[:rows]
+    index = pd.RangeIndex(rows) if labels is None else pd.Index(labels[:rows])
+    return pd.DataFrame(data, index=index, copy=False)
+
+def _empty_column(dtype, length):
+    if dtype == 'category':
+        # Category codes, until the categories are known
+        return np.empty(length, dtype=np.int16)
+    numpy_dtypes = {nullable: dtype for dtype, nullable in NULLABLE_DTYPES.items()}
+    if dtype in numpy_dtypes:
+        return pd.array(np.zeros(length, dtype=numpy_dtypes[dtype]), dtype=dtype)
+    return np.empty(length, dtype=dtype)
+
+def _count_rows(filepath, block_size=1 << 15):
+    """An upper bound on the rows of a CSV: the number of lines after its header."""
+    lines = 0
+    last = b'\n'
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    return max(lines - (last == b'\n'), 0)
+
+def _compact_dtypes(columns, nullable=False):
+    dtypes = {column: COMPACT_DTYPES.get(column, 'float32') for column in columns if column != 'run'}
+    if nullable:
+        dtypes = {column: NULLABLE_DTYPES.get(dtype, dtype) for column, dtype in dtypes.items()}
+    return dtypes
+
+
+def preprocess_compact(df):
+    """preprocess_data for a load_compact frame, returning (X, y, Preprocessor) and leaving 'df' as it is.
+
+    Instead of copying the frame to drop rows and columns, the kept rows of
+    every feature column are written straight into one C-contiguous
+    float32 matrix, which is then standardized in place a few rows at a
+    time. X is a DataFrame view of that matrix and y the categorical results.
+    """
+    from sklearn.preprocessing import LabelEncoder, StandardScaler
+    # Only rows with missing values are masked out, column by column, so a
+    # complete frame is copied into X without any temporaries
+    keep = None
+    for column in df.columns:
+        if df[column].hasnans:
+            present = df[column].notna().to_numpy()
+            keep = present if keep is None else keep & present
+    columns = [column for column in df.columns if column not in ['result', 'run'] + DROPPED_COLUMNS]
+    features = [feature for feature in FEATURES if feature in columns]
+
+    X = np.empty((len(df) if keep is None else int(keep.sum()), len(columns)), dtype=np.float32)
+    for i, column in enumerate(columns):
+        if column == 'opening':
+            # Same codes as a LabelEncoder fitted on the openings of the kept rows
+            codes = df['opening'].cat.codes.to_numpy()
+            codes = codes if keep is None else codes[keep]
+            used = np.unique(codes)
+            names = df['opening'].cat.categories[used]
+            opening_encoder = LabelEncoder().fit(names)
+            remap = np.zeros(len(df['opening'].cat.categories), dtype=np.float32)
+            remap[used] = opening_encoder.transform(names)
+            X[:, i] = remap[codes]
+        elif keep is None:
+            X[:, i] = df[column].to_numpy()
+        else:
+            X[:, i] = df[column].to_numpy(dtype=np.float32, na_value=np.nan)[keep]
+
+    scaled = [columns.index(feature) for feature in features]
+    scaler = StandardScaler()
+    for start in range(0, len(X), SCALE_CHUNK_ROWS):
+        scaler.partial_fit(X[start:start + SCALE_CHUNK_ROWS, scaled])
+    # In float32 and in place, column by column, so scaling allocates nothing
+    mean, scale = scaler.mean_.astype(np.float32), scaler.scale_.astype(np.float32)
+    for start in range(0, len(X), SCALE_CHUNK_ROWS):
+        block = X[start:start + SCALE_CHUNK_ROWS]
+        for j, i in enumerate(scaled):
+            block[:, i] -= mean[j]
+            block[:, i] /= scale[j]
+
+    # X and y share one index of the kept labels
+    index, results = df.index, df['result'].array
+    if keep is not None:
+        kept = np.flatnonzero(keep)
+        index, results = index[kept], results[kept]
+        del kept
+    # Sorting every code to find unused results only pays off when there are some
+    if not np.bincount(results.codes, minlength=len(results.categories)).all():
+        results = results.remove_unused_categories()
+    y = pd.Series(results, index=index, name='result', copy=False)
+    return pd.DataFrame(X, columns=columns, index=index, copy=False), y, Preprocessor(opening_encoder, scaler, columns, features)
+
+
+def split_compact(X, y, test_size=TEST_SIZE, random_state=SPLIT_SEED):
+    """split_data for preprocess_compact output: the same split and SMOTE, copying each row once."""
+    X_train, X_test, y_train, y_test = split_rows_compact(X, y, test_size, random_state)
+    X_train, y_train = oversample_compact(X_train, y_train, random_state)
+    return X_train, X_test, y_train, y_test
+
+
+def split_rows_compact(X, y, test_size=TEST_SIZE, random_state=SPLIT_SEED):
+    from sklearn.model_selection import train_test_split
+    train, test = train_test_split(np.arange(len(X)), test_size=test_size, random_state=random_state)
+    return X.iloc[train], X.iloc[test], y.iloc[train], y.iloc[test]
+
+
+def oversample_compact(X_train, y_train, random_state=SPLIT_SEED):
+    """SMOTE on the float32 matrix and the integer codes of the results, the same rows as SMOTE on the frames.
+
+    Frames and string labels would make SMOTE validate and copy them
+    before it starts, and SMOTE itself copies every training row before
+    stacking the new ones under them. So it is run on the rows of one class
+    at a time, only its new rows are kept, and the training rows are
+    copied once, next to them. SMOTE seeds its generator afresh for every
+    class, so this draws the same samples as a single run.
+    """
+    from imblearn.over_sampling import SMOTE
+    # SMOTE visits the classes in label order, so the codes must sort like the labels
+    categories = y_train.cat.categories
+    labels = y_train.cat.reorder_categories(categories.sort_values())
+    X, codes = X_train.to_numpy(), labels.cat.codes.to_numpy()
+    # The default strategy: every class up to the size of the largest one
+    counts = np.bincount(codes, minlength=len(categories))
+    new_rows = counts.max() - counts
+
+    X_new = []
+    for code in np.flatnonzero(new_rows):
+        rows = np.flatnonzero(codes == code)
+        # SMOTE needs a second class; its row is only passed through
+        rows = np.append(rows, np.argmax(codes != code))
+        # SMOTE's default 5 neighbours, and each row is its own nearest
+        smote = SMOTE(sampling_strategy={code: counts.max()}, random_state=random_state, k_neighbors=_chunked_neighbors(6))
+        X_class, _ = smote.fit_resample(X[rows], codes[rows])
+        X_new.append(X_class[len(rows):].copy())
+        del smote, X_class
+
+    X_resampled = np.concatenate([X] + X_new)
+    del X_new
+    codes = np.concatenate([codes, np.repeat(np.arange(len(categories), dtype=codes.dtype), new_rows)])
+    y_resampled = pd.Categorical.from_codes(codes, labels.cat.categories).set_categories(categories)
+    return (pd.DataFrame(X_resampled, columns=X_train.columns, copy=False),
+            pd.Series(y_resampled, name=y_train.name))
+
+
+def _chunked_neighbors(n_neighbors):
+    """The NearestNeighbors SMOTE fits, querying NEIGHBORS_CHUNK_ROWS rows at a time.
+
+    A query converts its rows to float64 and also returns the distances,
+    which SMOTE drops; each row's neighbours do not depend on the others.
+    """
+    from sklearn.neighbors import NearestNeighbors
+
+    class ChunkedNeighbors(NearestNeighbors):
+        def kneighbors(self, X=None, n_neighbors=None, return_distance=True):
+            if X is None or return_distance:
+                return super().kneighbors(X, n_neighbors, return_distance)
+            return np.concatenate([super(ChunkedNeighbors, self).kneighbors(X[start:start + NEIGHBORS_CHUNK_ROWS], n_neighbors, False)
+                                   for start in range(0, len(X), NEIGHBORS_CHUNK_ROWS)])
+
+    return ChunkedNeighbors(n_neighbors=n_neighbors)
+
+
+def _stages(memory):
+    if memory is None:
+        return lambda name: contextlib.nullcontext()
+    # Imported before tracing starts, so that the stages only count data
+    import imblearn.over_sampling
+    import sklearn.model_selection
+    import sklearn.preprocessing
+    # pandas converts strings through pyarrow when it is installed
+    with contextlib.suppress(ImportError):
+        import pyarrow.pandas_compat
+    return memory.stage
+
+
+def load_splits(filepath, memory=None):
+    """Runs load_data, preprocess_data and split_data, recording their stages on 'memory' like load_splits_compact."""
+    stage = _stages(memory)
+    with stage('load'):
+        df = load_data(filepath)
+    with stage('preprocess'):
+        df, preprocessor = preprocess_data(df, return_preprocessor=True)
+    with stage('split'):
+        X_train, X_test, y_train, y_test = split_data(df)
+        del df
+    return X_train, X_test, y_train, y_test, preprocessor
+
+
+def load_splits_compact(filepath, memory=None):
+    """Runs load_compact, preprocess_compact and split_compact, releasing every intermediate as soon as it is used.
+
+    Returns (X_train, X_test, y_train, y_test, preprocessor); stages are
+    recorded on 'memory', a MemoryReport, if one is given.
+    """
+    stage = _stages(memory)
+    with stage('load'):
+        df = load_compact(filepath)
+    with stage('preprocess'):
+        X, y, preprocessor = preprocess_compact(df)
+        del df
+    with stage('split'):
+        X_train, X_test, y_train, y_test = split_rows_compact(X, y)
+        # The full matrix is not needed by SMOTE, only the training rows
+        del X, y
+        X_train, y_train = oversample_compact(X_train, y_train)
+    return X_train, X_test, y_train, y_test, preprocessor
+
+
+def test_rows(index, test_size=0.25, random_state=11):
+    """Marks about 'test_size' of the rows as test rows by hashing their row labels.
+
+    Unlike train_test_split this needs no pass over the whole dataset, and a
+    row lands on the same side of the split whatever the chunk size.
+    """
+    hashed = (np.asarray(index, dtype=np.uint64) + np.uint64(random_state)) * np.uint64(0x9E3779B97F4A7C15)
+    return (hashed >> np.uint64(40)) % np.uint64(10_000) < np.uint64(round(test_size * 10_000))
+
+
+class StreamingPreprocessor:
+    """preprocess_data fitted one chunk at a time, for datasets that do not fit in memory.
+
+    partial_fit collects the opening vocabulary and running scaler
+    statistics, finish turns them into the same LabelEncoder and
+    StandardScaler that preprocess_data would fit on the whole frame, and
+    transform applies them to any chunk. Only the opening counts grow with
+    the dataset.
+    """
+
+    def __init__(self):
+        from sklearn.preprocessing import StandardScaler
+        self.opening_counts = collections.Counter()
+        self.numeric_scaler = StandardScaler()
+        # Set from the first chunk: datasets from before a feature was added lack its column
+        self.features = None
+        self.numeric_features = None
+        self.opening_encoder = None
+        self.scaler = None
+        self.columns = None
+
+    @staticmethod
+    def clean(chunk):
+        # Same row and column drops as preprocess_data, without modifying 'chunk'
+        return chunk.dropna().drop(columns=[column for column in DROPPED_COLUMNS if column in chunk])
+
+    def partial_fit(self, chunk):
+        chunk = self.clean(chunk)
+        self.columns = [column for column in chunk.columns if column != 'result']
+        if self.features is None:
+            self.features = [feature for feature in FEATURES if feature in chunk]
+            self.numeric_features = [feature for feature in self.features if feature != 'opening']
+        if len(chunk):
+            self.opening_counts.update(chunk['opening'])
+            self.numeric_scaler.partial_fit(chunk[self.numeric_features].astype(float))
+        return self
+
+    def finish(self):
+        from sklearn.preprocessing import LabelEncoder, StandardScaler
+        self.opening_encoder = LabelEncoder().fit(list(self.opening_counts))
+        self.opening_codes = {opening: code for code, opening in enumerate(self.opening_encoder.classes_)}
+
+        # The opening column is scaled after encoding, so its moments come from the counts
+        counts = np.array([self.opening_counts[opening] for opening in self.opening_encoder.classes_], dtype=float)
+        codes = np.arange(len(counts), dtype=float)
+        opening_mean = (counts * codes).sum() / counts.sum()
+        opening_var = (counts * (codes - opening_mean) ** 2).sum() / counts.sum()
+
+        numeric = dict(zip(self.numeric_features, zip(self.numeric_scaler.mean_, self.numeric_scaler.var_)))
+        numeric['opening'] = (opening_mean, opening_var)
+        scaler = StandardScaler()
+        scaler.mean_ = np.array([numeric[feature][0] for feature in self.features])
+        scaler.var_ = np.array([numeric[feature][1] for feature in self.features])
+        scaler.scale_ = np.where(scaler.var_ > 0, np.sqrt(scaler.var_), 1.0)
+        scaler.n_samples_seen_ = int(self.numeric_scaler.n_samples_seen_)
+        scaler.n_features_in_ = len(self.features)
+        scaler.feature_names_in_ = np.array(self.features, dtype=object)
+        self.scaler = scaler
+        return self
+
+    def preprocessor(self):
+        """The fitted encoder and scaler as a Preprocessor, to save with a model."""
+        return Preprocessor(self.opening_encoder, self.scaler, self.columns, self.features)
+
+    def transform(self, chunk):
+        """Returns the (X, y) of a chunk, encoded and scaled like preprocess_data."""
+        chunk = self.clean(chunk)
+        # Openings not seen while fitting get their own code
+        chunk['opening'] = chunk['opening'].map(self.opening_codes).fillna(-1).astype(int)
+        chunk[self.features] = self.scaler.transform(chunk[self.features].astype(float))
+        return chunk.drop(columns=['result']), chunk['result']
@@ -2,16 +2,74 @@ import chess
 import chess.engine
 import chess.pgn
 import chess.polyglot
+import argparse
+import collections
 import csv
+import json
+import logging
 import random
 import os
+import sys
+import multiprocessing
+from multiprocessing.util import Finalize
+from attack_maps import attack_counts, game_attack_counts
+from game_archive import game_record, open_archive
+from opening_book import load_opening_book
+from openings import OpeningClassifier, eco_lines, tree_lines
+from stage_timing import NULL_TIMER, RunTimings, StageTimer
 
 # Path to your Stockfish executable
 STOCKFISH_PATH = os.environ.get('STOCKFISH_PATH')
 OPENING_BOOK_PATH = os.environ.get('OPENING_BOOK_PATH')
+# ECO table (lichess chess-openings TSV file or directory); openings_tree is used when unset
+ECO_TABLE_PATH = os.environ.get('ECO_TABLE_PATH')
 
-# Initiliaze the Chess Engine
-engine = chess.engine.SimpleEngine.popen_uci(STOCKFISH_PATH)
+# Per-move and per-game details are logged at DEBUG, so runs are quiet unless --log-level asks otherwise
+log = logging.getLogger('dataset_generator')
+
+
+def engine_command(path=None):
+    """Returns the command that starts the UCI engine at 'path', STOCKFISH_PATH by default."""
+    path = path or STOCKFISH_PATH
+    if not path:
+        raise RuntimeError('No chess engine configured; set STOCKFISH_PATH to the Stockfish executable')
+    # Scripts such as fake_uci_engine.py run under this interpreter
+    return [sys.executable, path] if path.endswith('.py') else path
+
+
+def start_engine(path=None):
+    return chess.engine.SimpleEngine.popen_uci(engine_command(path))
+
+
+class EngineFactory:
+    """Starts a UCI engine the first time get() is called and quits it on close.
+
+    Importing this module or creating a factory starts nothing, so code
+    that only uses the feature functions never needs Stockfish.
+
+        with EngineFactory() as engines:
+            row = generate_game(engines.get(), seed, 0)
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.engine = None
+
+    def get(self):
+        if self.engine is None:
+            self.engine = start_engine(self.path)
+        return self.engine
+
+    def close(self):
+        if self.engine is not None:
+            self.engine.quit()
+            self.engine = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 openings_tree = {
     'e2e4': {
@@ -114,6 +172,17 @@ def get_opening_from_tree(moves, opening_tree):
     return last_known_opening
 
 
+_opening_classifier = None
+
+def opening_classifier():
+    """Returns the shared OpeningClassifier, compiled on first use."""
+    global _opening_classifier
+    if _opening_classifier is None:
+        lines = eco_lines(ECO_TABLE_PATH) if ECO_TABLE_PATH else tree_lines(openings_tree)
+        _opening_classifier = OpeningClassifier(lines)
+    return _opening_classifier
+
+
 def piece_value(piece):
     """Returns the value of the piece."""
     if piece is None:
@@ -159,56 +228,24 @@ def track_piece_counts(board):
         "black_knights": black_knights,
         "black_bishops": black_bishops
     }
-import chess
+
 
 def control_of_center(moves):
-    board = chess.Board()
-    center_squares = [chess.E4, chess.D4, chess.E5, chess.D5]
-    white_control_scores = []
-    black_control_scores = []
-    
-    for move in moves:
-        board.push(move)
-        white_control = 0
-        black_control = 0
-        for square in center_squares:
-            if board.is_attacked_by(chess.WHITE, square):
-                white_control += 1
-            if board.is_attacked_by(chess.BLACK, square):
-                black_control += 1
-        white_control_scores.append(white_control)
-        black_control_scores.append(black_control)
+    _, _, white_control, black_control = game_attack_counts(moves)
 
     # Calculate average control
-    avg_white_control = sum(white_control_scores) / len(white_control_scores) if white_control_scores else 0
-    avg_black_control = sum(black_control_scores) / len(black_control_scores) if black_control_scores else 0
+    avg_white_control = int(white_control.sum()) / len(moves) if moves else 0
+    avg_black_control = int(black_control.sum()) / len(moves) if moves else 0
 
     return avg_white_control, avg_black_control
 
 
 def calculate_piece_activity(moves):
-    board = chess.Board()
-    white_control_counts = []
-    black_control_counts = []
-    
-    for move in moves:
-        board.push(move)
-        white_control = 0
-        black_control = 0
-        
-        # Loop over all squares and check if they are attacked by white or black
-        for square in chess.SQUARES:
-            if board.is_attacked_by(chess.WHITE, square):
-                white_control += 1
-            if board.is_attacked_by(chess.BLACK, square):
-                black_control += 1
-                
-        white_control_counts.append(white_control)
-        black_control_counts.append(black_control)
+    white_control, black_control, _, _ = game_attack_counts(moves)
 
     # Calculate average control for white and black
-    avg_white_control = sum(white_control_counts) / len(white_control_counts) if white_control_counts else 0
-    avg_black_control = sum(black_control_counts) / len(black_control_counts) if black_control_counts else 0
+    avg_white_control = int(white_control.sum()) / len(moves) if moves else 0
+    avg_black_control = int(black_control.sum()) / len(moves) if moves else 0
 
     return avg_white_control, avg_black_control
 
@@ -260,19 +297,250 @@ def average_piece_evaluation(moves, evaluation_interval):
     return white_knight_to_bishop_ratio, black_knight_to_bishop_ratio
 
 
-def get_evaluation_score(board, engine, depth):
+class FeatureAccumulator:
+    """Computes the per-ply game features while the moves are being played.
+
+    play_game pushes every move through push(), so extract_features does not
+    have to replay the game once per feature. The results match
+    control_of_center, calculate_piece_activity, average_piece_evaluation and
+    count_sacrifices on the same move list, and the opening is classified
+    from the same positions.
+    """
+
+    def __init__(self, evaluation_interval=3, openings=None):
+        self.evaluation_interval = evaluation_interval
+        self.opening = (openings or opening_classifier()).tracker()
+        self.plies = 0
+        self.white_center = 0
+        self.black_center = 0
+        self.white_activity = 0
+        self.black_activity = 0
+        self.white_sacrifices = 0
+        self.black_sacrifices = 0
+        self.piece_sums = dict.fromkeys(["white_knights", "white_bishops", "black_knights", "black_bishops"], 0)
+        self.piece_evaluations = 0
+
+    def push(self, board, move):
+        """Records 'move' and pushes it on 'board'."""
+        if board.is_capture(move):
+            moving_piece = board.piece_at(move.from_square)
+            captured_piece = board.piece_at(move.to_square)
+            if moving_piece and captured_piece:
+                moving_value = piece_value(moving_piece)
+                captured_value = piece_value(captured_piece)
+                if moving_value > captured_value:
+                    if moving_piece.color == chess.WHITE:
+                        self.white_sacrifices += moving_value - captured_value
+                    else:
+                        self.black_sacrifices += moving_value - captured_value
+
+        board.push(move)
+        self.plies += 1
+        self.opening.push(board)
+
+        white_activity, black_activity, white_center, black_center = attack_counts(board)
+        self.white_center += white_center
+        self.black_center += black_center
+        self.white_activity += white_activity
+        self.black_activity += black_activity
+
+        if self.plies % self.evaluation_interval == 0:
+            for key, value in track_piece_counts(board).items():
+                self.piece_sums[key] += value
+            self.piece_evaluations += 1
+
+    def features(self, board):
+        """Returns the accumulated features once the game on 'board' is over."""
+        sums = dict(self.piece_sums)
+        num_evaluations = self.piece_evaluations
+        # average_piece_evaluation also samples the final position
+        if self.plies % self.evaluation_interval != 0:
+            for key, value in track_piece_counts(board).items():
+                sums[key] += value
+            num_evaluations += 1
+
+        if num_evaluations > 0:
+            avg_counts = {key: value / num_evaluations for key, value in sums.items()}
+            w_knight_to_bishop = avg_counts["white_knights"] / avg_counts["white_bishops"] if avg_counts["white_bishops"] != 0 else float('inf')
+            b_knight_to_bishop = avg_counts["black_knights"] / avg_counts["black_bishops"] if avg_counts["black_bishops"] != 0 else float('inf')
+        else:
+            w_knight_to_bishop = float('inf')
+            b_knight_to_bishop = float('inf')
+
+        plies = self.plies
+        return {
+            'opening': self.opening.name,
+            'w_knight_to_bishop': w_knight_to_bishop,
+            'b_knight_to_bishop': b_knight_to_bishop,
+            'w_center_control': self.white_center / plies if plies else 0,
+            'b_center_control': self.black_center / plies if plies else 0,
+            'white_piece_activity': self.white_activity / plies if plies else 0,
+            'black_piece_activity': self.black_activity / plies if plies else 0,
+            'white_sacrifices': self.white_sacrifices,
+            'black_sacrifices': self.black_sacrifices,
+        }
+
+
+def get_evaluation_score(board, engine, depth, cache=None):
+    # Positions already in the evaluation cache skip the engine search
+    if cache is not None:
+        score = cache.get(board, depth)
+        if score is not None:
+            return score
+
     # Get the evaluation score from Stockfish
     info = engine.analyse(board, chess.engine.Limit(depth=depth))
+    score = evaluation_from_info(info)
+    if score is None:
+        # Counts as an even position in this game, but is not cached for later ones
+        return 0
+    if cache is not None:
+        cache.put(board, depth, score)
+    return score
+
+
+# Mate in n is scored as MATE_SCORE - n centipawns, so it outranks any material score
+MATE_SCORE = 10000
+
+
+def score_to_pawns(score):
+    """Converts an engine PovScore into pawns from white's point of view, mates included."""
+    return score.white().score(mate_score=MATE_SCORE) / 100
+
+
+def evaluation_from_info(info):
+    """Converts an engine analysis result into a score in pawns for white, or None if it has no readable score."""
     try:
-        score = info["score"].white().score() / 100  # Normalize score for white's perspective
-        print(score)
+        score = score_to_pawns(info["score"])  # Normalize score for white's perspective
+        log.debug("evaluation %s", score)
     except Exception as e:
         # Handle any exceptions that occur during calculation
-        score=0
-        print(f"Error occurred: {e}")
+        score = None
+        log.warning("could not read the evaluation score: %s", e)
     return score
 
 
+def trajectory_fieldnames(plies):
+    return [f'eval_ply_{ply}' for ply in plies] + ['eval_swing'] if plies else []
+
+
+def trajectory_features(scores, plies, board):
+    """Turns the per-ply scores of a game into a fixed-length evaluation trajectory.
+
+    'scores' maps a ply to the score in pawns of the position after it, as
+    reported by the engine move played from there. Each of 'plies' takes the
+    latest score at or before it: 0 while the game is still in the book, and
+    the final result once the game is over. eval_swing is the largest change
+    between two consecutive scores.
+    """
+    final = None
+    if board.is_checkmate():
+        final = -MATE_SCORE / 100 if board.turn == chess.WHITE else MATE_SCORE / 100
+    elif board.is_game_over():
+        final = 0.0
+
+    scored = sorted(scores.items())
+    features = {}
+    current = 0.0
+    index = 0
+    for ply in plies:
+        while index < len(scored) and scored[index][0] <= ply:
+            current = scored[index][1]
+            index += 1
+        features[f'eval_ply_{ply}'] = final if final is not None and ply >= len(board.move_stack) else current
+
+    values = [score for _, score in scored]
+    features['eval_swing'] = max((abs(after - before) for before, after in zip(values, values[1:])), default=0.0)
+    return features
+
+
+def dataset_fieldnames(config):
+    """Columns of the dataset of a run, optional ones included, from its manifest config."""
+    return (FIELDNAMES + trajectory_fieldnames(config.get('trajectory_plies'))
+            + (['adjudication'] if config.get('adjudication') else []))
+
+
+class AdjudicationRules:
+    """When play_game may end a game early, from the scores the engine reports with its moves.
+
+    A side resigns once the score has favoured its opponent by at least
+    'resign_score' pawns for 'resign_plies' engine moves in a row. A game
+    is drawn once the score has stayed within 'draw_score' pawns of 0 for
+    'draw_plies' engine moves in a row from ply 'draw_after' on. A rule
+    whose score is None is off. With 'material_draw', pawnless endings
+    with one rook or minor piece a side are drawn as soon as they arise.
+    With 'audit', adjudicated games are played on to their end off the
+    record, timing the engine moves that adjudication saved.
+    """
+
+    def __init__(self, resign_score=None, resign_plies=6, draw_score=None, draw_plies=20, draw_after=80,
+                 material_draw=False, audit=False):
+        self.resign_score = resign_score
+        self.resign_plies = resign_plies
+        self.draw_score = draw_score
+        self.draw_plies = draw_plies
+        self.draw_after = draw_after
+        self.material_draw = material_draw
+        self.audit = audit
+
+    def as_dict(self):
+        """The rules for the run manifest; auditing is a choice of each run, not of the dataset."""
+        return {'resign_score': self.resign_score, 'resign_plies': self.resign_plies, 'draw_score': self.draw_score,
+                'draw_plies': self.draw_plies, 'draw_after': self.draw_after, 'material_draw': self.material_draw}
+
+    @classmethod
+    def from_dict(cls, config, audit=False):
+        return cls(**config, audit=audit) if config else None
+
+
+def is_material_draw(board):
+    """Pawnless endings where each side has exactly one rook or minor piece, e.g. KRvKR, KRvKB or KBvKN.
+
+    No tablebase is consulted: these are drawn with correct play, barring
+    rare mates. KRvK, which is won, has no piece on one side, and a lone
+    minor piece is already insufficient material.
+    """
+    if board.pawns or board.queens:
+        return False
+    return all(chess.popcount(board.occupied_co[color] & ~board.kings) == 1 for color in chess.COLORS)
+
+
+class Adjudicator:
+    """Holds one game's score streaks against its AdjudicationRules."""
+
+    def __init__(self, rules):
+        self.rules = rules
+        # Consecutive engine moves scored beyond the resign threshold, negative while black is ahead
+        self.resign_streak = 0
+        self.draw_streak = 0
+
+    def update(self, board, score):
+        """Returns (result, reason) if the game on 'board', which is not over, can be adjudicated, else None.
+
+        'score' is the engine's score in pawns for white that came with the
+        last move, None after a book move.
+        """
+        rules = self.rules
+        if rules.material_draw and is_material_draw(board):
+            return '1/2-1/2', 'material_draw'
+        if score is None:
+            return None
+        if rules.resign_score is not None:
+            if score >= rules.resign_score:
+                self.resign_streak = max(self.resign_streak, 0) + 1
+            elif score <= -rules.resign_score:
+                self.resign_streak = min(self.resign_streak, 0) - 1
+            else:
+                self.resign_streak = 0
+            if abs(self.resign_streak) >= rules.resign_plies:
+                return ('1-0' if self.resign_streak > 0 else '0-1'), 'resign'
+        if rules.draw_score is not None and len(board.move_stack) >= rules.draw_after:
+            self.draw_streak = self.draw_streak + 1 if abs(score) <= rules.draw_score else 0
+            if self.draw_streak >= rules.draw_plies:
+                return '1/2-1/2', 'draw'
+        return None
+
+
 def has_castled(moves, is_white):
     king_square = 'e1' if is_white else 'e8'
     kingside_castle = 'g1' if is_white else 'g8'
@@ -290,11 +558,11 @@ def has_castled(moves, is_white):
             return False
         elif src_square == king_square and (target_square == kingside_castle or target_square == queenside_castle):
             # Castled
-            print('Castled')
+            log.debug("castled: %s", move)
             return True
 
     # King never moved
-    print('King never moved')
+    log.debug("king never moved (%s)", 'white' if is_white else 'black')
     return False
 
 
@@ -334,54 +602,132 @@ def opposite_side_castling(moves):
         return False  # No opposite side castling
 
 
-def play_game(engine, white_skill, black_skill):
+def play_game(engine, white_skill, black_skill, rng=None, accumulator=None, black_engine=None, eval_cache=None, timer=None,
+              scores=None, adjudication=None):
+    """Plays a game of 'engine' against itself, or against 'black_engine'.
+
+    Given a separate 'black_engine', both engines must already be configured
+    at their side's skill level and no Skill Level changes are sent. Time
+    spent in each stage is added to 'timer', a StageTimer, if one is given.
+    Given a 'scores' dict, the score the engine reports with each of its
+    moves is stored in it by ply, in pawns for white; it comes from the
+    search the move needs anyway, so no analysis is added.
+    Given 'adjudication' rules, the game may end before it is over; the
+    result and the reason are in the game's Result and Adjudication headers.
+    """
+    timer = timer or NULL_TIMER
     board = chess.Board()
     moves = []
     eval_after_move_15= None
-    # Apply skill level settings
-    engine.configure({"Skill Level": white_skill})  # Set skill level for White
+    configured_skill = None
+    book_plies = 0
+    info = chess.engine.INFO_NONE if scores is None and adjudication is None else chess.engine.INFO_SCORE
+    adjudicator = Adjudicator(adjudication) if adjudication is not None else None
+    verdict = None
+    score = None
 
 
-    with chess.polyglot.open_reader(OPENING_BOOK_PATH) as reader:
+    with load_opening_book(OPENING_BOOK_PATH) as reader:
         while not board.is_game_over():
+            if adjudicator is not None:
+                verdict = adjudicator.update(board, score)
+                if verdict is not None:
+                    break
+            score = None
 
-            if len(moves) % 2 == 0:  # White's move
-                engine.configure({"Skill Level": white_skill})
-            else:  # Black's move
-                engine.configure({"Skill Level": black_skill})
+            side_engine = engine if black_engine is None or len(moves) % 2 == 0 else black_engine
+            if black_engine is None:
+                # Only switch the skill level when the side to move plays at a different one
+                skill = white_skill if len(moves) % 2 == 0 else black_skill
+                if skill != configured_skill:
+                    with timer.stage('configure'):
+                        engine.configure({"Skill Level": skill})
+                    configured_skill = skill
             move = None
 
             if len(moves) < 7: # Length of opening
                 try:
-                    entry = reader.choice(board)
+                    with timer.stage('book'):
+                        entry = reader.choice(board, random=rng)
                     move = entry.move
-                    print(f"Entry: {entry}, Using book move: {move.uci()}")  # Debug output
+                    book_plies += 1
+                    log.debug("book move %s (weight %d)", move.uci(), entry.weight)
                 except IndexError:
-                    move = engine.play(board, chess.engine.Limit(time=0.0001)).move
-                    print("No book move available, using engine move.")  # No book move available
-            else:
-                move = engine.play(board, chess.engine.Limit(time=0.0001)).move
-                print(f"Using engine move: {move.uci()}")  # Debug output
+                    log.debug("no book move available, using engine move")
+            if move is None:
+                with timer.stage('engine_play'):
+                    result = side_engine.play(board, chess.engine.Limit(time=0.0001), info=info)
+                move = result.move
+                if 'score' in result.info:
+                    score = score_to_pawns(result.info['score'])
+                    if scores is not None:
+                        scores[len(moves)] = score
+                log.debug("engine move %s", move.uci())
 
-            board.push(move)
+            if accumulator is not None:
+                with timer.stage('features'):
+                    accumulator.push(board, move)
+            else:
+                board.push(move)
             moves.append(move)
         
                 
 
             if len(moves) == 15:
-                eval_after_move_15 = get_evaluation_score(board, engine, 12)
+                with timer.stage('analysis'):
+                    eval_after_move_15 = get_evaluation_score(board, engine, 12, eval_cache)
 
     game = chess.pgn.Game.from_board(board)
     game.headers["Result"] = board.result()
+    game.headers["BookPlies"] = str(book_plies)
+    if verdict is not None:
+        game.headers["Result"], game.headers["Adjudication"] = verdict
+        log.debug("adjudicated %s after %d plies (%s)", verdict[0], len(moves), verdict[1])
+        played_result = None
+        if adjudication.audit:
+            played_result = play_out(board, engine, white_skill, black_skill, black_engine, timer)
+        timer.adjudicated(verdict[1], verdict[0], played_result)
     return game, board, moves, eval_after_move_15 
 
+
+def play_out(board, engine, white_skill, black_skill, black_engine=None, timer=None):
+    """Plays the game on 'board' on to its end on a copy and returns the result, for auditing an adjudication.
+
+    The engine moves are timed as 'saved_engine_play', the engine time
+    that adjudicating the game saved.
+    """
+    timer = timer or NULL_TIMER
+    board = board.copy()
+    configured_skill = None
+    while not board.is_game_over():
+        side_engine = engine if black_engine is None or board.turn == chess.WHITE else black_engine
+        if black_engine is None:
+            skill = white_skill if board.turn == chess.WHITE else black_skill
+            if skill != configured_skill:
+                engine.configure({"Skill Level": skill})
+                configured_skill = skill
+        with timer.stage('saved_engine_play'):
+            result = side_engine.play(board, chess.engine.Limit(time=0.0001))
+        board.push(result.move)
+    return board.result()
+
 # Function to extract features from a game
-def extract_features(game, board, moves, white_skill, black_skill, eval_after_move_15):
+def extract_features(game, board, moves, white_skill, black_skill, eval_after_move_15, accumulator=None, result=None):
+    # An adjudicated game's result is not the board's
+    result = result or board.result()
+    if accumulator is None:
+        # Games that were not played through an accumulator are replayed once
+        accumulator = FeatureAccumulator(evaluation_interval=3)
+        replay_board = chess.Board()
+        for move in moves:
+            accumulator.push(replay_board, move)
+    features = accumulator.features(board)
+
     game_info = {}
-    game_info['result'] = board.result()
+    game_info['result'] = result
     game_info['total_moves'] = board.fullmove_number
-    game_info['opening'] = get_opening_from_tree(moves, openings_tree)
-    game_info['winner'] = 'draw' if board.is_game_over() and board.result() == '1/2-1/2' else 'white' if '1-0' in board.result() else 'black'
+    game_info['opening'] = features.pop('opening')
+    game_info['winner'] = 'draw' if result == '1/2-1/2' else 'white' if '1-0' in result else 'black'
     #game_info['white_rating'] = random.randint(1000, 2000)
     #game_info['black_rating'] = random.randint(1000, 2000)
     game_info['white_skill'] = white_skill
@@ -391,37 +737,453 @@ def extract_features(game, board, moves, white_skill, black_skill, eval_after_mo
     parsed_moves = ' '.join(str(move) for move in moves)
     # Check if white has castled
     game_info['white_castled'] = has_castled(parsed_moves, is_white=True)
-    game_info['w_knight_to_bishop'], game_info['b_knight_to_bishop'] = average_piece_evaluation(moves, evaluation_interval=3)
-    game_info['w_center_control'], game_info['b_center_control'] = control_of_center(moves)
     # Check if black has castled:
     game_info['black_castled'] = has_castled(parsed_moves, is_white=False)
     game_info['opposite_side_castle'] = opposite_side_castling(parsed_moves)
-    game_info['white_piece_activity'], game_info['black_piece_activity'] = calculate_piece_activity(moves)
-    game_info['white_sacrifices'], game_info['black_sacrifices'] = count_sacrifices(board)
+    game_info.update(features)
     game_info['eval_after_move_15'] = eval_after_move_15
     
 
     return game_info
 
+FIELDNAMES = ['result', 'total_moves', 'opening', 'winner', 'white_skill', 'black_skill', 'white_castled', 'black_castled', 'opposite_side_castle', 'white_sacrifices', 'black_sacrifices', 'w_knight_to_bishop', 'b_knight_to_bishop', 'w_center_control', 'b_center_control', 'white_piece_activity', 'black_piece_activity', 'eval_after_move_15']
+
+
+def game_rng(seed, game_index):
+    """Returns the RNG that drives every random choice of one game."""
+    # String seeds are hashed deterministically, unlike tuples
+    return random.Random(f"{seed}:{game_index}")
+
+
+# Skill levels drawn by pick_skills
+SKILL_LEVELS = range(5, 21)
+
+
+def pick_skills(rng, asymmetric=False):
+    """Returns the (white_skill, black_skill) levels of a game."""
+    white_skill = rng.randint(SKILL_LEVELS[0], SKILL_LEVELS[-1])
+    black_skill = rng.randint(SKILL_LEVELS[0], SKILL_LEVELS[-1]) if asymmetric else white_skill
+    return white_skill, black_skill
+
+
+class SkillEnginePool:
+    """Keeps one engine per skill level, configured once when it is started.
+
+    A game borrows the engines of its two skill levels, so it never sends a
+    Skill Level change, and equal skills share one engine. There are only
+    len(SKILL_LEVELS) of them, so with the default 'max_engines' every
+    engine is started once per worker and then kept: starting an engine
+    costs far more than the configure round trips it saves. With a lower
+    limit the least recently used level is quit, never one of the pair
+    being handed out.
+    """
+
+    def __init__(self, max_engines=len(SKILL_LEVELS), engine_path=None):
+        self.max_engines = max_engines
+        self.engine_path = engine_path or STOCKFISH_PATH
+        self.engines = collections.OrderedDict()
+        self.starts = 0
+
+    def _get(self, skill):
+        if skill in self.engines:
+            self.engines.move_to_end(skill)
+            return self.engines[skill]
+        engine = start_engine(self.engine_path)
+        engine.configure({"Skill Level": skill})
+        self.starts += 1
+        self.engines[skill] = engine
+        return engine
+
+    def acquire(self, white_skill, black_skill):
+        """Returns the (white_engine, black_engine) pair for a game."""
+        white_engine = self._get(white_skill)
+        black_engine = self._get(black_skill)
+        for skill in list(self.engines):
+            if len(self.engines) <= self.max_engines:
+                break
+            if skill not in (white_skill, black_skill):
+                self.engines.pop(skill).quit()
+        return white_engine, black_engine
+
+    def close(self):
+        while self.engines:
+            self.engines.popitem()[1].quit()
+
+
+def generate_game(engine, seed, game_index, asymmetric=False, engine_pairs=None, eval_cache=None, timer=None, archive=False,
+                  trajectory_plies=(), adjudication=None):
+    """Plays game number 'game_index' of a run and returns its feature row.
+
+    With 'engine_pairs' the game is played on the pool's engines for its
+    skill pairing instead of on 'engine'. Stage timings go to 'timer'. With
+    'archive' the game's archive record is returned after the row. With
+    'trajectory_plies' the row gets the evaluation trajectory features.
+    With 'adjudication' rules the game may be ended early, and the row
+    records why in its adjudication column.
+    """
+    timer = timer or NULL_TIMER
+    rng = game_rng(seed, game_index)
+    white_skill, black_skill = pick_skills(rng, asymmetric)
+    black_engine = None
+    if engine_pairs is not None:
+        engine, black_engine = engine_pairs.acquire(white_skill, black_skill)
+    accumulator = FeatureAccumulator(evaluation_interval=3)
+    scores = {} if trajectory_plies else None
+    game, board, moves, eval_after_move_15 = play_game(engine, white_skill, black_skill, rng=rng, accumulator=accumulator,
+                                                       black_engine=black_engine, eval_cache=eval_cache, timer=timer,
+                                                       scores=scores, adjudication=adjudication)
+    result = game.headers["Result"]
+    timer.plies = len(moves)
+    log.debug("game %d finished after %d plies: %s", game_index, len(moves), result)
+    with timer.stage('features'):
+        row = extract_features(game, board, moves, white_skill, black_skill, eval_after_move_15, accumulator=accumulator,
+                               result=result)
+        if trajectory_plies:
+            row.update(trajectory_features(scores, trajectory_plies, board))
+        if adjudication is not None:
+            row['adjudication'] = game.headers.get("Adjudication", 'none')
+    if archive:
+        return row, game_record(seed, game_index, white_skill, black_skill, moves, result, eval_after_move_15,
+                                int(game.headers["BookPlies"]))
+    return row
+
+
+def open_eval_cache(path, max_entries):
+    if path is None:
+        return None
+    from eval_cache import EvalCache
+    return EvalCache(path, max_entries)
+
+
+def close_eval_cache(eval_cache):
+    if eval_cache is not None:
+        print(eval_cache.report())
+        eval_cache.close()
+
+
+# Each pool worker owns its Stockfish processes for its whole lifetime,
+# started when its first game needs them
+_worker_engines = None
+_worker_skill_engines = None
+_worker_eval_cache = None
+_worker_trajectory_plies = ()
+_worker_adjudication = None
+
+def _init_worker(engine_mode, max_engines, eval_cache_path, eval_cache_size, trajectory_plies, adjudication):
+    global _worker_engines, _worker_skill_engines, _worker_eval_cache, _worker_trajectory_plies, _worker_adjudication
+    _worker_trajectory_plies = trajectory_plies
+    _worker_adjudication = adjudication
+    if engine_mode == 'pairs':
+        _worker_skill_engines = SkillEnginePool(max_engines)
+        Finalize(None, _worker_skill_engines.close, exitpriority=10)
+    else:
+        _worker_engines = EngineFactory()
+        Finalize(None, _worker_engines.close, exitpriority=10)
+    _worker_eval_cache = open_eval_cache(eval_cache_path, eval_cache_size)
+    Finalize(None, close_eval_cache, args=(_worker_eval_cache,), exitpriority=10)
+
+def _generate_in_worker(task):
+    seed, game_index, asymmetric, timed, archive = task
+    timer = StageTimer() if timed else None
+    engine = _worker_engines.get() if _worker_skill_engines is None else None
+    result = generate_game(engine, seed, game_index, asymmetric, _worker_skill_engines, _worker_eval_cache, timer, archive,
+                           _worker_trajectory_plies, _worker_adjudication)
+    row, record = result if archive else (result, None)
+    return game_index, row, record, timer.as_dict() if timed else None
+
+
+def generate_rows(game_indices, seed, workers, scheduler='pool', in_flight=16,
+                  asymmetric=False, engine_mode='shared', max_engines=len(SKILL_LEVELS),
+                  eval_cache_path=None, eval_cache_size=1_000_000, timings=None, archive=False, trajectory_plies=(),
+                  adjudication=None):
+    """Yields (feature row, archive record) pairs in game order, playing them on 'workers' engine processes.
+
+    scheduler 'pool' plays a game per pool worker, 'async' interleaves
+    'in_flight' games on asyncio engines and 'serial' plays them one at a
+    time in this process, as 'pool' does with a single worker. All three
+    yield the same rows. engine_mode 'shared' plays both sides on one engine and switches its
+    Skill Level between moves. 'pairs' gives every side its own engine
+    through a SkillEnginePool of up to 'max_engines' engines per worker.
+    Evaluations are looked up in the EvalCache at 'eval_cache_path' first,
+    if one is given. Every game's stage timings are recorded on
+    'timings', a RunTimings, if one is given. Archive records are only
+    built with 'archive', otherwise they are None. 'trajectory_plies' adds
+    the evaluation trajectory at those plies to every row. Games may be
+    ended early by 'adjudication', an AdjudicationRules.
+    """
+    if scheduler == 'async':
+        from async_scheduler import generate_rows_async
+        eval_cache = open_eval_cache(eval_cache_path, eval_cache_size)
+        try:
+            yield from generate_rows_async(game_indices, seed, workers, in_flight, asymmetric=asymmetric, eval_cache=eval_cache,
+                                           timings=timings, archive=archive, trajectory_plies=trajectory_plies,
+                                           adjudication=adjudication)
+        finally:
+            close_eval_cache(eval_cache)
+        return
+
+    if workers <= 1 or scheduler == 'serial':
+        eval_cache = open_eval_cache(eval_cache_path, eval_cache_size)
+        engine_pairs = SkillEnginePool(max_engines) if engine_mode == 'pairs' else None
+        engines = EngineFactory()
+        try:
+            for game_index in game_indices:
+                engine = engines.get() if engine_pairs is None else None
+                timer = StageTimer() if timings is not None else None
+                result = generate_game(engine, seed, game_index, asymmetric, engine_pairs, eval_cache, timer, archive,
+                                       trajectory_plies, adjudication)
+                if timings is not None:
+                    timings.record(game_index, timer.as_dict())
+                yield result if archive else (result, None)
+        finally:
+            engines.close()
+            if engine_pairs is not None:
+                engine_pairs.close()
+            close_eval_cache(eval_cache)
+        return
+
+    # Workers forked after this share the parent's in-memory book and openings
+    load_opening_book(OPENING_BOOK_PATH)
+    opening_classifier()
+    tasks = ((seed, game_index, asymmetric, timings is not None, archive) for game_index in game_indices)
+    initargs = (engine_mode, max_engines, eval_cache_path, eval_cache_size, trajectory_plies, adjudication)
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+        # imap keeps the input order, so the CSV only depends on the seed
+        for game_index, row, record, game_timings in pool.imap(_generate_in_worker, tasks):
+            if timings is not None:
+                timings.record(game_index, game_timings)
+            yield row, record
+        pool.close()
+        pool.join()
+
+
+def manifest_path(output):
+    return output + '.manifest.json'
+
+
+def read_manifest(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_manifest(path, manifest):
+    """Atomically replaces the run manifest at 'path'."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+class CsvSink:
+    """Appends feature rows to a CSV file and fsyncs them at every checkpoint."""
+
+    def __init__(self, path, manifest, resume):
+        fieldnames = dataset_fieldnames(manifest['config'])
+        if resume:
+            # Drop rows written after the last checkpoint
+            os.truncate(path, manifest['committed_bytes'])
+            self.file = open(path, 'a', newline='')
+            self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+        else:
+            self.file = open(path, 'w', newline='')
+            self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+            self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+    def checkpoint(self, manifest):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        manifest['committed_bytes'] = os.fstat(self.file.fileno()).st_size
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink:
+    """Buffers feature rows and writes every checkpoint batch as typed Parquet files."""
+
+    def __init__(self, root, manifest, resume):
+        import parquet_io
+        self.parquet_io = parquet_io
+        self.root = root
+        self.partition_by = manifest['config']['partition_by']
+        self.extra_columns = dataset_fieldnames(manifest['config'])[len(FIELDNAMES):]
+        self.seed = manifest['seed']
+        self.batch_start = manifest['committed_games']
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+
+    def checkpoint(self, manifest):
+        if self.rows:
+            # Batch files are named after their first game, so a resumed run
+            # overwrites the files of a batch that was cut short
+            batch_name = f"run-{self.seed}-games-{self.batch_start:09d}"
+            self.parquet_io.write_batch(self.rows, self.root, self.partition_by, self.seed, batch_name, self.extra_columns)
+        self.batch_start += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        pass
+
+
+SINKS = {'csv': CsvSink, 'parquet': ParquetSink}
+
+
+def commit_batch(sink, manifest, output, committed_games, archive=None):
+    """Makes every row and archived game written so far durable and records them in the manifest."""
+    sink.checkpoint(manifest)
+    if archive is not None:
+        archive.checkpoint(manifest)
+    manifest['committed_games'] = committed_games
+    write_manifest(manifest_path(output), manifest)
+
+
+def open_dataset(args):
+    """Opens the output sink and returns it with its run manifest.
+
+    A fresh run starts a new manifest. A resumed run continues from the last
+    committed batch of the recorded one. The game archive, if the run keeps
+    one, is opened as the third value.
+    """
+    if args.resume:
+        manifest = read_manifest(manifest_path(args.output))
+        sink = SINKS[manifest['config']['format']](args.output, manifest, resume=True)
+        archive_path = manifest['config'].get('archive')
+        archive = open_archive(archive_path, manifest, resume=True) if archive_path else None
+        return sink, manifest, archive
+
+    manifest = {
+        'seed': args.seed if args.seed is not None else random.randrange(2**32),
+        'committed_games': 0,
+        'committed_bytes': 0,
+        'config': {
+            'games': args.games,
+            'format': args.format,
+            'partition_by': args.partition_by,
+            'asymmetric_skills': args.asymmetric_skills,
+            'opening_book': OPENING_BOOK_PATH,
+            'eco_table': ECO_TABLE_PATH,
+            'stockfish': STOCKFISH_PATH,
+            'archive': args.archive,
+            'trajectory_plies': args.trajectory_plies,
+            'adjudication': adjudication_config(args),
+        },
+    }
+    sink = SINKS[args.format](args.output, manifest, resume=False)
+    archive = open_archive(args.archive, manifest, resume=False) if args.archive else None
+    commit_batch(sink, manifest, args.output, 0, archive)
+    return sink, manifest, archive
+
+
+def parse_plies(text):
+    plies = sorted({int(ply) for ply in text.split(',') if ply.strip()})
+    if any(ply < 1 for ply in plies):
+        raise argparse.ArgumentTypeError('plies must be positive')
+    return plies
+
+
+def add_adjudication_arguments(parser):
+    parser.add_argument('--resign-score', type=float, default=None,
+                        help='Adjudicate a win once the engine scores a side this many pawns ahead for --resign-plies moves')
+    parser.add_argument('--resign-plies', type=int, default=6, help='Consecutive engine moves a resign score must hold')
+    parser.add_argument('--draw-score', type=float, default=None,
+                        help='Adjudicate a draw once the engine scores within this many pawns of 0 for --draw-plies moves')
+    parser.add_argument('--draw-plies', type=int, default=20, help='Consecutive engine moves a draw score must hold')
+    parser.add_argument('--draw-after', type=int, default=80, help='Ply from which draws may be adjudicated')
+    parser.add_argument('--material-draw', action='store_true',
+                        help='Adjudicate pawnless endings with one rook or minor piece a side as draws')
+
+
+def adjudication_config(args):
+    """The manifest entry of the adjudication arguments, None when no rule is on."""
+    if args.resign_score is None and args.draw_score is None and not args.material_draw:
+        return None
+    return AdjudicationRules(args.resign_score, args.resign_plies, args.draw_score, args.draw_plies, args.draw_after,
+                             args.material_draw).as_dict()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a chess games dataset with Stockfish self-play.')
+    parser.add_argument('--games', type=int, default=2500, help='Number of games to play')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of Stockfish processes to play games on')
+    parser.add_argument('--seed', type=int, default=None, help='Run seed; every game derives its own RNG from it')
+    parser.add_argument('--output', default='dataset.csv', help='CSV file, or Parquet dataset directory, to write')
+    parser.add_argument('--format', choices=sorted(SINKS), default='csv', help='Output format')
+    parser.add_argument('--partition-by', choices=['skill', 'run'], default='skill', help='Parquet partition key')
+    parser.add_argument('--scheduler', choices=['pool', 'async', 'serial'], default='pool', help='Play games on a process pool, interleave them on asyncio engines, or play them one by one in this process')
+    parser.add_argument('--in-flight', type=int, default=16, help='Games kept running at once by the async scheduler')
+    parser.add_argument('--asymmetric-skills', action='store_true', help='Draw black\'s skill level independently of white\'s')
+    parser.add_argument('--engine-mode', choices=['shared', 'pairs'], default='shared', help='One engine for both sides, or a pre-configured engine per side')
+    parser.add_argument('--max-engines', type=int, default=len(SKILL_LEVELS), help='Skill-level engines kept open per worker in pairs mode')
+    parser.add_argument('--eval-cache', default=None, help='SQLite file caching engine evaluations across games and runs')
+    parser.add_argument('--eval-cache-size', type=int, default=1_000_000, help='Positions kept in the evaluation cache')
+    parser.add_argument('--batch-size', type=int, default=50, help='Games written between two fsynced checkpoints')
+    parser.add_argument('--resume', action='store_true', help='Continue the run recorded in the output manifest')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default=os.environ.get('LOG_LEVEL', 'WARNING'),
+                        help='DEBUG logs every move and evaluation')
+    parser.add_argument('--timings', default=None, help='Append per-game and per-run stage timings to this JSON lines file')
+    parser.add_argument('--archive', default=None, help='Also keep the played games in this archive (.pgn or .moves) for extract.py')
+    parser.add_argument('--trajectory-plies', type=parse_plies, default=[],
+                        help='Comma separated plies, e.g. 10,20,40,60; adds the engine\'s evaluation at each of them and eval_swing')
+    add_adjudication_arguments(parser)
+    parser.add_argument('--adjudication-audit', action='store_true',
+                        help='Play adjudicated games on to their end off the record and time the engine moves saved (needs --timings)')
+    args = parser.parse_args(argv)
+    if args.resume and not os.path.exists(manifest_path(args.output)):
+        parser.error(f"--resume: no manifest found at {manifest_path(args.output)}")
+    if args.adjudication_audit and not args.timings:
+        parser.error('--adjudication-audit reports through --timings')
+    return args
+
+
 # Main function to generate games and write to CSV
-def main():
-    with open('dataset.csv', 'w', newline='') as file:
-        fieldnames = ['result', 'total_moves', 'opening', 'winner', 'white_skill', 'black_skill', 'white_castled', 'black_castled', 'opposite_side_castle', 'white_sacrifices', 'black_sacrifices', 'w_knight_to_bishop', 'b_knight_to_bishop', 'w_center_control', 'b_center_control', 'white_piece_activity', 'black_piece_activity', 'eval_after_move_15']
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-        writer.writeheader()
-    
-        for _ in range(2500):  # Number of games to play
-           
-            white_skill = random.randint(5,20)
-            #black_skill = random.randint(5,20)
-            black_skill = white_skill
-            #white_skill = 12
-            #black_skill = 12
-            game, board, moves, eval_after_move_15 = play_game(engine, white_skill, black_skill)
-            features = extract_features(game, board, moves, white_skill, black_skill, eval_after_move_15)
-            writer.writerow(features)
-
-    engine.quit()
+def main(argv=None):
+    args = parse_args(argv)
+    # Pool workers are forked after this and inherit the logging setup. The
+    # level only applies to the generator, python-chess stays at WARNING.
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s')
+    log.setLevel(args.log_level)
+    sink, manifest, archive = open_dataset(args)
+    seed = manifest['seed']
+    num_games = manifest['config']['games']
+    start = manifest['committed_games']
+    print(f"Generating games {start}-{num_games} with seed {seed} on {args.workers} worker(s)")
+    adjudication = AdjudicationRules.from_dict(manifest['config'].get('adjudication'), audit=args.adjudication_audit)
+
+    timings = RunTimings(args.timings, seed) if args.timings else None
+    adjudicated = collections.Counter()
+    try:
+        game_index = start
+        for features, record in generate_rows(range(start, num_games), seed, args.workers, args.scheduler, args.in_flight,
+                                      manifest['config'].get('asymmetric_skills', False), args.engine_mode, args.max_engines,
+                                      args.eval_cache, args.eval_cache_size, timings, archive is not None,
+                                      manifest['config'].get('trajectory_plies') or [], adjudication):
+            sink.write(features)
+            if features.get('adjudication', 'none') != 'none':
+                adjudicated[features['adjudication']] += 1
+            if archive is not None:
+                archive.write(record)
+            game_index += 1
+            if (game_index - start) % args.batch_size == 0:
+                commit_batch(sink, manifest, args.output, game_index, archive)
+        commit_batch(sink, manifest, args.output, game_index, archive)
+        if adjudication is not None:
+            print(f"Adjudicated {sum(adjudicated.values())} of {game_index - start} games"
+                  + ''.join(f", {count} by {reason}" for reason, count in sorted(adjudicated.items())))
+            if timings is not None and adjudication.audit:
+                print(timings.adjudication_report())
+    finally:
+        sink.close()
+        if archive is not None:
+            archive.close()
+        if timings is not None:
+            timings.close()
 
 if __name__ == "__main__":
     main()
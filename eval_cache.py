@@ -0,0 +1,76 @@
+'''
+Persistent cache of engine evaluations keyed by Zobrist hash and search depth.
+
+Book openings and low skill play send many games through the same
+positions, so an evaluation is looked up here before asking the engine.
+The cache is a SQLite file that several worker processes can share; once it
+holds more than 'max_entries' positions the least recently used ones are
+evicted.
+'''
+import sqlite3
+import time
+
+import chess.polyglot
+
+
+def _signed(key):
+    # SQLite integers are signed 64-bit, Zobrist hashes are unsigned
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+class EvalCache:
+    def __init__(self, path, max_entries=1_000_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS evaluations (
+                key INTEGER NOT NULL,
+                depth INTEGER NOT NULL,
+                score REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (key, depth)
+            )''')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS evaluations_last_used ON evaluations (last_used)')
+        self.connection.commit()
+
+    def get(self, board, depth):
+        """Returns the cached score of 'board' at 'depth', or None."""
+        key = _signed(chess.polyglot.zobrist_hash(board))
+        row = self.connection.execute('SELECT score FROM evaluations WHERE key = ? AND depth = ?', (key, depth)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self.connection:
+            self.connection.execute('UPDATE evaluations SET last_used = ? WHERE key = ? AND depth = ?', (time.time(), key, depth))
+        return row[0]
+
+    def put(self, board, depth, score):
+        key = _signed(chess.polyglot.zobrist_hash(board))
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO evaluations VALUES (?, ?, ?, ?)', (key, depth, score, time.time()))
+        if self.misses % 1000 == 0:
+            self.evict()
+
+    def evict(self):
+        """Drops the least recently used entries beyond 'max_entries'."""
+        with self.connection:
+            (count,) = self.connection.execute('SELECT COUNT(*) FROM evaluations').fetchone()
+            if count > self.max_entries:
+                self.connection.execute('''
+                    DELETE FROM evaluations WHERE rowid IN (
+                        SELECT rowid FROM evaluations ORDER BY last_used LIMIT ?)''', (count - self.max_entries,))
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0
+        return f"eval cache {self.path}: {self.hits}/{lookups} hits ({hit_rate:.1%})"
+
+    def close(self):
+        self.evict()
+        self.connection.close()
@@ -0,0 +1,92 @@
+'''
+Recomputes the games dataset from an archive written with --archive.
+
+Games are replayed through the same FeatureAccumulator and extract_features
+as during generation, without Stockfish, so a new or fixed feature only
+costs a pass over the archive. Batches of archived games are decoded and
+replayed on a process pool and the rows come out in archive order.
+
+    python extract.py games.moves --output dataset.csv
+    python extract.py games.pgn --format parquet --output dataset_parquet
+'''
+import argparse
+import multiprocessing
+import os
+import time
+
+import chess
+
+from dataset_generator import SINKS, FeatureAccumulator, extract_features, opening_classifier
+from game_archive import ARCHIVES, archive_format
+
+
+def features_from_record(record):
+    """Recomputes the feature row of an archived game."""
+    board = chess.Board()
+    accumulator = FeatureAccumulator(evaluation_interval=3)
+    for move in record['moves']:
+        accumulator.push(board, move)
+    return extract_features(None, board, record['moves'], record['white_skill'], record['black_skill'],
+                            record['eval_after_move_15'], accumulator=accumulator, result=record.get('result'))
+
+
+_worker_archive = None
+
+def _init_worker(extension):
+    global _worker_archive
+    _worker_archive = ARCHIVES[extension]
+
+def _extract_item(item):
+    return [features_from_record(record) for record in _worker_archive.decode(item)]
+
+
+def extract_rows(archive_path, workers):
+    """Yields the feature rows of every game in 'archive_path' in archive order."""
+    extension = archive_format(archive_path)
+    archive = ARCHIVES[extension]
+    items = archive.items(archive_path)
+    if workers <= 1:
+        for item in items:
+            for record in archive.decode(item):
+                yield features_from_record(record)
+        return
+
+    # Workers forked after this share the compiled opening table
+    opening_classifier()
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(extension,)) as pool:
+        for rows in pool.imap(_extract_item, items):
+            yield from rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Recompute the games dataset from a game archive.')
+    parser.add_argument('archive', help='Game archive written by dataset_generator.py --archive')
+    parser.add_argument('--output', default='dataset.csv', help='CSV file, or Parquet dataset directory, to write')
+    parser.add_argument('--format', choices=sorted(SINKS), default='csv', help='Output format')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Processes replaying games')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per checkpoint')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Parquet output is partitioned by skill, runs are not known up front
+    manifest = {'seed': 0, 'committed_games': 0, 'config': {'partition_by': 'skill'}}
+    sink = SINKS[args.format](args.output, manifest, resume=False)
+    started = time.perf_counter()
+    games = 0
+    try:
+        for features in extract_rows(args.archive, args.workers):
+            sink.write(features)
+            games += 1
+            if games % args.batch_size == 0:
+                sink.checkpoint(manifest)
+        sink.checkpoint(manifest)
+    finally:
+        sink.close()
+    elapsed = time.perf_counter() - started
+    print(f"Extracted {games} games from {args.archive} in {elapsed:.1f}s ({games / elapsed:.0f} games/sec)")
+
+
+if __name__ == '__main__':
+    main()
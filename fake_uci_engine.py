@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+'''
+Deterministic stand-in for Stockfish that speaks just enough UCI for the generator.
+
+The move it plays only depends on the position, so the same games come out
+no matter how they are scheduled across engine processes. It prefers
+captures to keep games short and reports the material balance as its score.
+
+    STOCKFISH_PATH=./fake_uci_engine.py python dataset_generator.py --games 10
+'''
+import argparse
+import sys
+import time
+
+import chess
+import chess.polyglot
+
+MATERIAL = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 300, chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0}
+
+
+def choose_move(board):
+    moves = sorted(board.legal_moves, key=lambda move: move.uci())
+    captures = [move for move in moves if board.is_capture(move)]
+    candidates = captures or moves
+    return candidates[chess.polyglot.zobrist_hash(board) % len(candidates)]
+
+
+def material_score(board):
+    """Material balance in centipawns from the side to move's point of view."""
+    score = 0
+    for square, piece in board.piece_map().items():
+        value = MATERIAL[piece.piece_type]
+        score += value if piece.color == board.turn else -value
+    return score
+
+
+def parse_position(tokens):
+    if tokens[0] == 'startpos':
+        board = chess.Board()
+        tokens = tokens[1:]
+    else:
+        end = tokens.index('moves') if 'moves' in tokens else len(tokens)
+        board = chess.Board(' '.join(tokens[1:end]))
+        tokens = tokens[end:]
+    if tokens and tokens[0] == 'moves':
+        for uci in tokens[1:]:
+            board.push_uci(uci)
+    return board
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Scripted UCI engine for tests and benchmarks.')
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds to "think" per go command')
+    args = parser.parse_args(argv)
+
+    board = chess.Board()
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        command = tokens[0]
+        if command == 'uci':
+            print('id name FakeUCI')
+            print('id author chess-ml-analysis')
+            print('option name Skill Level type spin default 20 min 0 max 20')
+            print('option name Hash type spin default 16 min 1 max 1024')
+            print('option name Threads type spin default 1 min 1 max 512')
+            print('uciok')
+        elif command == 'isready':
+            print('readyok')
+        elif command == 'position':
+            board = parse_position(tokens[1:])
+        elif command == 'go':
+            if args.delay:
+                time.sleep(args.delay)
+            if board.is_game_over():
+                print('bestmove (none)')
+            else:
+                move = choose_move(board)
+                print(f'info depth 1 seldepth 1 multipv 1 score cp {material_score(board)} nodes 1 pv {move.uci()}')
+                print(f'bestmove {move.uci()}')
+        elif command == 'quit':
+            break
+        # setoption, ucinewgame and anything else need no reply
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+'''
+Raw game archives written next to the generated dataset.
+
+With --archive the generator also keeps every game it plays, with the
+skill levels and engine evaluation extract_features needs, so new or fixed
+features can be computed again by extract.py without replaying the games
+on Stockfish. Two formats are supported, chosen by the archive's extension:
+
+- .pgn: PGN text; the generator's own values go into extra headers (Seed,
+  GameIndex, WhiteSkill, BlackSkill, EvalAfterMove15, BookPlies).
+- .moves: a directory holding every move as a 16-bit code in moves.u16 and
+  one fixed-size index.bin entry per game with its offset into the moves
+  and its metadata. Both files are memory-mapped by MoveArchiveReader, so
+  any game can be fetched by index without parsing.
+'''
+import functools
+import io
+import json
+import os
+import sys
+
+import chess
+import chess.pgn
+import numpy as np
+
+RESULTS = ('*', '1-0', '0-1', '1/2-1/2')
+
+INDEX_DTYPE = np.dtype([
+    ('offset', '<u8'),  # first move in moves.u16
+    ('length', '<u2'),
+    ('seed', '<i8'),
+    ('game_index', '<u4'),
+    ('white_skill', 'u1'),
+    ('black_skill', 'u1'),
+    ('result', 'u1'),  # index into RESULTS
+    ('book_plies', 'u1'),
+    ('eval_after_move_15', '<f8'),  # NaN when the game ended before move 15
+])
+MOVE_DTYPE = np.dtype('<u2')
+FORMAT_VERSION = 1
+
+
+def game_record(seed, game_index, white_skill, black_skill, moves, result, eval_after_move_15, book_plies=0):
+    """Everything needed to recompute a game's feature row."""
+    return {
+        'seed': seed,
+        'game_index': game_index,
+        'white_skill': white_skill,
+        'black_skill': black_skill,
+        'moves': list(moves),
+        'result': result,
+        'eval_after_move_15': eval_after_move_15,
+        'book_plies': book_plies,
+    }
+
+
+def record_to_pgn(record):
+    game = chess.pgn.Game()
+    game.headers['Event'] = 'chess-ml-analysis self-play'
+    game.headers['Round'] = str(record['game_index'])
+    game.headers['White'] = f"Stockfish skill {record['white_skill']}"
+    game.headers['Black'] = f"Stockfish skill {record['black_skill']}"
+    game.headers['Seed'] = str(record['seed'])
+    game.headers['GameIndex'] = str(record['game_index'])
+    game.headers['WhiteSkill'] = str(record['white_skill'])
+    game.headers['BlackSkill'] = str(record['black_skill'])
+    game.headers['EvalAfterMove15'] = '' if record['eval_after_move_15'] is None else repr(record['eval_after_move_15'])
+    game.headers['BookPlies'] = str(record['book_plies'])
+    game.headers['Result'] = record['result']
+    game.add_line(record['moves'])
+    return game
+
+
+def pgn_to_record(game):
+    headers = game.headers
+    eval_after_move_15 = headers.get('EvalAfterMove15', '')
+    return game_record(int(headers['Seed']), int(headers['GameIndex']), int(headers['WhiteSkill']),
+                       int(headers['BlackSkill']), game.mainline_moves(), headers['Result'],
+                       float(eval_after_move_15) if eval_after_move_15 else None, int(headers.get('BookPlies', 0)))
+
+
+# Games handed to an extract.py worker at a time
+BATCH_SIZE = 64
+
+
+class PgnArchive:
+    """Appends game records to a PGN file, checkpointed together with the dataset."""
+
+    def __init__(self, path, manifest, resume):
+        if resume:
+            # Drop games written after the last checkpoint
+            os.truncate(path, manifest['archive_bytes'])
+            self.file = open(path, 'a', encoding='utf-8')
+        else:
+            self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, record):
+        print(record_to_pgn(record), file=self.file, end='\n\n')
+
+    def checkpoint(self, manifest):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        manifest['archive_bytes'] = os.fstat(self.file.fileno()).st_size
+
+    def close(self):
+        self.file.close()
+
+    # extract.py hands batches of archive items to its workers, which decode them
+    @staticmethod
+    def items(path):
+        batch = []
+        for chunk in pgn_chunks(path):
+            batch.append(chunk)
+            if len(batch) == BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def decode(item):
+        return [parse_pgn_chunk(chunk) for chunk in item]
+
+
+def pgn_chunks(path):
+    """Yields the PGN text of each game in 'path' without parsing the moves.
+
+    Splitting is cheap enough for the main process, so the parsing itself
+    can run in extract.py's workers.
+    """
+    lines = []
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if line.startswith('[Event ') and lines:
+                yield ''.join(lines)
+                lines = []
+            lines.append(line)
+    if any(line.strip() for line in lines):
+        yield ''.join(lines)
+
+
+def parse_pgn_chunk(text):
+    return pgn_to_record(chess.pgn.read_game(io.StringIO(text)))
+
+
+def encode_moves(moves):
+    """Packs moves as from | to << 6 | (promotion piece type - 1) << 12."""
+    return np.fromiter((move.from_square | (move.to_square << 6) | ((move.promotion - 1 if move.promotion else 0) << 12)
+                        for move in moves), dtype=MOVE_DTYPE, count=len(moves))
+
+
+def decode_moves(codes):
+    return [chess.Move(code & 0x3f, (code >> 6) & 0x3f, (code >> 12) + 1 if code >> 12 else None)
+            for code in codes.tolist()]
+
+
+class MoveArchive:
+    """Appends game records to a .moves directory, checkpointed together with the dataset."""
+
+    def __init__(self, path, manifest, resume):
+        os.makedirs(path, exist_ok=True)
+        moves_path = os.path.join(path, 'moves.u16')
+        index_path = os.path.join(path, 'index.bin')
+        if resume:
+            # Drop games written after the last checkpoint; the last index
+            # entry that is kept says where its moves end
+            os.truncate(index_path, manifest['archive_bytes'])
+            index = np.fromfile(index_path, dtype=INDEX_DTYPE)
+            self.next_offset = int(index['offset'][-1]) + int(index['length'][-1]) if len(index) else 0
+            os.truncate(moves_path, self.next_offset * MOVE_DTYPE.itemsize)
+            mode = 'ab'
+        else:
+            with open(os.path.join(path, 'format.json'), 'w') as file:
+                json.dump({'version': FORMAT_VERSION, 'index_dtype': INDEX_DTYPE.descr, 'results': RESULTS}, file)
+            self.next_offset = 0
+            mode = 'wb'
+        self.moves_file = open(moves_path, mode)
+        self.index_file = open(index_path, mode)
+
+    def write(self, record):
+        codes = encode_moves(record['moves'])
+        entry = np.zeros(1, dtype=INDEX_DTYPE)
+        entry['offset'] = self.next_offset
+        entry['length'] = len(codes)
+        entry['seed'] = record['seed']
+        entry['game_index'] = record['game_index']
+        entry['white_skill'] = record['white_skill']
+        entry['black_skill'] = record['black_skill']
+        entry['result'] = RESULTS.index(record['result'])
+        entry['book_plies'] = record['book_plies']
+        entry['eval_after_move_15'] = np.nan if record['eval_after_move_15'] is None else record['eval_after_move_15']
+        self.moves_file.write(codes.tobytes())
+        self.index_file.write(entry.tobytes())
+        self.next_offset += len(codes)
+
+    def checkpoint(self, manifest):
+        # Moves first, so a durable index entry never points past them
+        for file in (self.moves_file, self.index_file):
+            file.flush()
+            os.fsync(file.fileno())
+        manifest['archive_bytes'] = os.fstat(self.index_file.fileno()).st_size
+
+    def close(self):
+        self.moves_file.close()
+        self.index_file.close()
+
+    @staticmethod
+    def items(path):
+        games = len(open_move_archive(path))
+        for start in range(0, games, BATCH_SIZE):
+            yield path, start, min(start + BATCH_SIZE, games)
+
+    @staticmethod
+    def decode(item):
+        path, start, stop = item
+        reader = open_move_archive(path)
+        return [reader.record(i) for i in range(start, stop)]
+
+
+class MoveArchiveReader:
+    """Memory-mapped read access to a .moves archive.
+
+    'index' is the structured per-game array (offsets, skills, result, book
+    plies, evaluation) and 'moves' every move code; both are views of the
+    files, so slicing them copies nothing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        index_path = os.path.join(path, 'index.bin')
+        moves_path = os.path.join(path, 'moves.u16')
+        # np.memmap cannot map empty files
+        self.index = np.memmap(index_path, dtype=INDEX_DTYPE, mode='r') if os.path.getsize(index_path) else np.zeros(0, INDEX_DTYPE)
+        self.moves = np.memmap(moves_path, dtype=MOVE_DTYPE, mode='r') if os.path.getsize(moves_path) else np.zeros(0, MOVE_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    def move_codes(self, i):
+        """The 16-bit move codes of game 'i', as a view of the archive."""
+        offset = int(self.index['offset'][i])
+        return self.moves[offset:offset + int(self.index['length'][i])]
+
+    def batch(self, start, stop):
+        """Move codes of games start..stop as one view, with each game's (offset, length) relative to it."""
+        entries = self.index[start:stop]
+        if not len(entries):
+            return self.moves[:0], np.zeros((0, 2), dtype=np.int64)
+        first = int(entries['offset'][0])
+        end = int(entries['offset'][-1]) + int(entries['length'][-1])
+        spans = np.stack([entries['offset'].astype(np.int64) - first, entries['length'].astype(np.int64)], axis=1)
+        return self.moves[first:end], spans
+
+    def record(self, i):
+        entry = self.index[i]
+        eval_after_move_15 = float(entry['eval_after_move_15'])
+        return game_record(int(entry['seed']), int(entry['game_index']), int(entry['white_skill']),
+                           int(entry['black_skill']), decode_moves(self.move_codes(i)), RESULTS[entry['result']],
+                           None if np.isnan(eval_after_move_15) else eval_after_move_15, int(entry['book_plies']))
+
+    def game(self, i):
+        """Game 'i' as a chess.pgn.Game."""
+        return record_to_pgn(self.record(i))
+
+
+@functools.lru_cache(maxsize=8)
+def open_move_archive(path):
+    """Returns a MoveArchiveReader for 'path', mapped once per process."""
+    return MoveArchiveReader(path)
+
+
+ARCHIVES = {'.pgn': PgnArchive, '.moves': MoveArchive}
+
+
+def archive_format(path):
+    extension = os.path.splitext(os.path.normpath(path))[1].lower()
+    if extension not in ARCHIVES:
+        raise ValueError(f"Unknown archive format for {path}; expected one of {', '.join(sorted(ARCHIVES))}")
+    return extension
+
+
+def open_archive(path, manifest, resume):
+    return ARCHIVES[archive_format(path)](path, manifest, resume)
+
+
+def read_archive(path):
+    """Yields the game records of an archive in order."""
+    archive = ARCHIVES[archive_format(path)]
+    for item in archive.items(path):
+        yield from archive.decode(item)
+
+
+def convert_archive(source, target):
+    """Copies every game of archive 'source' into a new archive 'target', e.g. PGN to .moves."""
+    manifest = {}
+    archive = open_archive(target, manifest, resume=False)
+    try:
+        for record in read_archive(source):
+            archive.write(record)
+        archive.checkpoint(manifest)
+    finally:
+        archive.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('usage: python game_archive.py SOURCE TARGET  (e.g. games.pgn games.moves)')
+    convert_archive(sys.argv[1], sys.argv[2])
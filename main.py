@@ -1,67 +1,129 @@
-from data_prep import load_data, preprocess_data, split_data
-from model_operations import train_random_forest, train_naive_bayes, train_logistic_regression, train_svm, evaluate_model
-from sklearn.metrics import confusion_matrix
-import seaborn as sns
-import matplotlib.pyplot as plt
-from sklearn.metrics import classification_report, accuracy_score
-from sklearn.metrics import roc_curve, auc, precision_recall_curve, average_precision_score
+import argparse
+import collections
+import time
+from data_prep import load_splits, load_splits_compact, iter_chunks, test_rows, MemoryReport, StreamingPreprocessor
+from model_operations import TRAINERS, INCREMENTAL_MODELS, partial_fit_batches, evaluate_streaming, save_model
+from model_comparison import core_budgets, train_models, leaderboard, print_leaderboard
+from split_cache import SPLIT_CACHE_DIR, SplitCache
 import numpy as np
-import pandas as pd
 
 
-
-
-
-def plot_feature_importance(model, X_train):
-    importances = model.feature_importances_
-    indices = np.argsort(importances)[::-1]
-
-    plt.figure(figsize=(10, 6))
-    plt.title("Feature Importance")
-    plt.bar(range(X_train.shape[1]), importances[indices], align="center")
-    plt.xticks(range(X_train.shape[1]), X_train.columns[indices], rotation=90)
-    plt.tight_layout()
-    plt.show()
-
-def plot_manual_feature_importance(coefficients, feature_names):
-    feat_importances = pd.Series(coefficients, index=feature_names)
-    feat_importances.nlargest(20).plot(kind='barh', title='Feature Importance')
-    plt.xlabel('Coefficient Magnitude')
-    plt.ylabel('Feature')
-    plt.show()
-
-def plot_confusion_matrix(y_true, y_pred):
-    cm = confusion_matrix(y_true, y_pred)
-    sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', xticklabels=['White wins', 'Black wins', 'Draw'], yticklabels=['White wins', 'Black wins', 'Draw'])
-    plt.title('Detailed Confusion Matrix')
-    plt.xlabel('Predicted Label')
-    plt.ylabel('True Label')
-    plt.show()
-
-
-
-
-def print_classification_report(y_true, y_pred):
-    report = classification_report(y_true, y_pred)
-    print(report)
-
-
-def main():
-    df = load_data('chess_games_dataset_2500.csv')
-    df = preprocess_data(df)
-    X_train, X_test, y_train, y_test = split_data(df)
-    
-    model = train_svm(X_train, y_train)
-    #accuracy = evaluate_model(model, X_test, y_test)
-    predictions = model.predict(X_test)
-    plot_confusion_matrix(y_test, predictions)
-    #plot_feature_importance(model,X_train)
-    plot_manual_feature_importance(model.coef_[0], X_train.columns)    
-    print_classification_report(y_test, predictions)
-
-    accuracy = evaluate_model(model,X_test,y_test)
-    
-    print(f'Accuracy on test data: {accuracy}')
+def train_out_of_core(filepath, model_name='sgd', chunksize=100_000, epochs=1):
+    """Trains an incremental model holding one chunk of the dataset in memory at a time.
+
+    A first pass fits the StreamingPreprocessor and counts the training
+    classes, then every epoch streams the training rows through
+    partial_fit and a last pass scores the test rows.
+    """
+    preprocessor = StreamingPreprocessor()
+    class_counts = collections.Counter()
+    for chunk in iter_chunks(filepath, chunksize):
+        preprocessor.partial_fit(chunk)
+        class_counts.update(StreamingPreprocessor.clean(chunk[~test_rows(chunk.index)])['result'])
+    preprocessor.finish()
+
+    classes = np.array(sorted(class_counts))
+    total = sum(class_counts.values())
+    # Balanced class weights, in place of SMOTE
+    class_weight = {label: total / (len(classes) * count) for label, count in class_counts.items()}
+
+    def batches(test):
+        for chunk in iter_chunks(filepath, chunksize):
+            is_test = test_rows(chunk.index)
+            yield preprocessor.transform(chunk[is_test if test else ~is_test])
+
+    model = INCREMENTAL_MODELS[model_name]()
+    for _ in range(epochs):
+        partial_fit_batches(model, batches(test=False), classes, class_weight)
+    metrics = evaluate_streaming(model, batches(test=True), classes)
+    print(metrics.report())
+    return model, preprocessor, metrics
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Train and evaluate a game outcome model.')
+    parser.add_argument('dataset', nargs='?', default='chess_games_dataset_2500.csv', help='CSV file or Parquet dataset')
+    parser.add_argument('--stream', action='store_true', help='Train out of core, one chunk at a time')
+    parser.add_argument('--model', choices=sorted(INCREMENTAL_MODELS), default='sgd', help='Incremental model for --stream')
+    parser.add_argument('--chunksize', type=int, default=100_000, help='Rows per chunk for --stream')
+    parser.add_argument('--epochs', type=int, default=1, help='Passes over the training rows for --stream')
+    parser.add_argument('--compact', action='store_true',
+                        help='Load into categorical, small integer and float32 columns, scaled in place')
+    parser.add_argument('--memory-report', action='store_true', help='Print the peak memory of loading, preprocessing and splitting')
+    parser.add_argument('--split-cache', default=SPLIT_CACHE_DIR, help='Directory caching preprocessed splits between runs')
+    parser.add_argument('--split-cache-size', type=int, default=1024, help='Megabytes of splits kept in --split-cache')
+    parser.add_argument('--no-split-cache', action='store_true', help='Always load, preprocess and split the dataset')
+    parser.add_argument('--models', default='svm', help=f"Comma separated models to train and report: {', '.join(TRAINERS)} or all")
+    parser.add_argument('--assets', default=None, help='Directory the report PNGs are written to (default: assets/ next to main.py)')
+    parser.add_argument('--jobs', type=int, default=-1, help='Processes evaluating the models (-1: all cores)')
+    parser.add_argument('--budget', default='', metavar='MODEL=CORES,...',
+                        help='Cores a model may train on, e.g. random_forest=6 (default: the cores left by the others)')
+    parser.add_argument('--leaderboard', metavar='PATH', help='Also write the leaderboard to this CSV')
+    parser.add_argument('--save-model', metavar='PATH', help='Save the trained model and its preprocessing for predict.py; '
+                                                              'with several models, PATH must contain {name}')
+    args = parser.parse_args(argv)
+    args.models = list(TRAINERS) if args.models == 'all' else args.models.split(',')
+    for name in args.models:
+        if name not in TRAINERS:
+            parser.error(f"unknown model {name}; choose from {', '.join(TRAINERS)} or all")
+    try:
+        args.budget = {name: int(cores) for name, cores in (entry.split('=') for entry in args.budget.split(',') if entry)}
+    except ValueError:
+        parser.error('--budget takes MODEL=CORES pairs separated by commas')
+    if args.save_model and len(args.models) > 1 and '{name}' not in args.save_model:
+        parser.error('--save-model needs a {name} placeholder when training several models')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.stream:
+        model, preprocessor, metrics = train_out_of_core(args.dataset, args.model, args.chunksize, args.epochs)
+        if args.save_model:
+            save_model(args.save_model, model, preprocessor.preprocessor(), dataset=args.dataset,
+                       accuracy=float(metrics.accuracy))
+            print(f"Saved model to {args.save_model}")
+        return
+
+    memory = MemoryReport() if args.memory_report else None
+    started = time.perf_counter()
+    if args.no_split_cache:
+        load = load_splits_compact if args.compact else load_splits
+        X_train, X_test, y_train, y_test, preprocessor = load(args.dataset, memory)
+    else:
+        cache = SplitCache(args.split_cache, args.split_cache_size * 2 ** 20)
+        (X_train, X_test, y_train, y_test, preprocessor), hit = cache.load(args.dataset, args.compact, memory)
+        print(f"{'Loaded' if hit else 'Prepared and cached'} the splits in {1000 * (time.perf_counter() - started):.0f} ms")
+    if memory is not None:
+        memory.stop()
+        print(memory.report())
+
+    budgets = core_budgets(args.models, overrides=args.budget)
+    started = time.perf_counter()
+    trained = train_models(args.models, X_train, y_train, budgets)
+    print(f"Trained {', '.join(args.models)} in {time.perf_counter() - started:.1f}s")
+    models = {name: model for name, (model, _) in trained.items()}
+
+    # Plots render in the background while the remaining reports print and models save
+    from reporting import ASSETS_DIR, ReportRenderer, evaluate_models
+    args.assets = args.assets or ASSETS_DIR
+    with ReportRenderer(args.assets) as renderer:
+        reports = evaluate_models(models, X_test, y_test, n_jobs=args.jobs)
+        for name, metrics in reports.items():
+            renderer.submit(name, metrics)
+            print(f"\n{name}")
+            print(metrics['report'])
+            print(f'Accuracy on test data: {metrics["accuracy"]}')
+            if args.save_model:
+                path = args.save_model.format(name=name)
+                save_model(path, models[name], preprocessor, dataset=args.dataset, accuracy=float(metrics['accuracy']))
+                print(f"Saved model to {path}")
+        board = leaderboard(trained, reports, X_test, budgets)
+        print()
+        print_leaderboard(board)
+        if args.leaderboard:
+            board.to_csv(args.leaderboard, index=False)
+    print(f"\nWrote {len(renderer.futures)} plots to {args.assets}")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,86 @@
+'''
+Trains several models concurrently on one preprocessed split and ranks them.
+
+Every model fits in its own process with its own core budget: trainers in
+PARALLEL_TRAINERS get n_jobs, and BLAS threads are capped at the budget
+for all of them, so concurrent fits do not oversubscribe the machine. The
+training arrays are handed to the processes as read-only memory maps by
+joblib rather than copied into each one. The leaderboard ranks the models
+by test accuracy, with their fit time, predict latency and pickled size.
+'''
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from threadpoolctl import threadpool_limits
+
+from model_operations import PARALLEL_TRAINERS, TRAINERS
+
+
+def core_budgets(names, total=None, overrides=None):
+    """Returns the cores each model may use: one for serial trainers, the rest shared by parallel ones."""
+    total = total or os.cpu_count() or 1
+    overrides = overrides or {}
+    parallel = [name for name in names if name in PARALLEL_TRAINERS and name not in overrides]
+    spare = total - sum(overrides.values()) - sum(1 for name in names if name not in PARALLEL_TRAINERS and name not in overrides)
+    share = max(1, spare // len(parallel)) if parallel else 1
+    return {name: overrides.get(name, share if name in parallel else 1) for name in names}
+
+
+def _fit(name, X_train, y_train, n_jobs):
+    kwargs = {'n_jobs': n_jobs} if name in PARALLEL_TRAINERS else {}
+    started = time.perf_counter()
+    with threadpool_limits(limits=n_jobs):
+        model = TRAINERS[name](X_train, y_train, **kwargs)
+    return model, time.perf_counter() - started
+
+
+def train_models(names, X_train, y_train, budgets):
+    """Fits the named models at the same time, one process each, and returns {name: (model, fit seconds)}."""
+    # Arrays above max_nbytes reach the workers as read-only memory maps.
+    # With fewer cores than models the rest wait rather than time-share.
+    workers = min(len(names), sum(budgets.values()), os.cpu_count() or 1)
+    results = Parallel(n_jobs=workers, max_nbytes='1M', mmap_mode='r')(
+        delayed(_fit)(name, X_train, y_train, budgets[name]) for name in names)
+    return dict(zip(names, results))
+
+
+def row_latency_ms(model, X, repeat=25):
+    """Median wall time of predicting a single row, as a serving request would."""
+    row = X.iloc[:1]
+    model.predict(row)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        model.predict(row)
+        timings.append((time.perf_counter() - started) * 1000)
+    return float(np.median(timings))
+
+
+def model_size(model):
+    """Bytes the model takes pickled, i.e. on disk and on the way to a worker."""
+    return len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def leaderboard(trained, reports, X_test, budgets):
+    """Ranks the models by test accuracy; 'trained' and 'reports' come from train_models and evaluate_models."""
+    rows = []
+    for name, (model, fit_seconds) in trained.items():
+        metrics = reports[name]
+        rows.append({
+            'model': name,
+            'accuracy': metrics['accuracy'],
+            'fit_s': fit_seconds,
+            'predict_us_per_row': 1e6 * metrics['predict_seconds'] / len(X_test),
+            'row_latency_ms': row_latency_ms(model, X_test),
+            'size_kb': model_size(model) / 1024,
+            'n_jobs': budgets[name],
+        })
+    return pd.DataFrame(rows).sort_values('accuracy', ascending=False, ignore_index=True)
+
+
+def print_leaderboard(board):
+    print(board.to_string(index=False, float_format=lambda value: f'{value:.4f}'))
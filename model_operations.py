@@ -1,102 +1,198 @@
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.linear_model import LogisticRegression
-from sklearn.naive_bayes import GaussianNB
-from sklearn.svm import SVC
-from sklearn.metrics import accuracy_score, roc_curve, auc
-import matplotlib.pyplot as plt
-from sklearn.preprocessing import label_binarize
-from sklearn.model_selection import GridSearchCV
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.linear_model import LogisticRegression
-from sklearn.svm import SVC
-
-def train_random_forest(X_train, y_train):
-    model = RandomForestClassifier(n_estimators=100)
+import os
+import time
+import warnings
+
+import joblib
+import numpy as np
+# Importing any part of scikit-learn loads scipy.stats (about a second), so
+# estimators are imported by the functions that fit them and e.g. --help
+# never pays for it
+from data_prep import PREPROCESSOR_VERSION
+from tuning import TUNING_CACHE_PATH, halving_search
+
+def train_random_forest(X_train, y_train, n_jobs=None):
+    from sklearn.ensemble import RandomForestClassifier
+    model = RandomForestClassifier(n_estimators=100, n_jobs=n_jobs)
     model.fit(X_train, y_train)
     return model
 
 def train_naive_bayes(X_train, y_train):
+    from sklearn.naive_bayes import GaussianNB
     model = GaussianNB()
     model.fit(X_train, y_train)  
     return model
 
 
 def train_logistic_regression(X_train, y_train):
+    from sklearn.linear_model import LogisticRegression
     model = LogisticRegression()
     model.fit(X_train, y_train)
     return model
 
 def train_svm(X_train, y_train):
+    from sklearn.svm import SVC
     svm = SVC(kernel='linear', probability=True)  #'linear', 'rbf', 'poly'
     svm.fit(X_train, y_train)
     return svm
 
+# Models main.py can train, by the name their report files start with
+TRAINERS = {
+    'random_forest': train_random_forest,
+    'naive_bayes': train_naive_bayes,
+    'log': train_logistic_regression,
+    'svm': train_svm,
+}
+# Trainers that spread their fit over n_jobs cores; the others fit on one
+PARALLEL_TRAINERS = {'random_forest'}
+
+def sgd_classifier():
+    from sklearn.linear_model import SGDClassifier
+    return SGDClassifier(loss='log_loss', random_state=11)
+
+def gaussian_nb():
+    from sklearn.naive_bayes import GaussianNB
+    return GaussianNB()
+
+# Learners that can be trained one chunk at a time with partial_fit
+INCREMENTAL_MODELS = {
+    'sgd': sgd_classifier,
+    'naive_bayes': gaussian_nb,
+}
+
+def partial_fit_batches(model, batches, classes, class_weight=None):
+    """Trains an incremental learner on an iterable of (X, y) batches.
+
+    'class_weight' maps a class to a sample weight; it stands in for the
+    SMOTE oversampling of split_data, which needs the whole training set.
+    """
+    for X, y in batches:
+        if not len(y):
+            continue
+        sample_weight = y.map(class_weight).to_numpy() if class_weight else None
+        model.partial_fit(X, y, classes=classes, sample_weight=sample_weight)
+    return model
+
+class StreamingMetrics:
+    """Accuracy and a confusion matrix accumulated over test batches."""
+
+    def __init__(self, classes):
+        self.classes = list(classes)
+        self.confusion = np.zeros((len(self.classes), len(self.classes)), dtype=np.int64)
+
+    def update(self, y_true, y_pred):
+        true_codes = np.searchsorted(self.classes, y_true)
+        pred_codes = np.searchsorted(self.classes, y_pred)
+        np.add.at(self.confusion, (true_codes, pred_codes), 1)
+
+    @property
+    def accuracy(self):
+        total = self.confusion.sum()
+        return np.trace(self.confusion) / total if total else 0.0
+
+    def report(self):
+        lines = [f"{'class':<10}{'precision':>10}{'recall':>10}{'support':>10}"]
+        for i, label in enumerate(self.classes):
+            predicted = self.confusion[:, i].sum()
+            support = self.confusion[i].sum()
+            precision = self.confusion[i, i] / predicted if predicted else 0.0
+            recall = self.confusion[i, i] / support if support else 0.0
+            lines.append(f"{label:<10}{precision:>10.2f}{recall:>10.2f}{support:>10}")
+        lines.append(f"accuracy {self.accuracy:.4f} on {self.confusion.sum()} rows")
+        return '\n'.join(lines)
+
+def evaluate_streaming(model, batches, classes):
+    """Scores a model on an iterable of (X, y) test batches without holding them all."""
+    metrics = StreamingMetrics(classes)
+    for X, y in batches:
+        if len(y):
+            metrics.update(y, model.predict(X))
+    return metrics
+
 def predict(model, X_test):
     return model.predict(X_test)
 
-def evaluate_model(model, X_test, y_test):
-    predictions = model.predict(X_test)
-    accuracy = accuracy_score(y_test, predictions)
-    
-    # Binarize the labels for each class using one-hot encoding
-    y_test_binarized = label_binarize(y_test, classes=model.classes_)
-    
-    # Define mappings for class labels to make it clearer
-    class_mappings = {
-        0: "0-1",
-        1: "1-0",
-        2: "1/2-1/2"
+# Bumped whenever the layout of a saved model changes
+MODEL_FORMAT_VERSION = 1
+
+def save_model(path, model, preprocessor, **metadata):
+    """Saves a trained model with the Preprocessor its training rows went through.
+
+    'metadata' (e.g. the dataset and the test accuracy) is stored alongside
+    for whoever loads the model later.
+    """
+    import sklearn
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    artifact = {
+        'format_version': MODEL_FORMAT_VERSION,
+        'preprocessor_version': preprocessor.version,
+        'sklearn_version': sklearn.__version__,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'model': model,
+        'preprocessor': preprocessor,
+        'metadata': metadata,
     }
-    
-    # Compute predicted probabilities for each class
-    y_probs = model.predict_proba(X_test)
-    
-    # Compute ROC curve and AUC for each class
-    plt.figure(figsize=(8, 6))
-    for i in range(len(model.classes_)):
-        fpr, tpr, _ = roc_curve(y_test_binarized[:, i], y_probs[:, i])
-        roc_auc = auc(fpr, tpr)
-        plt.plot(fpr, tpr, lw=2, label='ROC curve (area = %0.2f) for %s' % (roc_auc, class_mappings[i]))
-    
-    # Plot ROC curve for random guessing
-    plt.plot([0, 1], [0, 1], color='navy', lw=2, linestyle='--')
-    
-    # Set plot labels and legend
-    plt.xlim([0.0, 1.0])
-    plt.ylim([0.0, 1.05])
-    plt.xlabel('False Positive Rate')
-    plt.ylabel('True Positive Rate')
-    plt.title('Receiver Operating Characteristic (ROC) Curve for Multi-class')
-    plt.legend(loc="lower right")
-    plt.show()
-    
-    return accuracy
-
-def tune_random_forest(X_train, y_train):
+    joblib.dump(artifact, path)
+
+def load_model(path):
+    """Loads a model saved by save_model and returns its artifact dict.
+
+    Raises ValueError for artifacts written by an incompatible version of
+    this code; a different scikit-learn version only warns.
+    """
+    import sklearn
+    artifact = joblib.load(path)
+    if artifact.get('format_version') != MODEL_FORMAT_VERSION:
+        raise ValueError(f"{path} has model format {artifact.get('format_version')}, expected {MODEL_FORMAT_VERSION}")
+    if artifact['preprocessor_version'] != PREPROCESSOR_VERSION:
+        raise ValueError(f"{path} was preprocessed with version {artifact['preprocessor_version']}, "
+                         f"expected {PREPROCESSOR_VERSION}; retrain the model")
+    if artifact['sklearn_version'] != sklearn.__version__:
+        warnings.warn(f"{path} was saved with scikit-learn {artifact['sklearn_version']}, "
+                      f"running {sklearn.__version__}")
+    return artifact
+
+def evaluate_model(model, X_test, y_test, name='model', output_dir=None):
+    """Returns the test accuracy of a model and writes its report plots to output_dir/<name>_*.png (default assets/)."""
+    from reporting import ASSETS_DIR, ReportRenderer, evaluate
+    metrics = evaluate(model, X_test, y_test)
+    with ReportRenderer(output_dir or ASSETS_DIR) as renderer:
+        renderer.submit(name, metrics)
+    return metrics['accuracy']
+
+# The searches run their folds on all cores and keep fold scores in
+# tuning.TUNING_CACHE_PATH, so tuning the same training set again only fits
+# configurations it has not seen. Pass cache_path=None to skip the cache.
+def tune_random_forest(X_train, y_train, n_jobs=-1, cache_path=TUNING_CACHE_PATH):
+    from sklearn.ensemble import RandomForestClassifier
     param_grid = {
         'n_estimators': [50, 100, 200],
         'max_depth': [5, 10, 20],
         'min_samples_split': [2, 5, 10]
     }
-    grid_search = GridSearchCV(RandomForestClassifier(), param_grid, cv=5, scoring='accuracy')
-    grid_search.fit(X_train, y_train)
-    return grid_search.best_estimator_
+    return halving_search(RandomForestClassifier(random_state=11), param_grid, X_train, y_train,
+                          n_jobs=n_jobs, cache_path=cache_path)
 
-def tune_logistic_regression(X_train, y_train):
+def tune_logistic_regression(X_train, y_train, n_jobs=-1, cache_path=TUNING_CACHE_PATH):
+    from sklearn.linear_model import LogisticRegression
     param_grid = {
         'C': [0.1, 1, 10],
-        'penalty': ['l1', 'l2']
+        # l2 and l1; 'penalty' is deprecated in favour of the elastic-net mix
+        'l1_ratio': [0.0, 1.0]
     }
-    grid_search = GridSearchCV(LogisticRegression(), param_grid, cv=5, scoring='accuracy')
-    grid_search.fit(X_train, y_train)
-    return grid_search.best_estimator_
+    # saga is the multiclass solver that supports both penalties
+    return halving_search(LogisticRegression(solver='saga', max_iter=1000), param_grid, X_train, y_train,
+                          n_jobs=n_jobs, cache_path=cache_path)
 
-def tune_svm(X_train, y_train):
+def tune_svm(X_train, y_train, n_jobs=-1, cache_path=TUNING_CACHE_PATH):
+    from sklearn.svm import SVC
     param_grid = {
         'kernel': ['linear', 'rbf', 'poly'],
         'C': [0.1, 1, 10],
         'gamma': ['scale', 'auto']
     }
-    grid_search = GridSearchCV(SVC(probability=True), param_grid, cv=5, scoring='accuracy')
-    grid_search.fit(X_train, y_train)
-    return grid_search.best_estimator_
+    # Accuracy does not need probabilities; only the refitted model pays for
+    # the internal cross-validation behind probability=True
+    return halving_search(SVC(), param_grid, X_train, y_train, n_jobs=n_jobs, cache_path=cache_path,
+                          refit_params={'probability': True})
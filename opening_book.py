@@ -0,0 +1,121 @@
+'''
+In-memory index of a Polyglot opening book.
+
+The book is read once into sorted NumPy arrays of keys, raw moves and
+weights, so a lookup is a binary search in memory instead of a file open
+and mmap reads per game. Books are cached per path; pool workers forked
+after the first load share the arrays read-only.
+'''
+import functools
+import random as _random
+
+import chess
+import chess.polyglot
+import numpy as np
+
+ENTRY_DTYPE = np.dtype([('key', '>u8'), ('raw_move', '>u2'), ('weight', '>u2'), ('learn', '>u4')])
+
+
+def _decode_move(board, raw_move):
+    # Same decoding as chess.polyglot.MemoryMappedReader
+    to_square = raw_move & 0x3f
+    from_square = (raw_move >> 6) & 0x3f
+    promotion_part = (raw_move >> 12) & 0x7
+    promotion = promotion_part + 1 if promotion_part else None
+    drop = None
+    if from_square == to_square:
+        promotion, drop = None, promotion
+    # Polyglot encodes castling as king-takes-rook
+    return board._from_chess960(board.chess960, from_square, to_square, promotion, drop)
+
+
+class OpeningBook:
+    """A Polyglot book held in memory, with the lookups play_game needs."""
+
+    def __init__(self, path):
+        entries = np.fromfile(path, dtype=ENTRY_DTYPE)
+        self.path = path
+        self.keys = entries['key'].astype(np.uint64)
+        self.raw_moves = entries['raw_move'].astype(np.uint16)
+        self.weights = entries['weight'].astype(np.uint16)
+        self.learn = entries['learn'].astype(np.uint32)
+
+    def __len__(self):
+        return len(self.keys)
+
+    # The book is shared, so 'with' blocks written for open_reader leave it open
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def _candidates(self, board, minimum_weight):
+        key = chess.polyglot.zobrist_hash(board)
+        start = int(np.searchsorted(self.keys, np.uint64(key), side='left'))
+        end = int(np.searchsorted(self.keys, np.uint64(key), side='right'))
+        entries = zip(self.raw_moves[start:end].tolist(), self.weights[start:end].tolist(), self.learn[start:end].tolist())
+        return key, [entry for entry in entries if entry[1] >= minimum_weight]
+
+    def find_all(self, board, minimum_weight=1):
+        """Yields the legal book entries for 'board' in file order."""
+        key, candidates = self._candidates(board, minimum_weight)
+        for raw_move, weight, learn in candidates:
+            move = _decode_move(board, raw_move)
+            if board.is_legal(move):
+                yield chess.polyglot.Entry(key, raw_move, weight, learn, move)
+
+    def choice(self, board, minimum_weight=1, random=None):
+        """Uniformly picks a book entry, drawing from 'random' exactly like
+        chess.polyglot.MemoryMappedReader.choice.
+
+        :raises: :exc:`IndexError` if no entries are found.
+        """
+        randint = (random or _random).randint
+        key, candidates = self._candidates(board, minimum_weight)
+        chosen = None
+        for i, candidate in enumerate(candidates):
+            if chosen is None or randint(0, i) == i:
+                chosen = candidate
+        if chosen is None:
+            raise IndexError()
+
+        raw_move, weight, learn = chosen
+        move = _decode_move(board, raw_move)
+        if board.is_legal(move):
+            return chess.polyglot.Entry(key, raw_move, weight, learn, move)
+
+        # Only a Zobrist collision puts an illegal move under this key, so the
+        # legality of every entry is only checked when it happens
+        chosen_entry = None
+        for i, entry in enumerate(self.find_all(board, minimum_weight)):
+            if chosen_entry is None or randint(0, i) == i:
+                chosen_entry = entry
+        if chosen_entry is None:
+            raise IndexError()
+        return chosen_entry
+
+    def weighted_choice(self, board, *, exclude_moves=(), random=None):
+        """Picks a book entry with probability proportional to its weight,
+        drawing from 'random' exactly like
+        chess.polyglot.MemoryMappedReader.weighted_choice.
+
+        :raises: :exc:`IndexError` if no entries are found.
+        """
+        entries = [entry for entry in self.find_all(board) if entry.move not in exclude_moves]
+        total_weights = sum(entry.weight for entry in entries)
+        if not total_weights:
+            raise IndexError()
+
+        choice = (random or _random).randint(0, total_weights - 1)
+        current_sum = 0
+        for entry in entries:
+            current_sum += entry.weight
+            if current_sum > choice:
+                return entry
+
+
+@functools.lru_cache(maxsize=None)
+def load_opening_book(path):
+    """Returns the OpeningBook for 'path', reading the file on first use only."""
+    return OpeningBook(path)
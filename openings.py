@@ -0,0 +1,224 @@
+'''
+Opening classification by position rather than by move order.
+
+Every line of an opening table is replayed once when the table is loaded
+and its positions are stored under a transposition key, so games that
+reach a named position through a different move order still get its name.
+A game is classified by the last named table position it passes through.
+Positions are looked up up to the depth of the table's longest line, so a
+game may leave the table and come back to it by transposition, until it
+has moved a pawn, lost a castling right or lost material that every named
+position still has.
+
+Tables are either the nested openings_tree dict from dataset_generator or
+ECO files in the lichess chess-openings TSV format (eco, name, pgn columns).
+'''
+import csv
+import os
+
+import chess
+
+UNKNOWN = "Unknown"
+
+
+def position_key(board):
+    """Identifies a position independently of the moves that led to it."""
+    return (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+            board.occupied_co[chess.WHITE], board.turn, board.castling_rights)
+
+
+# Pawns on their start squares; once a pawn leaves them it never comes back
+HOME_PAWNS = {chess.WHITE: chess.BB_RANK_2, chess.BLACK: chess.BB_RANK_7}
+
+
+def reach_key(board):
+    """What a position keeps from the start: unmoved pawns, castling rights and material per side.
+
+    None of them is ever regained, so a position can only lead to
+    positions whose reach_key it covers.
+    """
+    white, black = board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK]
+    home_pawns = board.pawns & ((white & HOME_PAWNS[chess.WHITE]) | (black & HOME_PAWNS[chess.BLACK]))
+    return home_pawns, board.castling_rights, chess.popcount(white), chess.popcount(black)
+
+
+def covers(key, target):
+    """Whether a position with reach_key 'key' may still lead to one with reach_key 'target'."""
+    return (not target[0] & ~key[0] and not target[1] & ~key[1]
+            and target[2] <= key[2] and target[3] <= key[3])
+
+
+def tree_lines(tree, prefix=()):
+    """Flattens an openings_tree style dict into (name, moves) lines."""
+    for move_uci, node in tree.items():
+        if move_uci == 'name':
+            continue
+        moves = prefix + (chess.Move.from_uci(move_uci),)
+        if isinstance(node, dict):
+            if 'name' in node:
+                yield node['name'], moves
+            yield from tree_lines(node, moves)
+        else:
+            yield node, moves
+
+
+def eco_lines(path):
+    """Reads (name, moves) lines from ECO TSV files; 'path' may be a file or a directory of them."""
+    paths = [path]
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.tsv'))
+    for tsv_path in paths:
+        with open(tsv_path, newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file, delimiter='\t'):
+                board = chess.Board()
+                for token in row['pgn'].split():
+                    # Skip move numbers such as "1." and "12..."
+                    if not token.rstrip('.').isdigit():
+                        board.push_san(token)
+                yield row['name'], tuple(board.move_stack)
+
+
+# Node id of the start position, the edge target for positions off the
+# table once the memo is full, and for positions no named one is reachable from
+ROOT = 0
+OFF_TABLE = -1
+UNREACHABLE = -2
+# Positions off the table memoized as nodes; past it they are looked up ply by ply
+MAX_MEMO_NODES = 100_000
+
+
+def move_code(move):
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+class OpeningTracker:
+    """Follows one game ply by ply; FeatureAccumulator feeds it the played positions."""
+
+    def __init__(self, classifier):
+        self.classifier = classifier
+        self.node = ROOT
+        self.name = UNKNOWN
+        self.plies_left = classifier.max_plies
+
+    def push(self, board):
+        if not self.plies_left:
+            return
+        self.node = self.classifier.step(self.node, board.peek(), board)
+        if self.node == UNREACHABLE:
+            self.plies_left = 0
+            return
+        self.plies_left -= 1
+        if self.node != OFF_TABLE:
+            self.name = self.classifier.names[self.node] or self.name
+
+
+class OpeningClassifier:
+    """Opening table compiled into a flat trie of positions.
+
+    Every position on a table line gets a node id, and 'edges' maps
+    (node, move) to the node it leads to. Following the table's own move
+    order costs one dict lookup per ply. A move that is not a table edge
+    is checked once by its resulting position, which catches
+    transpositions, and the answer is memoized as a new edge. Positions
+    off the table become unnamed nodes of their own, up to
+    MAX_MEMO_NODES, so a game that leaves the table the way an earlier
+    one did is followed by edges too. Positions are followed up to
+    'max_plies', the length of the longest line, and no further once no
+    named position is reachable from them.
+    """
+
+    def __init__(self, lines):
+        self.node_ids = {position_key(chess.Board()): ROOT}
+        self.names = [None]
+        self.edges = {}
+        self.max_plies = 0
+        named_keys = set()
+        for name, moves in lines:
+            self.max_plies = max(self.max_plies, len(moves))
+            board = chess.Board()
+            node = ROOT
+            for move in moves:
+                board.push(move)
+                child = self.node_ids.setdefault(position_key(board), len(self.names))
+                if child == len(self.names):
+                    self.names.append(None)
+                self.edges[(node << 16) | move_code(move)] = child
+                node = child
+            if self.names[node] is None:
+                self.names[node] = name
+            named_keys.add(reach_key(board))
+        self.table_nodes = len(self.names)
+        self.named_keys = list(named_keys)
+        # reach_key -> whether a named position is reachable from it
+        self.reachable = {}
+
+    def __len__(self):
+        return sum(name is not None for name in self.names)
+
+    def step(self, node, move, board):
+        """Returns the node reached by playing 'move' from 'node'; 'board' is the position after it."""
+        if node == OFF_TABLE:
+            # The memo is full, so there are no edges to follow or add
+            return self.lookup(board, memoize=False)
+        edge = (node << 16) | move_code(move)
+        child = self.edges.get(edge)
+        if child is None:
+            child = self.lookup(board, memoize=True)
+            if child != OFF_TABLE:
+                self.edges[edge] = child
+        return child
+
+    def lookup(self, board, memoize):
+        """Returns the node of the position on 'board', adding it to the memo if 'memoize' and it has room."""
+        key = position_key(board)
+        node = self.node_ids.get(key)
+        if node is not None:
+            return node
+        if not self.is_reachable(reach_key(board)):
+            return UNREACHABLE
+        if not memoize or len(self.names) - self.table_nodes >= MAX_MEMO_NODES:
+            return OFF_TABLE
+        node = self.node_ids[key] = len(self.names)
+        self.names.append(None)
+        return node
+
+    def is_reachable(self, key):
+        """Whether a named table position may follow a position with reach_key 'key'."""
+        reachable = self.reachable.get(key)
+        if reachable is None:
+            reachable = self.reachable[key] = any(covers(key, target) for target in self.named_keys)
+        return reachable
+
+    def tracker(self):
+        return OpeningTracker(self)
+
+    def classify(self, moves):
+        """Returns the opening name of one game."""
+        node = ROOT
+        name = UNKNOWN
+        board = None
+        for ply, move in enumerate(moves[:self.max_plies]):
+            if board is not None:
+                board.push(move)
+            child = self.edges.get((node << 16) | move_code(move)) if node != OFF_TABLE else None
+            if child is None:
+                if board is None:
+                    # Only build the position once a move's target is not known yet
+                    board = chess.Board()
+                    for played in moves[:ply + 1]:
+                        board.push(played)
+                child = self.step(node, move, board)
+            if child == UNREACHABLE:
+                break
+            node = child
+            if node != OFF_TABLE:
+                name = self.names[node] or name
+        return name
+
+    def classify_batch(self, games):
+        """Returns the opening names of many games.
+
+        Transposition checks are memoized on the classifier, so across a
+        batch each distinct position off the table is resolved once.
+        """
+        return [self.classify(moves) for moves in games]
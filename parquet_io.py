@@ -0,0 +1,113 @@
+'''
+Typed Parquet storage for the generated games dataset.
+
+Rows are written as hive-partitioned Parquet files, either by white skill
+level (white_skill=12/...) or by generation run (run=<seed>/...), so readers
+can skip whole partitions and only decode the columns they ask for.
+'''
+import os
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+SCHEMA = pa.schema([
+    ('result', pa.string()),
+    ('total_moves', pa.int16()),
+    ('opening', pa.string()),
+    ('winner', pa.string()),
+    ('white_skill', pa.int8()),
+    ('black_skill', pa.int8()),
+    ('white_castled', pa.bool_()),
+    ('black_castled', pa.bool_()),
+    ('opposite_side_castle', pa.bool_()),
+    ('white_sacrifices', pa.int16()),
+    ('black_sacrifices', pa.int16()),
+    ('w_knight_to_bishop', pa.float64()),
+    ('b_knight_to_bishop', pa.float64()),
+    ('w_center_control', pa.float64()),
+    ('b_center_control', pa.float64()),
+    ('white_piece_activity', pa.float64()),
+    ('black_piece_activity', pa.float64()),
+    ('eval_after_move_15', pa.float64()),
+])
+
+# Types of the optional columns that are not float features
+EXTRA_FIELDS = {'adjudication': pa.string()}
+
+# Hive partition keys, typed so they do not come back as dictionary columns
+PARTITION_FIELDS = {
+    'skill': pa.field('white_skill', pa.int8()),
+    'run': pa.field('run', pa.int64()),
+}
+
+
+def is_parquet_path(path):
+    return os.path.isdir(path) or path.endswith('.parquet')
+
+
+def _partitioning(partition_by):
+    return ds.partitioning(pa.schema([PARTITION_FIELDS[partition_by]]), flavor='hive')
+
+
+def write_batch(rows, root, partition_by, run, batch_name, extra_columns=()):
+    """Writes feature rows as one Parquet file per partition under 'root'.
+
+    'batch_name' names the files, so rewriting the same batch after a crash
+    replaces its files instead of duplicating the rows. The files are
+    fsynced before returning. 'extra_columns' are optional columns such as
+    the evaluation trajectory, floats unless EXTRA_FIELDS types them.
+    """
+    schema = SCHEMA
+    for name in extra_columns:
+        schema = schema.append(pa.field(name, EXTRA_FIELDS.get(name, pa.float64())))
+    table = pa.Table.from_pylist(rows, schema=schema)
+    if partition_by == 'run':
+        table = table.append_column(PARTITION_FIELDS['run'], pa.array([run] * len(rows), pa.int64()))
+    written = []
+    ds.write_dataset(table, root, format='parquet', partitioning=_partitioning(partition_by),
+                     basename_template=batch_name + '-{i}.parquet',
+                     existing_data_behavior='overwrite_or_ignore',
+                     file_visitor=lambda written_file: written.append(written_file.path))
+    for path in written:
+        with open(path, 'rb') as file:
+            os.fsync(file.fileno())
+
+
+def _detect_partitioning(root):
+    for partition_by, field in PARTITION_FIELDS.items():
+        if any(name.startswith(field.name + '=') for name in os.listdir(root)):
+            return _partitioning(partition_by)
+    return None
+
+
+def _feature_columns(path, partitioning):
+    # The generator's columns and any optional ones (e.g. the evaluation
+    # trajectory) found in the files, without the run partition key
+    names = ds.dataset(path, format='parquet', partitioning=partitioning).schema.names
+    return SCHEMA.names + [name for name in names if name not in SCHEMA.names and name != 'run']
+
+
+def read_dataset(path, columns=None, filters=None):
+    """Reads a Parquet dataset into a DataFrame.
+
+    Only 'columns' are decoded (by default the generator's feature columns),
+    and 'filters' are pushed down to skip partitions and row groups, e.g.
+    [('white_skill', '>=', 15)].
+    """
+    partitioning = _detect_partitioning(path) if os.path.isdir(path) else None
+    table = pq.read_table(path, columns=columns or _feature_columns(path, partitioning), filters=filters,
+                          partitioning=partitioning)
+    return table.to_pandas()
+
+
+def iter_batches(path, batch_size, columns=None):
+    """Yields a Parquet dataset as DataFrames of at most 'batch_size' rows, labelled like one frame."""
+    partitioning = _detect_partitioning(path) if os.path.isdir(path) else None
+    dataset = ds.dataset(path, format='parquet', partitioning=partitioning)
+    start = 0
+    for batch in dataset.to_batches(columns=columns or _feature_columns(path, partitioning), batch_size=batch_size):
+        frame = batch.to_pandas()
+        frame.index += start
+        start += len(frame)
+        yield frame
@@ -0,0 +1,251 @@
+'''
+Predicts game results with a model saved by main.py --save-model.
+
+The model and the preprocessing it was trained with are loaded once, and
+input rows are scored in microbatches of --batch-size, with the latency of
+every batch recorded. Inputs are dataset rows (a CSV or Parquet dataset in
+the generator's format) or JSON lines, each either a feature row or a game
+given as a raw move list:
+
+    {"moves": "e2e4 e7e5 g1f3 ...", "white_skill": 12, "black_skill": 12, "eval_after_move_15": 0.4}
+
+Features of move lists are computed as in extract.py, without an engine;
+a missing eval_after_move_15 counts as the training mean. --serve reads
+JSON lines from stdin and answers each with a JSON line on stdout,
+batching the lines that arrive within --max-wait milliseconds.
+
+    python predict.py models/svm.joblib dataset.csv --output predictions.csv
+    python predict.py models/svm.joblib games.jsonl --output predictions.csv
+    python predict.py models/svm.joblib --serve < games.jsonl
+'''
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import chess
+import numpy as np
+import pandas as pd
+
+from data_prep import iter_chunks
+from model_operations import load_model
+
+PERCENTILES = (50, 90, 99)
+
+
+def parse_game(game):
+    """Returns the extract.py record of a game given as a move list, checking the moves are legal."""
+    moves = game['moves'].split() if isinstance(game['moves'], str) else game['moves']
+    board = chess.Board()
+    parsed = []
+    for uci in moves:
+        move = chess.Move.from_uci(uci)
+        if move not in board.legal_moves:
+            raise ValueError(f"illegal move {uci} in {board.fen()}")
+        board.push(move)
+        parsed.append(move)
+    return {'moves': parsed, 'white_skill': game['white_skill'], 'black_skill': game['black_skill'],
+            'eval_after_move_15': game.get('eval_after_move_15')}
+
+
+def feature_row(entry):
+    """Returns the dataset row of a JSON input, computing the features of move lists."""
+    if 'moves' in entry:
+        # Only move lists need the generator's feature code
+        from extract import features_from_record
+        return features_from_record(parse_game(entry))
+    return entry
+
+
+class LatencyStats:
+    """Wall time of every microbatch scored by a Predictor."""
+
+    def __init__(self):
+        self.batch_ms = []
+        self.rows = 0
+
+    def record(self, rows, seconds):
+        self.batch_ms.append(seconds * 1000)
+        self.rows += rows
+
+    def summary(self):
+        if not self.batch_ms:
+            return {'batches': 0, 'rows': 0}
+        values = np.asarray(self.batch_ms)
+        total_seconds = values.sum() / 1000
+        summary = {'batches': len(values), 'rows': self.rows,
+                   'rows_per_sec': round(self.rows / total_seconds, 1) if total_seconds else 0.0,
+                   'row_us': round(1e6 * total_seconds / self.rows, 2)}
+        summary.update({f'p{percentile}_ms': round(float(np.percentile(values, percentile)), 3)
+                        for percentile in PERCENTILES})
+        summary['mean_ms'] = round(float(values.mean()), 3)
+        return summary
+
+
+class Predictor:
+    """A saved model and its Preprocessor, loaded once and scoring rows in microbatches."""
+
+    def __init__(self, path, batch_size=256):
+        artifact = load_model(path)
+        self.model = artifact['model']
+        self.preprocessor = artifact['preprocessor']
+        self.batch_size = batch_size
+        self.classes = [str(label) for label in self.model.classes_]
+        # An SVC trained without probability=True has no predict_proba
+        self.has_probabilities = hasattr(self.model, 'predict_proba')
+        # The first call pays for lazy imports and caches inside scikit-learn
+        # and pandas; make it here rather than on the first request
+        self.latency = LatencyStats()
+        self.predict_frame(pd.DataFrame([{}]))
+        self.latency = LatencyStats()
+
+    def predict_frame(self, rows):
+        """Returns the prediction, and the probability of every class, of each dataset row in 'rows'."""
+        outputs = []
+        for start in range(0, len(rows), self.batch_size):
+            started = time.perf_counter()
+            batch = rows.iloc[start:start + self.batch_size]
+            X = self.preprocessor.transform(batch)
+            output = pd.DataFrame({'prediction': self.model.predict(X)}, index=batch.index)
+            if self.has_probabilities:
+                probabilities = self.model.predict_proba(X)
+                for i, label in enumerate(self.classes):
+                    output[f'p_{label}'] = probabilities[:, i]
+            self.latency.record(len(batch), time.perf_counter() - started)
+            outputs.append(output)
+        if not outputs:
+            return pd.DataFrame(columns=['prediction'])
+        return pd.concat(outputs)
+
+    def predict_entries(self, entries):
+        """Predicts a list of JSON inputs (feature rows or move lists)."""
+        return self.predict_frame(pd.DataFrame([feature_row(entry) for entry in entries]))
+
+
+def read_json_lines(path, batch_size):
+    """Yields the JSON inputs of 'path' as DataFrames of dataset rows, 'batch_size' games at a time."""
+    with open(path) as file:
+        entries = []
+        for line in file:
+            if line.strip():
+                entries.append(feature_row(json.loads(line)))
+            if len(entries) == batch_size:
+                yield pd.DataFrame(entries)
+                entries = []
+        if entries:
+            yield pd.DataFrame(entries)
+
+
+def predict_file(predictor, input_path, output_path):
+    """Writes the predictions of every row of 'input_path' to a CSV, one input chunk at a time."""
+    if input_path.endswith('.jsonl') or input_path.endswith('.json'):
+        chunks = read_json_lines(input_path, predictor.batch_size)
+    else:
+        chunks = iter_chunks(input_path, chunksize=predictor.batch_size * 16)
+    rows = 0
+    with open(output_path, 'w', newline='') as file:
+        for chunk in chunks:
+            predictions = predictor.predict_frame(chunk)
+            predictions.index = range(rows, rows + len(predictions))
+            predictions.to_csv(file, header=rows == 0, index_label='row')
+            rows += len(predictions)
+    return rows
+
+
+def _read_stdin(lines):
+    for line in sys.stdin:
+        if line.strip():
+            lines.put(line)
+    lines.put(None)
+
+
+def serve(predictor, max_wait_ms):
+    """Answers JSON lines on stdin with JSON lines on stdout, in input order.
+
+    Lines arriving within 'max_wait_ms' of the first waiting one are
+    scored together, up to the predictor's batch size.
+    """
+    lines = queue.Queue()
+    threading.Thread(target=_read_stdin, args=(lines,), daemon=True).start()
+    finished = False
+    while not finished:
+        line = lines.get()
+        if line is None:
+            break
+        batch = [line]
+        deadline = time.perf_counter() + max_wait_ms / 1000
+        while len(batch) < predictor.batch_size:
+            try:
+                line = lines.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if line is None:
+                finished = True
+                break
+            batch.append(line)
+
+        # A bad line gets an error answer without failing the rest of its batch
+        answers = [None] * len(batch)
+        rows = {}
+        for i, line in enumerate(batch):
+            try:
+                rows[i] = feature_row(json.loads(line))
+            except (ValueError, KeyError, TypeError) as error:
+                answers[i] = {'error': f"{type(error).__name__}: {error}"}
+        if rows:
+            predictions = predictor.predict_frame(pd.DataFrame(list(rows.values()), index=list(rows)))
+            for i, prediction in predictions.iterrows():
+                answer = {'prediction': prediction['prediction']}
+                if predictor.has_probabilities:
+                    answer['probabilities'] = {label: round(float(prediction[f'p_{label}']), 6)
+                                               for label in predictor.classes}
+                answers[i] = answer
+        for answer in answers:
+            sys.stdout.write(json.dumps(answer) + '\n')
+        sys.stdout.flush()
+
+
+def print_latency(summary, file=sys.stdout):
+    if not summary['batches']:
+        print("No rows scored", file=file)
+        return
+    print(f"{summary['rows']} rows in {summary['batches']} batches, {summary['rows_per_sec']:.0f} rows/sec "
+          f"({summary['row_us']:.1f} us/row); batch latency "
+          + ', '.join(f"p{p} {summary[f'p{p}_ms']:.2f} ms" for p in PERCENTILES), file=file)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Predict game results with a saved model.')
+    parser.add_argument('model', help='Model saved by main.py --save-model')
+    parser.add_argument('input', nargs='?', help='Dataset CSV/Parquet, or JSON lines of feature rows or move lists')
+    parser.add_argument('--output', default='predictions.csv', help='CSV of predictions to write')
+    parser.add_argument('--batch-size', type=int, default=256, help='Rows scored per model call')
+    parser.add_argument('--serve', action='store_true', help='Answer JSON lines on stdin until it closes')
+    parser.add_argument('--max-wait', type=float, default=5.0, help='Milliseconds --serve waits to fill a batch')
+    args = parser.parse_args(argv)
+    if not args.serve and args.input is None:
+        parser.error('an input file is required unless --serve is given')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.perf_counter()
+    predictor = Predictor(args.model, args.batch_size)
+    load_ms = (time.perf_counter() - started) * 1000
+    if args.serve:
+        print(f"Loaded {os.path.basename(args.model)} in {load_ms:.0f} ms", file=sys.stderr)
+        serve(predictor, args.max_wait)
+        print_latency(predictor.latency.summary(), file=sys.stderr)
+        return
+    print(f"Loaded {os.path.basename(args.model)} in {load_ms:.0f} ms")
+    rows = predict_file(predictor, args.input, args.output)
+    print(f"Wrote {rows} predictions to {args.output}")
+    print_latency(predictor.latency.summary())
+
+
+if __name__ == '__main__':
+    main()
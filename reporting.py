@@ -0,0 +1,175 @@
+'''
+Headless evaluation reports of trained models.
+
+evaluate_models scores every model on the test set in parallel, calling
+predict and predict_proba once per model, and derives the accuracy,
+classification report, confusion matrix, ROC and precision-recall curves
+and feature importances from those. ReportRenderer draws the plots as
+PNGs with the non-interactive Agg backend on a background process pool,
+so nothing waits on a window and training can go on while they render:
+
+    assets/<model>_roc.png
+    assets/<model>_pr.png
+    assets/<model>_confusion_matrix.png
+    assets/<model>_feature_importance.png
+'''
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+RESULT_LABELS = {'1-0': 'White wins', '0-1': 'Black wins', '1/2-1/2': 'Draw'}
+
+
+def feature_importance(model, feature_names):
+    """Impurity importances of tree ensembles, mean absolute coefficients of linear models, else None."""
+    if hasattr(model, 'feature_importances_'):
+        values = model.feature_importances_
+    else:
+        try:
+            # SVC only has coef_ with a linear kernel
+            values = np.abs(np.atleast_2d(model.coef_)).mean(axis=0)
+        except AttributeError:
+            return None
+    return pd.Series(values, index=feature_names).sort_values(ascending=False)
+
+
+def evaluate(model, X_test, y_test):
+    """Returns every metric of a model's report, from one predict and one predict_proba call."""
+    # Only evaluating pays for sklearn.metrics and the scipy modules behind it
+    from sklearn.metrics import (accuracy_score, auc, average_precision_score, classification_report, confusion_matrix,
+                                 precision_recall_curve, roc_curve)
+    started = time.perf_counter()
+    predictions = model.predict(X_test)
+    predict_seconds = time.perf_counter() - started
+    # An SVC trained without probability=True has no predict_proba
+    probabilities = model.predict_proba(X_test) if hasattr(model, 'predict_proba') else None
+    classes = [str(label) for label in model.classes_]
+    y_true = np.asarray(y_test).astype(str)
+
+    metrics = {
+        'classes': classes,
+        'accuracy': accuracy_score(y_test, predictions),
+        'predict_seconds': predict_seconds,
+        'report': classification_report(y_test, predictions, zero_division=0),
+        'confusion': confusion_matrix(y_test, predictions, labels=model.classes_),
+        'roc': {},
+        'pr': {},
+        'importance': feature_importance(model, list(X_test.columns)),
+    }
+    if probabilities is not None:
+        for i, label in enumerate(classes):
+            is_label = y_true == label
+            fpr, tpr, _ = roc_curve(is_label, probabilities[:, i])
+            metrics['roc'][label] = (fpr, tpr, auc(fpr, tpr))
+            precision, recall, _ = precision_recall_curve(is_label, probabilities[:, i])
+            metrics['pr'][label] = (precision, recall, average_precision_score(is_label, probabilities[:, i]))
+    return metrics
+
+
+def evaluate_models(models, X_test, y_test, n_jobs=-1):
+    """Evaluates a {name: model} dict on one process per model and returns {name: metrics}."""
+    results = Parallel(n_jobs=n_jobs)(delayed(evaluate)(model, X_test, y_test) for model in models.values())
+    return dict(zip(models, results))
+
+
+def plot_roc(metrics, ax):
+    for label, (fpr, tpr, roc_auc) in metrics['roc'].items():
+        ax.plot(fpr, tpr, lw=2, label=f"{RESULT_LABELS.get(label, label)} (area = {roc_auc:.2f})")
+    ax.plot([0, 1], [0, 1], color='navy', lw=2, linestyle='--')
+    ax.set_xlim([0.0, 1.0])
+    ax.set_ylim([0.0, 1.05])
+    ax.set_xlabel('False Positive Rate')
+    ax.set_ylabel('True Positive Rate')
+    ax.set_title('Receiver Operating Characteristic (ROC) Curve for Multi-class')
+    ax.legend(loc='lower right')
+
+
+def plot_pr(metrics, ax):
+    for label, (precision, recall, average_precision) in metrics['pr'].items():
+        ax.plot(recall, precision, lw=2, label=f"{RESULT_LABELS.get(label, label)} (AP = {average_precision:.2f})")
+    ax.set_xlim([0.0, 1.0])
+    ax.set_ylim([0.0, 1.05])
+    ax.set_xlabel('Recall')
+    ax.set_ylabel('Precision')
+    ax.set_title('Precision-Recall Curve for Multi-class')
+    ax.legend(loc='lower left')
+
+
+def plot_confusion_matrix(metrics, ax):
+    import seaborn as sns
+    labels = [RESULT_LABELS.get(label, label) for label in metrics['classes']]
+    sns.heatmap(metrics['confusion'], annot=True, fmt='d', cmap='Blues', xticklabels=labels, yticklabels=labels, ax=ax)
+    ax.set_title('Detailed Confusion Matrix')
+    ax.set_xlabel('Predicted Label')
+    ax.set_ylabel('True Label')
+
+
+def plot_feature_importance(metrics, ax):
+    metrics['importance'].head(20)[::-1].plot(kind='barh', ax=ax, title='Feature Importance')
+    ax.set_xlabel('Importance')
+    ax.set_ylabel('Feature')
+
+
+# Plot name: (draw function, figure size, whether the metrics support it)
+PLOTS = {
+    'roc': (plot_roc, (8, 6), lambda metrics: bool(metrics['roc'])),
+    'pr': (plot_pr, (8, 6), lambda metrics: bool(metrics['pr'])),
+    'confusion_matrix': (plot_confusion_matrix, (8, 6), lambda metrics: True),
+    'feature_importance': (plot_feature_importance, (10, 6), lambda metrics: metrics['importance'] is not None),
+}
+
+
+def render_plot(name, plot, metrics, output_dir):
+    """Draws one plot of model 'name' to output_dir/<name>_<plot>.png and returns its path."""
+    # Only the processes that draw load the plotting libraries
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    draw, figsize, _ = PLOTS[plot]
+    figure, ax = plt.subplots(figsize=figsize)
+    try:
+        draw(metrics, ax)
+        figure.tight_layout()
+        path = os.path.join(output_dir, f'{name}_{plot}.png')
+        figure.savefig(path)
+    finally:
+        plt.close(figure)
+    return path
+
+
+class ReportRenderer:
+    """Renders report PNGs on background processes; close() waits for them all."""
+
+    def __init__(self, output_dir=ASSETS_DIR, workers=None):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        self.pool = ProcessPoolExecutor(workers)
+        self.futures = []
+
+    def submit(self, name, metrics):
+        """Queues every plot the metrics of model 'name' support."""
+        for plot, (_, _, supported) in PLOTS.items():
+            if supported(metrics):
+                self.futures.append(self.pool.submit(render_plot, name, plot, metrics, self.output_dir))
+
+    def close(self):
+        """Waits for the queued plots and returns their paths."""
+        try:
+            return [future.result() for future in self.futures]
+        finally:
+            self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.close()
+        else:
+            self.pool.shutdown(cancel_futures=True)
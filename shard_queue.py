@@ -0,0 +1,401 @@
+'''
+Generates one dataset on several hosts through a work queue in a shared directory.
+
+Every game derives its RNG from the run seed and its index, so a run can be
+cut into shards of consecutive games that any host plays independently.
+'plan' writes the shards into the queue, 'work' runs on every host (or as
+several local processes) and plays shards until none are left, and 'merge'
+concatenates the shard outputs in game order into the same CSV a single
+dataset_generator.py run with that seed writes.
+
+    QUEUE/plan.json                   seed, games and run config
+    QUEUE/pending/<shard>.json        shards nobody works on
+    QUEUE/claimed/<shard>.<worker>.json
+    QUEUE/done/<shard>.<worker>.json
+    QUEUE/shards/<shard>.<worker>.csv
+
+A worker claims a shard by renaming it from pending/ to claimed/ under its
+own name, which exactly one of several racing workers wins. While it plays,
+it keeps the claim's mtime fresh; a claim untouched for --lease seconds
+is renamed back to pending/ by any other worker, so the shards of a dead
+host are played again. A shard is committed by renaming its claim to
+done/ after its CSV is fsynced. That fails once the claim has been taken
+back, so every shard is committed by exactly one worker. All hosts must
+see the queue through a filesystem with atomic rename (a local disk or
+NFS), and their clocks should agree to well within the lease.
+
+    python shard_queue.py plan /shared/queue --games 100000 --seed 7 --shard-size 500
+    python shard_queue.py work /shared/queue --workers 8
+    python shard_queue.py status /shared/queue
+    python shard_queue.py merge /shared/queue --output dataset.csv
+'''
+import argparse
+import csv
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+
+from dataset_generator import (ECO_TABLE_PATH, OPENING_BOOK_PATH, SKILL_LEVELS, STOCKFISH_PATH, AdjudicationRules, add_adjudication_arguments,
+                               adjudication_config, dataset_fieldnames, generate_rows, manifest_path, parse_plies,
+                               write_manifest)
+
+QUEUE_STATES = ('pending', 'claimed', 'done', 'shards')
+
+
+def _write_json(path, data):
+    """Writes 'data' to 'path' through a fsynced temporary file and an atomic rename."""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(data, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def _shard_name(filename):
+    return filename.split('.', 1)[0]
+
+
+def plan_run(queue, games, seed, shard_size, asymmetric_skills=False, trajectory_plies=(), adjudication=None):
+    """Creates the queue directory with one pending shard per 'shard_size' games and returns the plan.
+
+    'adjudication' is the manifest entry of the run's AdjudicationRules.
+    """
+    if os.path.exists(os.path.join(queue, 'plan.json')):
+        raise FileExistsError(f"{queue} already holds a planned run")
+    for state in QUEUE_STATES:
+        os.makedirs(os.path.join(queue, state), exist_ok=True)
+    shards = [{'shard': f"shard-{index:06d}", 'start': start, 'stop': min(start + shard_size, games)}
+              for index, start in enumerate(range(0, games, shard_size))]
+    plan = {
+        'seed': seed,
+        'games': games,
+        'shards': shards,
+        # Same keys as a dataset_generator.py manifest, which merge writes for the merged CSV
+        'config': {
+            'games': games,
+            'format': 'csv',
+            'partition_by': 'skill',
+            'asymmetric_skills': asymmetric_skills,
+            'opening_book': OPENING_BOOK_PATH,
+            'eco_table': ECO_TABLE_PATH,
+            'stockfish': STOCKFISH_PATH,
+            'archive': None,
+            'trajectory_plies': list(trajectory_plies),
+            'adjudication': adjudication,
+        },
+    }
+    for shard in shards:
+        _write_json(os.path.join(queue, 'pending', shard['shard'] + '.json'), dict(shard, seed=seed))
+    # plan.json comes last: workers wait for it, so they never see a half-written queue
+    _write_json(os.path.join(queue, 'plan.json'), plan)
+    return plan
+
+
+def read_plan(queue):
+    with open(os.path.join(queue, 'plan.json')) as file:
+        return json.load(file)
+
+
+def queue_status(queue):
+    """Returns the number of shards pending, claimed and done."""
+    return {state: sum(1 for name in os.listdir(os.path.join(queue, state)) if name.endswith('.json'))
+            for state in ('pending', 'claimed', 'done')}
+
+
+def worker_name():
+    """A name unique to this process on any host, without the '.' that separates it from the shard."""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}".replace('.', '_')
+
+
+def claim_shard(queue, worker):
+    """Moves a pending shard to claimed/ under this worker's name and returns (shard, claim path), or None."""
+    pending = os.path.join(queue, 'pending')
+    for filename in sorted(os.listdir(pending)):
+        if not filename.endswith('.json'):
+            continue
+        claim = os.path.join(queue, 'claimed', f"{_shard_name(filename)}.{worker}.json")
+        try:
+            # A rename keeps the mtime, which dates from the plan; the lease
+            # starts now, so reclaim_expired never sees the claim as expired
+            os.utime(os.path.join(pending, filename))
+            os.rename(os.path.join(pending, filename), claim)
+        except FileNotFoundError:
+            # Another worker claimed it first
+            continue
+        try:
+            os.utime(claim)
+            with open(claim) as file:
+                return json.load(file), claim
+        except FileNotFoundError:
+            # Taken back from us before the lease started, e.g. after a long pause
+            continue
+    return None
+
+
+def release_claim(queue, claim):
+    """Puts a claimed shard back in pending/; False if the claim is no longer there."""
+    try:
+        os.rename(claim, os.path.join(queue, 'pending', _shard_name(os.path.basename(claim)) + '.json'))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def reclaim_expired(queue, lease):
+    """Returns the shards whose claim has not been renewed for 'lease' seconds to pending/."""
+    claimed = os.path.join(queue, 'claimed')
+    reclaimed = []
+    for filename in os.listdir(claimed):
+        path = os.path.join(claimed, filename)
+        try:
+            expired = time.time() - os.stat(path).st_mtime > lease
+        except FileNotFoundError:
+            continue
+        if expired and release_claim(queue, path):
+            reclaimed.append(_shard_name(filename))
+    return reclaimed
+
+
+class Heartbeat:
+    """Renews a claim's lease on a background thread until stopped, noting when the claim is lost."""
+
+    def __init__(self, claim, interval):
+        self.claim = claim
+        self.interval = interval
+        self.lost = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                os.utime(self.claim)
+            except FileNotFoundError:
+                self.lost.set()
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def play_shard(queue, plan, shard, worker, lease, generation):
+    """Plays a claimed shard into shards/<shard>.<worker>.csv; False if the lease was lost meanwhile.
+
+    'generation' holds the generate_rows options of this host (workers,
+    scheduler, engine mode, evaluation cache).
+    """
+    config = plan['config']
+    fieldnames = dataset_fieldnames(config)
+    output = os.path.join(queue, 'shards', f"{shard['shard']}.{worker}.csv")
+    tmp_path = output + '.tmp'
+    claim = os.path.join(queue, 'claimed', f"{shard['shard']}.{worker}.json")
+    heartbeat = Heartbeat(claim, lease / 4)
+    try:
+        with open(tmp_path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=fieldnames)
+            writer.writeheader()
+            for features, _ in generate_rows(range(shard['start'], shard['stop']), plan['seed'],
+                                             asymmetric=config['asymmetric_skills'],
+                                             trajectory_plies=config['trajectory_plies'],
+                                             adjudication=AdjudicationRules.from_dict(config.get('adjudication')), **generation):
+                if heartbeat.lost.is_set():
+                    break
+                writer.writerow(features)
+            file.flush()
+            os.fsync(file.fileno())
+    finally:
+        heartbeat.stop()
+    if heartbeat.lost.is_set():
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, output)
+    try:
+        # The commit point: only the worker still holding the claim can rename it
+        os.rename(claim, os.path.join(queue, 'done', os.path.basename(claim)))
+    except FileNotFoundError:
+        os.remove(output)
+        return False
+    return True
+
+
+def work(queue, lease=600.0, poll=5.0, max_shards=None, worker=None, **generation):
+    """Claims and plays shards until every shard of the run is done; returns the number this worker committed.
+
+    Shards of workers whose lease ran out are played again. With
+    'max_shards' the worker stops after committing that many.
+    """
+    worker = worker or worker_name()
+    while not os.path.exists(os.path.join(queue, 'plan.json')):
+        time.sleep(poll)
+    plan = read_plan(queue)
+    committed = 0
+    while max_shards is None or committed < max_shards:
+        claimed = claim_shard(queue, worker)
+        if claimed is None:
+            status = queue_status(queue)
+            if status['claimed'] == 0 and status['pending'] == 0:
+                break
+            # Wait for the other workers, taking over the shards of any that died
+            for shard_name in reclaim_expired(queue, lease):
+                print(f"{worker}: lease of {shard_name} expired, returned it to the queue")
+            if queue_status(queue)['pending'] == 0:
+                time.sleep(poll)
+            continue
+
+        shard, claim = claimed
+        started = time.perf_counter()
+        try:
+            finished = play_shard(queue, plan, shard, worker, lease, generation)
+        except BaseException:
+            # Let another worker retry it straight away rather than after the lease
+            release_claim(queue, claim)
+            raise
+        games = shard['stop'] - shard['start']
+        if finished:
+            committed += 1
+            print(f"{worker}: {shard['shard']} (games {shard['start']}-{shard['stop']}) done in "
+                  f"{time.perf_counter() - started:.1f}s, {games / (time.perf_counter() - started):.1f} games/sec")
+        else:
+            print(f"{worker}: lost the lease of {shard['shard']}, dropped its output")
+    return committed
+
+
+def count_rows(path, fieldnames):
+    """Returns the number of data rows of a shard CSV, checking its header."""
+    with open(path, newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header != fieldnames:
+            raise ValueError(f"{path}: header {header} does not match the run's columns")
+        return sum(1 for _ in reader)
+
+
+def shard_outputs(queue, plan):
+    """Returns the committed CSV of every planned shard, in game order, checking each holds all its games."""
+    done = {}
+    for filename in os.listdir(os.path.join(queue, 'done')):
+        if filename.endswith('.json'):
+            done.setdefault(_shard_name(filename), []).append(filename[:-len('.json')])
+    fieldnames = dataset_fieldnames(plan['config'])
+    outputs = []
+    missing = []
+    for shard in plan['shards']:
+        commits = done.get(shard['shard'], [])
+        if not commits:
+            missing.append(shard['shard'])
+            continue
+        if len(commits) > 1:
+            raise ValueError(f"{shard['shard']} was committed by more than one worker: {', '.join(commits)}")
+        path = os.path.join(queue, 'shards', commits[0] + '.csv')
+        rows = count_rows(path, fieldnames)
+        if rows != shard['stop'] - shard['start']:
+            raise ValueError(f"{path} has {rows} rows, expected {shard['stop'] - shard['start']}")
+        outputs.append(path)
+    if missing:
+        raise ValueError(f"{len(missing)} shards are not done yet, e.g. {missing[0]}")
+    return outputs
+
+
+def merge(queue, output):
+    """Concatenates the shard outputs into 'output' in game order, with a manifest as dataset_generator.py writes.
+
+    Nothing is written unless every shard is done and complete. Returns the
+    number of rows written.
+    """
+    plan = read_plan(queue)
+    outputs = shard_outputs(queue, plan)
+    tmp_path = output + '.tmp'
+    rows = 0
+    with open(tmp_path, 'w', newline='') as merged:
+        writer = csv.writer(merged)
+        for index, path in enumerate(outputs):
+            with open(path, newline='') as file:
+                reader = csv.reader(file)
+                header = next(reader)
+                if index == 0:
+                    writer.writerow(header)
+                for row in reader:
+                    writer.writerow(row)
+                    rows += 1
+        merged.flush()
+        os.fsync(merged.fileno())
+        size = os.fstat(merged.fileno()).st_size
+    if rows != plan['games']:
+        os.remove(tmp_path)
+        raise ValueError(f"merged {rows} rows, expected {plan['games']}")
+    os.replace(tmp_path, output)
+    # The merged CSV reads as a finished dataset_generator.py run with the plan's seed
+    write_manifest(manifest_path(output), {'seed': plan['seed'], 'committed_games': rows, 'committed_bytes': size,
+                                           'config': plan['config']})
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Generate one dataset on several hosts through a shared queue directory.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    plan = commands.add_parser('plan', help='Split a run into shards in a new queue directory')
+    plan.add_argument('queue', help='Queue directory, shared by every host')
+    plan.add_argument('--games', type=int, default=2500, help='Number of games to play')
+    plan.add_argument('--seed', type=int, required=True, help='Run seed; every game derives its own RNG from it')
+    plan.add_argument('--shard-size', type=int, default=500, help='Games per shard, the unit a worker claims')
+    plan.add_argument('--asymmetric-skills', action='store_true', help='Draw black\'s skill level independently of white\'s')
+    plan.add_argument('--trajectory-plies', type=parse_plies, default=[], help='As for dataset_generator.py')
+    add_adjudication_arguments(plan)
+
+    worker = commands.add_parser('work', help='Play shards until the run is done')
+    worker.add_argument('queue', help='Queue directory, shared by every host')
+    worker.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of Stockfish processes on this host')
+    worker.add_argument('--scheduler', choices=['pool', 'async', 'serial'], default='pool', help='As for dataset_generator.py')
+    worker.add_argument('--in-flight', type=int, default=16, help='Games kept running at once by the async scheduler')
+    worker.add_argument('--engine-mode', choices=['shared', 'pairs'], default='shared', help='As for dataset_generator.py')
+    worker.add_argument('--max-engines', type=int, default=len(SKILL_LEVELS), help='Skill-level engines kept open per worker in pairs mode')
+    worker.add_argument('--eval-cache', default=None, help='SQLite file caching engine evaluations on this host')
+    worker.add_argument('--lease', type=float, default=600.0, help='Seconds after which the claim of a silent worker expires')
+    worker.add_argument('--poll', type=float, default=5.0, help='Seconds between looks at the queue while waiting')
+    worker.add_argument('--max-shards', type=int, default=None, help='Stop after committing this many shards')
+
+    status = commands.add_parser('status', help='Count the pending, claimed and done shards')
+    status.add_argument('queue', help='Queue directory')
+
+    merge_command = commands.add_parser('merge', help='Merge the shard outputs into one CSV')
+    merge_command.add_argument('queue', help='Queue directory')
+    merge_command.add_argument('--output', default='dataset.csv', help='CSV file to write')
+
+    args = parser.parse_args(argv)
+    if args.command == 'plan' and args.shard_size < 1:
+        parser.error('--shard-size must be positive')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == 'plan':
+        plan = plan_run(args.queue, args.games, args.seed, args.shard_size, args.asymmetric_skills, args.trajectory_plies,
+                        adjudication_config(args))
+        print(f"Planned {plan['games']} games with seed {plan['seed']} as {len(plan['shards'])} shards in {args.queue}")
+    elif args.command == 'work':
+        committed = work(args.queue, args.lease, args.poll, args.max_shards, workers=args.workers, scheduler=args.scheduler,
+                         in_flight=args.in_flight, engine_mode=args.engine_mode, max_engines=args.max_engines,
+                         eval_cache_path=args.eval_cache)
+        print(f"Committed {committed} shards")
+    elif args.command == 'status':
+        status = queue_status(args.queue)
+        print(', '.join(f"{count} {state}" for state, count in status.items()))
+    else:
+        try:
+            rows = merge(args.queue, args.output)
+        except ValueError as error:
+            sys.exit(f"merge failed: {error}")
+        print(f"Merged {rows} games into {args.output}")
+
+
+if __name__ == '__main__':
+    main()
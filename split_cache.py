@@ -0,0 +1,240 @@
+'''
+Content-addressed cache of the train/test splits main.py trains on.
+
+Loading, preprocessing, splitting and oversampling the dataset gives the
+same splits on every run until the data or the pipeline changes. They are
+stored under a key hashing the dataset's bytes and everything else that
+shapes them: the pipeline (default or compact), the features, the
+preprocessor version, the scaler, the split and SMOTE seeds and the
+library versions. Any change gives a new key, so stale splits are never
+loaded. An entry is a directory of .npy arrays, memory-mapped on load,
+and the fitted Preprocessor. Once the cache outgrows its size limit, the
+least recently used entries are removed.
+
+    SPLIT_CACHE_DIR/files.json                content hashes of datasets, by path, size and mtime
+    SPLIT_CACHE_DIR/<key>/meta.json           columns and label dtype; its mtime is the last use
+    SPLIT_CACHE_DIR/<key>/<array>.npy         X_train, X_test, y_train, y_test, train_index, test_index
+    SPLIT_CACHE_DIR/<key>/preprocessor.joblib
+'''
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from importlib import metadata
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from data_prep import (DROPPED_COLUMNS, FEATURES, PREPROCESSOR_VERSION, SPLIT_SEED, TEST_SIZE, load_splits,
+                       load_splits_compact)
+
+SPLIT_CACHE_DIR = os.environ.get('SPLIT_CACHE_DIR', 'split_cache')
+# Bumped whenever the layout of an entry changes
+SPLIT_CACHE_VERSION = 1
+ARRAYS = ('X_train', 'X_test', 'y_train', 'y_test', 'train_index', 'test_index')
+# Temporary entries older than this were left by a crashed run
+STALE_SECONDS = 3600
+
+
+def _library_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def pipeline_config(compact=False):
+    """Everything besides the data that shapes the splits."""
+    from sklearn.preprocessing import StandardScaler
+    return {
+        'cache_version': SPLIT_CACHE_VERSION,
+        'pipeline': 'compact' if compact else 'default',
+        'features': FEATURES,
+        'dropped_columns': DROPPED_COLUMNS,
+        'preprocessor_version': PREPROCESSOR_VERSION,
+        'encoder': 'LabelEncoder',
+        'scaler': StandardScaler().get_params(),
+        'test_size': TEST_SIZE,
+        'split_seed': SPLIT_SEED,
+        'smote': {'random_state': SPLIT_SEED},
+        # Versions only: importing imblearn would take longer than a cache hit
+        'versions': {name: _library_version(name) for name in ('numpy', 'pandas', 'scikit-learn', 'imbalanced-learn')},
+    }
+
+
+def _read_json(path, default=None):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        if default is None:
+            raise
+        return default
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
+
+
+def _dataset_files(path):
+    """The files of a dataset, with the names that are part of its content."""
+    if os.path.isdir(path):
+        # Partition values are in the directory names of a Parquet dataset
+        return sorted((os.path.relpath(os.path.join(root, name), path), os.path.join(root, name))
+                      for root, _, names in os.walk(path) for name in names)
+    # A renamed CSV file keeps its splits
+    return [('', path)]
+
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+class SplitCache:
+    """Train/test splits of past runs in 'directory', at most 'max_bytes' of them."""
+
+    def __init__(self, directory=SPLIT_CACHE_DIR, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def dataset_digest(self, path):
+        """sha1 of a dataset's content; files are only hashed again after their size or mtime changed."""
+        files = _dataset_files(path)
+        signature = [[name, os.stat(file_path).st_size, os.stat(file_path).st_mtime_ns] for name, file_path in files]
+        memo_path = os.path.join(self.directory, 'files.json')
+        memo = _read_json(memo_path, {})
+        entry = memo.get(os.path.abspath(path))
+        if entry is not None and entry['signature'] == signature:
+            return entry['sha1']
+
+        digest = hashlib.sha1()
+        for name, file_path in files:
+            digest.update(name.encode() + b'\0')
+            with open(file_path, 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(block)
+        memo[os.path.abspath(path)] = {'signature': signature, 'sha1': digest.hexdigest()}
+        _write_json(memo_path, memo)
+        return digest.hexdigest()
+
+    def key(self, path, compact=False):
+        description = json.dumps([self.dataset_digest(path), pipeline_config(compact)], sort_keys=True)
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def get(self, key):
+        """Returns the (X_train, X_test, y_train, y_test, preprocessor) cached as 'key', or None.
+
+        The feature matrices are read-only views of memory-mapped files.
+        """
+        entry = os.path.join(self.directory, key)
+        try:
+            meta = _read_json(os.path.join(entry, 'meta.json'))
+            arrays = {name: np.load(os.path.join(entry, name + '.npy'), mmap_mode='r') for name in ARRAYS}
+            preprocessor = joblib.load(os.path.join(entry, 'preprocessor.joblib'))
+            # The mtime of meta.json is what eviction goes by
+            os.utime(os.path.join(entry, 'meta.json'))
+        except FileNotFoundError:
+            # Not cached, or evicted meanwhile
+            return None
+
+        X_train = pd.DataFrame(arrays['X_train'], columns=meta['columns'], index=pd.Index(np.asarray(arrays['train_index'])),
+                               copy=False)
+        X_test = pd.DataFrame(arrays['X_test'], columns=meta['columns'], index=pd.Index(np.asarray(arrays['test_index'])),
+                              copy=False)
+        return X_train, X_test, self._labels(arrays['y_train'], meta, X_train.index), \
+            self._labels(arrays['y_test'], meta, X_test.index), preprocessor
+
+    @staticmethod
+    def _labels(values, meta, index):
+        if meta['y_categories'] is not None:
+            values = pd.Categorical(np.asarray(values), categories=meta['y_categories'])
+            return pd.Series(values, index=index, name=meta['y_name'])
+        return pd.Series(np.asarray(values), index=index, name=meta['y_name'], dtype=meta['y_dtype'])
+
+    def put(self, key, splits):
+        """Stores the splits as 'key', then evicts down to the size limit."""
+        X_train, X_test, y_train, y_test, preprocessor = splits
+        tmp = os.path.join(self.directory, f".{key}.{uuid.uuid4().hex}.tmp")
+        os.makedirs(tmp)
+        try:
+            arrays = {
+                'X_train': X_train.to_numpy(), 'X_test': X_test.to_numpy(),
+                # Fixed-width strings, so the labels load without pickle
+                'y_train': np.asarray(y_train, dtype=str), 'y_test': np.asarray(y_test, dtype=str),
+                'train_index': X_train.index.to_numpy(), 'test_index': X_test.index.to_numpy(),
+            }
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(array), allow_pickle=False)
+            joblib.dump(preprocessor, os.path.join(tmp, 'preprocessor.joblib'))
+            categorical = isinstance(y_train.dtype, pd.CategoricalDtype)
+            _write_json(os.path.join(tmp, 'meta.json'), {
+                'columns': [str(column) for column in X_train.columns],
+                'y_name': y_train.name,
+                'y_dtype': str(y_train.dtype),
+                'y_categories': [str(label) for label in y_train.cat.categories] if categorical else None,
+                'created': time.time(),
+            })
+            try:
+                os.rename(tmp, os.path.join(self.directory, key))
+            except OSError:
+                # Another run stored the same splits first
+                pass
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """Returns (last used, bytes, key) of every entry, least recently used first."""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp') and os.path.isdir(path):
+                if time.time() - os.path.getmtime(path) > STALE_SECONDS:
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+            if not os.path.isdir(path):
+                continue
+            try:
+                entries.append((os.path.getmtime(os.path.join(path, 'meta.json')), _directory_size(path), name))
+            except FileNotFoundError:
+                continue
+        return sorted(entries)
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in max_bytes; returns their keys."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = []
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            # Runs that have the entry memory-mapped keep reading it
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+            total -= size
+            evicted.append(key)
+        return evicted
+
+    def load(self, path, compact=False, memory=None):
+        """load_splits, or load_splits_compact, of 'path' through the cache; returns (splits, whether it was a hit).
+
+        On a hit the MemoryReport 'memory' records a single 'cache' stage.
+        """
+        key = self.key(path, compact)
+        # Only a hit is a stage of its own; a miss reports the pipeline's stages
+        if memory is not None and os.path.exists(os.path.join(self.directory, key, 'meta.json')):
+            with memory.stage('cache'):
+                splits = self.get(key)
+        else:
+            splits = self.get(key)
+        if splits is not None:
+            return splits, True
+        splits = (load_splits_compact if compact else load_splits)(path, memory)
+        self.put(key, splits)
+        return splits, False
@@ -0,0 +1,140 @@
+'''
+Per-stage timing counters for generation runs.
+
+play_game and generate_game time their book lookups, engine moves,
+analyses and feature extraction on a StageTimer. RunTimings writes every
+game's counters as a JSON line and a run total when it is closed, so a
+production run can be profiled with --timings instead of edited code.
+Without a timer the stages run under NULL_TIMER, which records nothing.
+An adjudicated game also records why it ended early; when it is audited,
+saved_engine_play is the engine time of the moves that were not needed.
+'''
+import collections
+import contextlib
+import json
+import time
+
+STAGES = ('book', 'configure', 'engine_play', 'analysis', 'features', 'saved_engine_play')
+
+
+class StageTimer:
+    """Wall time and call counts per stage of one game."""
+
+    def __init__(self):
+        self.seconds = collections.Counter()
+        self.calls = collections.Counter()
+        self.plies = 0
+        self.adjudication = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - started
+            self.calls[name] += 1
+
+    def adjudicated(self, reason, result, played_result=None):
+        """Records that the game was adjudicated as 'result', and its result when played on to the end."""
+        self.adjudication = {'reason': reason, 'result': result}
+        if played_result is not None:
+            self.adjudication['played_result'] = played_result
+
+    def as_dict(self):
+        timings = {
+            'plies': self.plies,
+            'stages': {name: {'seconds': round(self.seconds[name], 6), 'calls': self.calls[name]}
+                       for name in STAGES if self.calls[name]},
+        }
+        if self.adjudication is not None:
+            timings['adjudication'] = self.adjudication
+        return timings
+
+
+class _NullTimer:
+    """Stands in for a StageTimer when timings are off and records nothing."""
+    _null_stage = contextlib.nullcontext()
+
+    def stage(self, name):
+        return self._null_stage
+
+    def adjudicated(self, reason, result, played_result=None):
+        pass
+
+    @property
+    def plies(self):
+        return 0
+
+    @plies.setter
+    def plies(self, value):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class RunTimings:
+    """Appends per-game timings as JSON lines to 'path' and totals them for the run."""
+
+    def __init__(self, path, seed):
+        self.file = open(path, 'a')
+        self.seed = seed
+        self.started = time.perf_counter()
+        self.games = 0
+        self.plies = 0
+        self.seconds = collections.Counter()
+        self.calls = collections.Counter()
+        self.adjudications = collections.Counter()
+        self.audited = 0
+        self.agreed = 0
+
+    def record(self, game_index, timings):
+        """Adds the StageTimer.as_dict() of game 'game_index'."""
+        self.games += 1
+        self.plies += timings['plies']
+        for name, stage in timings['stages'].items():
+            self.seconds[name] += stage['seconds']
+            self.calls[name] += stage['calls']
+        adjudication = timings.get('adjudication')
+        if adjudication is not None:
+            self.adjudications[adjudication['reason']] += 1
+            if 'played_result' in adjudication:
+                self.audited += 1
+                self.agreed += adjudication['played_result'] == adjudication['result']
+        self._write({'event': 'game', 'seed': self.seed, 'game_index': game_index, **timings})
+
+    def adjudication_report(self):
+        """One line on the engine time the audited adjudications saved and how often their result held."""
+        if not self.audited:
+            return "No adjudicated game was audited"
+        saved = self.seconds['saved_engine_play']
+        engine = self.seconds['engine_play'] + saved
+        return (f"Adjudication saved {saved / self.games * 1000:.1f} ms of engine time per game "
+                f"({saved / self.audited * 1000:.1f} ms per adjudicated game, {self.calls['saved_engine_play']} engine moves, "
+                f"{100 * saved / engine if engine else 0:.0f}% of the engine time); the played result agreed in "
+                f"{self.agreed} of {self.audited} games")
+
+    def close(self):
+        elapsed = time.perf_counter() - self.started
+        adjudications = {}
+        if self.adjudications:
+            adjudications = {'adjudications': {'reasons': dict(self.adjudications), 'audited': self.audited,
+                                               'agreed': self.agreed}}
+        self._write({
+            'event': 'run',
+            'seed': self.seed,
+            'games': self.games,
+            'plies': self.plies,
+            'wall_seconds': round(elapsed, 3),
+            'games_per_sec': round(self.games / elapsed, 3) if elapsed else 0,
+            'stages': {name: {'seconds': round(self.seconds[name], 3), 'calls': self.calls[name],
+                              'mean_ms': round(1000 * self.seconds[name] / self.calls[name], 4)}
+                       for name in STAGES if self.calls[name]},
+            **adjudications,
+        })
+        self.file.close()
+
+    def _write(self, event):
+        self.file.write(json.dumps(event) + '\n')
+        self.file.flush()
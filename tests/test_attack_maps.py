@@ -0,0 +1,62 @@
+'''
+The bitboard attack counts must match the per-square is_attacked_by loops
+that control_of_center and calculate_piece_activity used before them.
+'''
+import json
+import os
+import random
+
+import chess
+import pytest
+
+from attack_maps import attack_counts, game_attack_counts
+
+RECORDED_GAMES = os.path.join(os.path.dirname(__file__), '..', 'benchmarks', 'recorded_games.json')
+
+
+def reference_counts(board):
+    """(white_activity, black_activity, white_center, black_center) counted square by square."""
+    center_squares = [chess.E4, chess.D4, chess.E5, chess.D5]
+    return (sum(board.is_attacked_by(chess.WHITE, square) for square in chess.SQUARES),
+            sum(board.is_attacked_by(chess.BLACK, square) for square in chess.SQUARES),
+            sum(board.is_attacked_by(chess.WHITE, square) for square in center_squares),
+            sum(board.is_attacked_by(chess.BLACK, square) for square in center_squares))
+
+
+def recorded_games():
+    with open(RECORDED_GAMES) as file:
+        games = json.load(file)['games']
+    return [[chess.Move.from_uci(uci) for uci in game['moves']] for game in games]
+
+
+def random_games(count=50, seed=3):
+    rng = random.Random(seed)
+    games = []
+    for _ in range(count):
+        board = chess.Board()
+        while not board.is_game_over() and board.ply() < 300:
+            board.push(rng.choice(list(board.legal_moves)))
+        games.append(board.move_stack)
+    return games
+
+
+GAMES = recorded_games() + random_games()
+
+
+@pytest.mark.parametrize('moves', GAMES)
+def test_attack_counts_match_per_square_loops(moves):
+    board = chess.Board()
+    for move in moves:
+        board.push(move)
+        assert attack_counts(board) == reference_counts(board)
+
+
+@pytest.mark.parametrize('moves', GAMES)
+def test_game_attack_counts_match_per_square_loops(moves):
+    board = chess.Board()
+    expected = []
+    for move in moves:
+        board.push(move)
+        expected.append(reference_counts(board))
+    counts = game_attack_counts(moves)
+    assert [tuple(int(values[ply]) for values in counts) for ply in range(len(moves))] == expected
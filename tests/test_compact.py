@@ -0,0 +1,31 @@
+'''
+load_splits_compact must give the splits load_splits gives, in float32,
+also when rows have to be dropped for missing values.
+'''
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_prep import load_splits, load_splits_compact
+
+DATASET = os.path.join(os.path.dirname(__file__), '..', 'dataset', 'chess_games_dataset_2500.csv')
+
+
+def test_compact_splits_match_default(tmp_path):
+    path = str(tmp_path / 'games.csv')
+    df = pd.read_csv(DATASET)
+    # A missing float, integer and winner, each in a different chunk of rows
+    df.loc[5, 'eval_after_move_15'] = np.nan
+    df.loc[1200, 'white_skill'] = np.nan
+    df.loc[2100, 'winner'] = np.nan
+    df.to_csv(path, index=False)
+
+    X_train, X_test, y_train, y_test, preprocessor = load_splits(path)
+    compact = load_splits_compact(path)
+    assert compact[4].columns == preprocessor.columns
+    np.testing.assert_allclose(compact[0].to_numpy(dtype=float), X_train.to_numpy(dtype=float), atol=1e-5)
+    np.testing.assert_allclose(compact[1].to_numpy(dtype=float), X_test.to_numpy(dtype=float), atol=1e-5)
+    assert list(compact[1].index) == list(X_test.index)
+    assert list(compact[2]) == list(y_train)
+    assert list(compact[3]) == list(y_test)
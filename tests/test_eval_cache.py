@@ -0,0 +1,39 @@
+'''
+Only scores the engine actually reported may reach the persistent
+evaluation cache.
+'''
+import chess
+import chess.engine
+
+from dataset_generator import get_evaluation_score
+from eval_cache import EvalCache
+
+
+class ScriptedAnalysis:
+    """Answers analyse() with the given results in turn."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def analyse(self, board, limit):
+        self.calls += 1
+        return self.results.pop(0)
+
+
+def test_unreadable_score_is_not_cached(tmp_path):
+    board = chess.Board()
+    board.push_uci('e2e4')
+    score = chess.engine.PovScore(chess.engine.Cp(35), chess.WHITE)
+    engine = ScriptedAnalysis({}, {'score': score})
+    cache = EvalCache(str(tmp_path / 'evals.sqlite'))
+    try:
+        # An answer without a score counts as 0 for this game only
+        assert get_evaluation_score(board, engine, 12, cache) == 0
+        assert cache.get(board, 12) is None
+
+        assert get_evaluation_score(board, engine, 12, cache) == 0.35
+        assert get_evaluation_score(board, engine, 12, cache) == 0.35
+        assert engine.calls == 2
+    finally:
+        cache.close()
@@ -0,0 +1,75 @@
+'''
+OpeningClassifier and its tracker must name games like a plain lookup of
+every position up to the longest table line, however the memo and the
+reachability pruning cut that walk short.
+'''
+import random
+
+import chess
+import pytest
+
+import openings
+from dataset_generator import openings_tree
+from openings import UNKNOWN, OpeningClassifier, position_key, tree_lines
+
+LINES = list(tree_lines(openings_tree))
+
+
+def reference_names(lines):
+    """Named positions by position_key; the first line naming a position wins."""
+    names = {}
+    for name, moves in lines:
+        board = chess.Board()
+        for move in moves:
+            board.push(move)
+        names.setdefault(position_key(board), name)
+    return names
+
+
+def reference_classify(names, max_plies, moves):
+    board = chess.Board()
+    name = UNKNOWN
+    for move in moves[:max_plies]:
+        board.push(move)
+        name = names.get(position_key(board), name)
+    return name
+
+
+def games(count=300, seed=4):
+    """Games that follow part of a table line, then random moves."""
+    rng = random.Random(seed)
+    games = []
+    for _ in range(count):
+        board = chess.Board()
+        _, line = rng.choice(LINES)
+        for move in line[:rng.randint(0, len(line))]:
+            board.push(move)
+        while not board.is_game_over() and board.ply() < 30:
+            board.push(rng.choice(list(board.legal_moves)))
+        games.append(board.move_stack)
+    return games
+
+
+@pytest.mark.parametrize('memo_nodes', [openings.MAX_MEMO_NODES, 20, 0])
+def test_names_match_position_lookup(monkeypatch, memo_nodes):
+    monkeypatch.setattr(openings, 'MAX_MEMO_NODES', memo_nodes)
+    classifier = OpeningClassifier(LINES)
+    names = reference_names(LINES)
+    for moves in games():
+        expected = reference_classify(names, classifier.max_plies, moves)
+        # Twice, the second time through the memo
+        assert classifier.classify(moves) == expected
+        assert classifier.classify(moves) == expected
+        tracker = classifier.tracker()
+        board = chess.Board()
+        for move in moves:
+            board.push(move)
+            tracker.push(board)
+        assert tracker.name == expected
+
+
+def test_transposition_through_positions_off_the_table():
+    ruy_lopez = [chess.Move.from_uci(uci) for uci in ('e2e4', 'e7e5', 'g1f3', 'b8c6', 'f1b5')]
+    classifier = OpeningClassifier([("Ruy Lopez", tuple(ruy_lopez))])
+    transposed = [chess.Move.from_uci(uci) for uci in ('g1f3', 'b8c6', 'e2e4', 'e7e5', 'f1b5')]
+    assert classifier.classify(transposed) == "Ruy Lopez"
@@ -0,0 +1,59 @@
+'''
+A run killed after a checkpoint, with a torn row after its last committed
+byte, must resume into the CSV an uninterrupted run writes.
+'''
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GAMES = 20
+SEED = 9
+
+
+def read_bytes(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def committed_games(output):
+    try:
+        with open(f"{output}.manifest.json") as file:
+            return json.load(file)['committed_games']
+    except (FileNotFoundError, json.JSONDecodeError):
+        return 0
+
+
+def test_resume_after_kill_matches_uninterrupted_run(tmp_path, engine_env, run_script):
+    expected = tmp_path / 'direct.csv'
+    run_script('dataset_generator.py', '--games', GAMES, '--seed', SEED, '--workers', 1, '--output', expected)
+
+    output = tmp_path / 'resumed.csv'
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'dataset_generator.py'), '--games', str(GAMES),
+                                '--seed', str(SEED), '--workers', '1', '--batch-size', '4', '--output', str(output)],
+                               env=engine_env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 120
+        while committed_games(output) < 4:
+            assert process.poll() is None and time.monotonic() < deadline, "the run never committed a batch"
+            time.sleep(0.02)
+        os.kill(process.pid, signal.SIGKILL)
+        process.wait()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    committed = committed_games(output)
+    assert committed < GAMES, "the run finished before it could be interrupted"
+
+    # A row cut off halfway through its write, past the committed bytes
+    with open(output, 'ab') as file:
+        file.write(b'1-0,61,Larsen')
+
+    run_script('dataset_generator.py', '--resume', '--output', output)
+    assert committed_games(output) == GAMES
+    assert read_bytes(output) == read_bytes(expected)
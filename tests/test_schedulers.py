@@ -0,0 +1,21 @@
+'''
+The pool, async and serial schedulers play the same games for a seed, so
+they must write the same CSV; fake_uci_engine.py stands in for Stockfish.
+'''
+
+
+def read_bytes(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def test_schedulers_write_identical_csvs(tmp_path, run_script):
+    outputs = {}
+    for scheduler, workers in (('serial', 1), ('pool', 2), ('async', 2)):
+        output = tmp_path / f"{scheduler}.csv"
+        run_script('dataset_generator.py', '--games', 12, '--seed', 9, '--scheduler', scheduler, '--workers', workers,
+                   '--output', output)
+        outputs[scheduler] = read_bytes(output)
+    assert outputs['serial'].count(b'\n') == 13
+    assert outputs['pool'] == outputs['serial']
+    assert outputs['async'] == outputs['serial']
@@ -0,0 +1,58 @@
+'''
+Several local `shard_queue.py work` processes, one of them killed halfway
+through a shard, must merge into the CSV a single dataset_generator.py run
+with the same seed writes.
+'''
+import os
+import signal
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GAMES = 24
+SEED = 9
+
+
+def read_bytes(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def claimed_by(queue, pid):
+    """The claims held by the worker process 'pid'; worker names carry the pid."""
+    return [name for name in os.listdir(os.path.join(queue, 'claimed')) if f"-{pid}-" in name]
+
+
+def test_killed_worker_merges_like_a_single_run(tmp_path, engine_env, run_script):
+    expected = tmp_path / 'direct.csv'
+    run_script('dataset_generator.py', '--games', GAMES, '--seed', SEED, '--workers', 1, '--output', expected)
+
+    queue = str(tmp_path / 'queue')
+    run_script('shard_queue.py', 'plan', queue, '--games', GAMES, '--seed', SEED, '--shard-size', 4)
+    workers = [subprocess.Popen([sys.executable, os.path.join(ROOT, 'shard_queue.py'), 'work', queue, '--workers', '1',
+                                 '--lease', '2', '--poll', '0.2'],
+                                env=engine_env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+               for _ in range(3)]
+    try:
+        victim = workers[0]
+        deadline = time.monotonic() + 60
+        while not claimed_by(queue, victim.pid):
+            assert victim.poll() is None and time.monotonic() < deadline, "the worker never claimed a shard"
+            time.sleep(0.05)
+        # Mid-shard: its claim stays in claimed/ until the others take it over
+        os.kill(victim.pid, signal.SIGKILL)
+        victim.wait()
+        for worker in workers[1:]:
+            assert worker.wait(timeout=300) == 0
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.kill()
+                worker.wait()
+
+    assert not claimed_by(queue, victim.pid)
+    merged = tmp_path / 'merged.csv'
+    run_script('shard_queue.py', 'merge', queue, '--output', merged)
+    assert read_bytes(merged) == read_bytes(expected)
@@ -0,0 +1,40 @@
+'''
+StreamingPreprocessor must prepare rows like preprocess_data, also for
+datasets written before an optional feature column existed.
+'''
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_prep import StreamingPreprocessor, iter_chunks, load_data, preprocess_data
+
+DATASET = os.path.join(os.path.dirname(__file__), '..', 'dataset', 'chess_games_dataset_2500.csv')
+
+
+def stream(path, chunksize):
+    preprocessor = StreamingPreprocessor()
+    for chunk in iter_chunks(path, chunksize):
+        preprocessor.partial_fit(chunk)
+    preprocessor.finish()
+    parts = [preprocessor.transform(chunk) for chunk in iter_chunks(path, chunksize)]
+    return preprocessor, pd.concat([X for X, _ in parts]), pd.concat([y for _, y in parts])
+
+
+def test_stream_without_optional_feature(tmp_path):
+    path = str(tmp_path / 'games.csv')
+    pd.read_csv(DATASET).drop(columns=['opposite_side_castle']).to_csv(path, index=False)
+
+    preprocessor, X, y = stream(path, chunksize=700)
+    assert 'opposite_side_castle' not in X.columns
+    assert 'opposite_side_castle' not in preprocessor.features
+
+    # Same encoding and scaling as preprocess_data on the whole file
+    expected = preprocess_data(load_data(path))
+    np.testing.assert_allclose(X.to_numpy(dtype=float), expected.drop(columns=['result']).to_numpy(dtype=float), atol=1e-9)
+    assert list(y) == list(expected['result'])
+
+    # The saved Preprocessor prepares new rows the same way
+    rows = pd.read_csv(path, nrows=50).dropna()
+    np.testing.assert_allclose(preprocessor.preprocessor().transform(rows).to_numpy(),
+                               X.loc[rows.index].to_numpy(dtype=float), atol=1e-9)
@@ -0,0 +1,160 @@
+'''
+Parallel successive-halving hyperparameter search with cached fold scores.
+
+Every candidate is first cross-validated on a small sample of the training
+rows; only the best 1/factor of them move on to a sample 'factor' times
+larger, until the last round uses all rows. Fold fits run on a joblib
+process pool, and each fold score is stored in a SQLite file keyed by a
+hash of the dataset and the full estimator parameters, so tuning the same
+data again only fits configurations that were not tried before.
+'''
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+TUNING_CACHE_PATH = os.environ.get('TUNING_CACHE_PATH', 'tuning_cache.sqlite')
+
+
+def dataset_fingerprint(X, y):
+    """Hash of the training rows, their columns and labels."""
+    digest = hashlib.sha1()
+    digest.update(json.dumps([str(column) for column in X.columns]).encode())
+    digest.update(pd.util.hash_pandas_object(X, index=False).to_numpy().tobytes())
+    digest.update(pd.util.hash_pandas_object(pd.Series(np.asarray(y)), index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class FoldCache:
+    """Cross-validation fold scores of past searches, in a SQLite file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS folds (
+                dataset TEXT NOT NULL,
+                key TEXT NOT NULL,
+                score REAL,
+                fit_seconds REAL NOT NULL,
+                PRIMARY KEY (dataset, key)
+            )''')
+        self.connection.commit()
+
+    def get(self, dataset, key):
+        """Returns the cached (score, fit_seconds) of a fold, or None."""
+        return self.connection.execute('SELECT score, fit_seconds FROM folds WHERE dataset = ? AND key = ?',
+                                       (dataset, key)).fetchone()
+
+    def put_many(self, dataset, entries):
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO folds VALUES (?, ?, ?, ?)',
+                                        [(dataset, key, score, seconds) for key, (score, seconds) in entries.items()])
+
+    def close(self):
+        self.connection.close()
+
+
+def _fold_key(estimator, resource, cv, random_state, fold):
+    params = {name: repr(value) for name, value in sorted(estimator.get_params().items())}
+    description = json.dumps([type(estimator).__name__, params, resource, cv, random_state, fold])
+    return hashlib.sha1(description.encode()).hexdigest()
+
+
+def _fit_and_score(estimator, X, y, train, test):
+    started = time.perf_counter()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            estimator.fit(X.iloc[train], y.iloc[train])
+            score = estimator.score(X.iloc[test], y.iloc[test])
+    except Exception as error:
+        # Same as GridSearchCV's error_score=nan: a failing configuration loses
+        warnings.warn(f"{estimator} failed: {error}")
+        score = float('nan')
+    return score, time.perf_counter() - started
+
+
+def halving_search(estimator, param_grid, X, y, cv=5, factor=3, n_jobs=-1, cache_path=TUNING_CACHE_PATH,
+                   random_state=11, refit_params=None):
+    """Searches 'param_grid' by successive halving and returns the refitted best estimator.
+
+    The estimator is refitted on all of X with the best parameters plus
+    'refit_params' (e.g. probability=True for an SVC that was tuned
+    without it). The search history is kept on the returned estimator as
+    'tuning_results_'.
+    """
+    # Only a search pays for importing scikit-learn
+    from sklearn.base import clone
+    from sklearn.model_selection import ParameterGrid, StratifiedKFold
+    X = X.reset_index(drop=True)
+    y = pd.Series(np.asarray(y))
+    candidates = list(ParameterGrid(param_grid))
+    # The last round, on all rows, is the one that leaves a single candidate;
+    # a round with one candidate left would decide nothing
+    counts = [len(candidates)]
+    while math.ceil(counts[-1] / factor) > 1:
+        counts.append(math.ceil(counts[-1] / factor))
+    rounds = len(counts) - 1
+    # Each fold needs a few rows of every class
+    min_resource = cv * y.nunique() * 4
+    resource = max(len(X) // factor ** rounds, min_resource)
+    order = np.random.RandomState(random_state).permutation(len(X))
+
+    dataset = dataset_fingerprint(X, y)
+    cache = FoldCache(cache_path) if cache_path else None
+    results = []
+    try:
+        for round_index in range(rounds + 1 if len(candidates) > 1 else 0):
+            resource = len(X) if round_index == rounds else min(resource, len(X))
+            sample = np.sort(order[:resource])
+            folds = list(StratifiedKFold(cv, shuffle=True, random_state=random_state).split(sample, y.iloc[sample]))
+
+            scores = {}
+            jobs = {}
+            for candidate_index, params in enumerate(candidates):
+                candidate = clone(estimator).set_params(**params)
+                for fold, (train, test) in enumerate(folds):
+                    key = _fold_key(candidate, resource, cv, random_state, fold)
+                    cached = cache.get(dataset, key) if cache is not None else None
+                    if cached is not None:
+                        scores[candidate_index, fold] = cached
+                    else:
+                        jobs[key] = (candidate_index, fold, candidate, sample[train], sample[test])
+
+            computed = Parallel(n_jobs=n_jobs)(delayed(_fit_and_score)(candidate, X, y, train, test)
+                                               for _, _, candidate, train, test in jobs.values())
+            for (key, (candidate_index, fold, _, _, _)), outcome in zip(jobs.items(), computed):
+                scores[candidate_index, fold] = outcome
+            if cache is not None and jobs:
+                cache.put_many(dataset, dict(zip(jobs, computed)))
+
+            ranked = []
+            for candidate_index, params in enumerate(candidates):
+                fold_scores = np.array([scores[candidate_index, fold][0] for fold in range(cv)], dtype=float)
+                mean_score = float(fold_scores.mean()) if not np.isnan(fold_scores).any() else float('nan')
+                results.append({'round': round_index, 'resource': resource, 'params': params, 'mean_score': mean_score})
+                ranked.append((-np.inf if np.isnan(mean_score) else mean_score, candidate_index))
+            print(f"round {round_index}: {len(candidates)} candidates on {resource} rows, "
+                  f"{len(jobs)} folds fitted, {len(candidates) * cv - len(jobs)} from cache")
+
+            ranked.sort(key=lambda entry: entry[0], reverse=True)
+            candidates = [candidates[index] for _, index in ranked[:max(1, math.ceil(len(candidates) / factor))]]
+            resource *= factor
+    finally:
+        if cache is not None:
+            cache.close()
+
+    best = clone(estimator).set_params(**candidates[0], **(refit_params or {}))
+    best.fit(X, y)
+    best.tuning_results_ = results
+    best.best_params_ = candidates[0]
+    return best